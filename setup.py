@@ -23,7 +23,13 @@ dev_requirements = (
     'pytest-cov==2.7.1',
     'pytest-pythonpath==0.7.3',
     'tox==3.13.2',
-    'tox-pyenv==1.1.0'
+    'tox-pyenv==1.1.0',
+    'boto3',
+    'moto[server]'
+)
+
+s3_requirements = (
+    'boto3',
 )
 
 setup(
@@ -50,7 +56,8 @@ setup(
     license='GPLv3',
     install_requires=requirements,
     extras_require={
-        'dev': dev_requirements
+        'dev': dev_requirements,
+        's3': s3_requirements
     },
     packages=find_packages('src'),
     package_dir={'': 'src'},
@@ -12,13 +12,16 @@
 import importlib
 import os
 
+import click
 from flask import Flask, jsonify
 from flask_pymongo import PyMongo
 from werkzeug.exceptions import HTTPException, default_exceptions
 
 from . import settings
+from .lib.cache import LRUCache
 from .lib.logging import configure_logging
-from .lib.storage import get_media_storage
+from .lib.storage import CachedStorage, get_media_storage
+from .lib.upload import Request
 from .celery_app import init_celery
 from flask_cors import CORS
 
@@ -38,6 +41,7 @@ def get_app(config=None):
     :return: a new SuperdeskEve app instance
     """
     app = Flask(__name__)
+    app.request_class = Request
 
     if config is None:
         config = {}
@@ -52,7 +56,19 @@ def get_app(config=None):
 
     #: init storage
     media_storage = get_media_storage(app.config.get('MEDIA_STORAGE'))
+    if app.config.get('STORAGE_CACHE_ENABLED'):
+        media_storage = CachedStorage(media_storage)
     app.fs = media_storage
+    #: in-memory cache of small media files (thumbnails)
+    app.media_cache = LRUCache(app.config.get('MEDIA_CACHE_SIZE'), app.config.get('MEDIA_CACHE_MAX_ITEM_SIZE'))
+
+    @app.cli.command('rebalance-storage')
+    def rebalance_storage():
+        """Move files to their shards after storage roots were changed."""
+        storage = getattr(app.fs, 'storage', app.fs)
+        if not hasattr(storage, 'rebalance'):
+            raise click.UsageError(f"Media storage '{app.config.get('MEDIA_STORAGE')}' does not support rebalancing.")
+        click.echo(f'Moved {storage.rebalance()} projects.')
 
     installed = set()
 
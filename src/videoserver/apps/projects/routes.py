@@ -1,12 +1,15 @@
 import copy
 import logging
+import mimetypes
 import os
 import re
+import uuid
 from datetime import datetime
+from time import time
 
 import bson
 from flask import current_app as app
-from flask import request
+from flask import request, url_for
 from pymongo import ReturnDocument
 from pymongo.errors import ServerSelectionTimeoutError
 from werkzeug.exceptions import BadRequest, Conflict, InternalServerError, NotFound
@@ -14,12 +17,15 @@ from werkzeug.exceptions import BadRequest, Conflict, InternalServerError, NotFo
 from videoserver.lib.video_editor import get_video_editor
 from videoserver.lib.views import MethodView
 from videoserver.lib.utils import (
-    add_urls, create_file_name, get_request_address, json_response, paginate, save_activity_log, storage2response,
-    validate_document
+    add_urls, cached_storage2response, create_file_name, get_request_address, iter_chunks, json_response, paginate,
+    save_activity_log, storage2response, validate_document
 )
 
 from . import bp
-from .tasks import edit_video, generate_preview_thumbnail, generate_timeline_thumbnails
+from .tasks import (
+    delete_later, edit_video, generate_keyframe_index, generate_preview_thumbnail, generate_timeline_thumbnails,
+    get_keyframe_index_storage_id, get_timeline_pack_filename, join_upload, load_keyframe_index, open_video
+)
 
 logger = logging.getLogger(__name__)
 
@@ -103,6 +109,10 @@ class ListUploadProject(MethodView):
                   original_filename:
                     type: string
                     example: video.mp4
+                  checksum:
+                    type: string
+                    description: sha256 of originally uploaded file
+                    example: 9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08
                   request_address:
                     type: string
                     example: 127.0.0.1
@@ -136,27 +146,73 @@ class ListUploadProject(MethodView):
         """
 
         # validate request
+        # reject an upload with unsupported codec before it's received completely
+        request.upload_codecs = app.config.get('CODEC_SUPPORT_VIDEO')
         if 'file' not in request.files:
             # to avoid TypeError: cannot serialize '_io.BufferedRandom' error
             raise BadRequest({"file": ["required field"]})
         document = validate_document(request.files, self.SCHEMA_UPLOAD)
 
         # validate codec
-        file_stream = document['file'].stream.read()
-        metadata = get_video_editor().get_meta(file_stream)
+        # file was received into a tmp file (see `videoserver.lib.upload`), it's probed in place
+        file_stream = document['file'].stream
+        file_stream.flush()
+        metadata = get_video_editor().get_meta(file_stream.path)
         if metadata.get('codec_name') not in app.config.get('CODEC_SUPPORT_VIDEO'):
             raise BadRequest({'file': [f"Codec: '{metadata.get('codec_name')}' is not supported."]})
 
         # add record to database
-        project = {
-            '_id': bson.ObjectId(),
-            'filename': create_file_name(ext=document['file'].filename.rsplit('.')[-1]),
+        project = self._new_project(
+            project_id=bson.ObjectId(),
+            filename=create_file_name(ext=document['file'].filename.rsplit('.')[-1]),
+            metadata=metadata,
+            mime_type=document['file'].mimetype,
+            original_filename=document['file'].filename,
+            checksum=file_stream.checksum
+        )
+
+        # move received file into storage
+        storage_id = app.fs.put_from_path(
+            file_path=file_stream.path,
+            filename=project['filename'],
+            project_id=project['_id'],
+            content_type=document['file'].mimetype
+        )
+        # set 'storage_id' for project
+        project['storage_id'] = storage_id
+
+        return self._save_project(project)
+
+    @staticmethod
+    def _new_project(project_id, filename, metadata, mime_type, original_filename, checksum):
+        """
+        Build a document of a new project
+        :param project_id: unique project id
+        :type project_id: bson.objectid.ObjectId
+        :param filename: name of a file in a storage
+        :type filename: str
+        :param metadata: video metadata
+        :type metadata: dict
+        :param mime_type: video mimetype
+        :type mime_type: str
+        :param original_filename: uploaded file name
+        :type original_filename: str
+        :param checksum: sha256 hex digest of originally uploaded file
+        :type checksum: str
+        :return: project
+        :rtype: dict
+        """
+
+        return {
+            '_id': project_id,
+            'filename': filename,
             'storage_id': None,
             'metadata': metadata,
             'create_time': datetime.utcnow(),
-            'mime_type': document['file'].mimetype,
+            'mime_type': mime_type,
             'request_address': get_request_address(request.headers.environ),
-            'original_filename': document['file'].filename,
+            'original_filename': original_filename,
+            'checksum': checksum,
             'version': 1,
             'parent': None,
             'processing': {
@@ -170,26 +226,30 @@ class ListUploadProject(MethodView):
             }
         }
 
-        # put file stream into storage
-        storage_id = app.fs.put(
-            content=file_stream,
-            filename=project['filename'],
-            project_id=project['_id'],
-            content_type=document['file'].mimetype
-        )
-        # set 'storage_id' for project
-        project['storage_id'] = storage_id
+    @staticmethod
+    def _save_project(project):
+        """
+        Save a new project which video is already in a storage or is being saved (`processing.video` is set)
+        :param project: project
+        :type project: dict
+        :return: json response
+        :rtype: flask.wrappers.Response
+        """
 
         try:
             # save project
             app.mongo.db.projects.insert_one(project)
         except ServerSelectionTimeoutError as e:
             # delete project dir
-            app.fs.delete_dir(storage_id)
+            if not project['processing']['video']:
+                delete_later(project['storage_id'], directory=True)
             raise InternalServerError(str(e))
 
         logger.info(f"New project was created. ID: {project['_id']}")
         save_activity_log('UPLOAD', project['_id'], project)
+        # index of a video which is being saved is built afterwards
+        if not project['processing']['video']:
+            generate_keyframe_index.delay(project)
         add_urls(project)
 
         return json_response(project, status=201)
@@ -343,6 +403,17 @@ class RetrieveEditDestroyProject(MethodView):
                 'min_trim_start': 0,
                 'min_trim_end': 1
             },
+            'trim_mode': {
+                'type': 'string',
+                'required': False,
+                'allowed': ['encode', 'copy', 'smart'],
+                'dependencies': ['trim'],
+            },
+            'encoder_profile': {
+                'type': 'string',
+                'required': False,
+                'allowed': list(app.config.get('FFMPEG_ENCODER_PROFILES')),
+            },
             'rotate': {
                 'type': 'integer',
                 'required': False,
@@ -490,16 +561,36 @@ class RetrieveEditDestroyProject(MethodView):
               trim:
                 type: string
                 example: 5.1,10.5
+              trim_mode:
+                type: string
+                enum: [encode, copy, smart]
+                description: "`encode` (default) cuts exactly and re-encodes a video. `copy` copies streams
+                              without re-encoding, it's much faster, but `trim` is widened to keyframes,
+                              adjusted `trim` is returned if keyframes are known and saved in `metadata.trim`.
+                              `smart` cuts exactly, but re-encodes only frames between cut points and nearest
+                              keyframes, it falls back to `encode` for videos other than constant frame rate H.264.
+                              Only `trim` and `rotate` are allowed with `copy`, only `trim` with `smart`.
+                              `rotate` is allowed with `copy` only for mp4, mov, m4v and 3gp videos."
+                example: copy
               crop:
                 type: string
                 example: 480,360,10,10
               rotate:
                 type: integer
                 enum: [-270, -180, -90, 90, 180, 270]
+                description: "Clockwise. An mp4 or mov video is rotated by its display matrix without re-encoding
+                              unless other rules require it."
                 example: 90
               scale:
                 type: integer
                 example: 800
+              encoder_profile:
+                type: string
+                enum: [fast, balanced, archival]
+                description: "Speed of encoding versus size of a file, a codec of a video is kept.
+                              `balanced` is used by default. Not allowed with `copy` and `smart` trim modes,
+                              a video which is only rotated is not re-encoded."
+                example: fast
         responses:
           202:
             description: Editing started
@@ -509,6 +600,10 @@ class RetrieveEditDestroyProject(MethodView):
                 processing:
                   type: boolean
                   example: True
+                trim:
+                  type: object
+                  description: Trim widened to keyframes, if `trim_mode` is `copy`
+                  example: {"start": 4.0, "end": 12.0}
           409:
             description: Previous editing was not finished yet
             schema:
@@ -532,11 +627,22 @@ class RetrieveEditDestroyProject(MethodView):
             self.schema_edit
         )
 
-        if not document:
+        if not document.keys() - {'encoder_profile'}:
             raise BadRequest({
                 'edit': [f"At least one of the edit rules is required. "
                          f"Available edit rules are: {', '.join(self.schema_edit.keys())}"]
             })
+        # rules which don't require re-encoding of a whole video
+        copy_rules = {'copy': {'trim', 'trim_mode', 'rotate'}, 'smart': {'trim', 'trim_mode'}}
+        if document.get('trim_mode') in copy_rules and document.keys() - copy_rules[document['trim_mode']]:
+            raise BadRequest({
+                "trim_mode": [f"'{document['trim_mode']}' trim mode can't be combined with other edit rules"]
+            })
+        # video in other containers is rotated by re-encoding, so it can't be trimmed by copying
+        if document.get('trim_mode') == 'copy' and 'rotate' in document \
+                and self.project['filename'].rsplit('.', 1)[-1].lower() \
+                not in get_video_editor().DISPLAY_MATRIX_EXTENSIONS:
+            raise BadRequest({"trim_mode": ["'copy' trim mode can't be combined with rotate for this video format"]})
 
         metadata = self.project['metadata']
 
@@ -592,13 +698,20 @@ class RetrieveEditDestroyProject(MethodView):
         logger.info(f"New project editing task was started. ID: {self.project['_id']}")
         save_activity_log("EDIT", self.project['_id'], document)
 
+        response = {"processing": True}
+        if document.get('trim_mode') == 'copy':
+            keyframes = load_keyframe_index(self.project)
+            if keyframes:
+                start, end = keyframes.snap(document['trim']['start'], document['trim']['end'])
+                response['trim'] = {'start': start, 'end': end}
+
         # run task
         edit_video.delay(
             self.project,
             changes=document
         )
 
-        return json_response({"processing": True}, status=202)
+        return json_response(response, status=202)
 
     def delete(self, project_id):
         """
@@ -615,8 +728,8 @@ class RetrieveEditDestroyProject(MethodView):
             description: NO CONTENT
         """
 
-        # remove project dir from storage
-        app.fs.delete_dir(self.project['storage_id'])
+        # remove project dir from storage by a background task
+        delete_later(self.project['storage_id'], directory=True)
         logger.info(f"Project was deleted. ID: {self.project['_id']}")
         save_activity_log("DELETE", self.project['_id'])
         app.mongo.db.projects.delete_one({'_id': self.project['_id']})
@@ -753,13 +866,12 @@ class DuplicateProject(MethodView):
         }
         app.mongo.db.projects.insert_one(child_project)
 
-        # put a video file stream into storage
+        # copy a video file inside storage
         try:
-            storage_id = app.fs.put(
-                content=app.fs.get(self.project['storage_id']),
+            storage_id = app.fs.copy(
+                self.project['storage_id'],
                 filename=child_project['filename'],
-                project_id=child_project['_id'],
-                content_type=child_project['mime_type']
+                project_id=child_project['_id']
             )
         except Exception as e:
             # remove record from db
@@ -774,15 +886,26 @@ class DuplicateProject(MethodView):
                 return_document=ReturnDocument.AFTER
             )
 
+            # copy keyframe index, or build it if it's not built for a parent yet
+            try:
+                app.fs.copy(
+                    get_keyframe_index_storage_id(self.project),
+                    filename=os.path.basename(get_keyframe_index_storage_id(child_project)),
+                    project_id=None,
+                    asset_type='keyframes',
+                    storage_id=child_project['storage_id']
+                )
+            except Exception:
+                generate_keyframe_index.delay(child_project)
+
             # save preview thumbnail
             if self.project['thumbnails']['preview']:
-                storage_id = app.fs.put(
-                    content=app.fs.get(self.project['thumbnails']['preview']['storage_id']),
+                storage_id = app.fs.copy(
+                    self.project['thumbnails']['preview']['storage_id'],
                     filename=self.project['thumbnails']['preview']['filename'],
                     project_id=None,
                     asset_type='thumbnails',
-                    storage_id=child_project['storage_id'],
-                    content_type=self.project['thumbnails']['preview']['mimetype']
+                    storage_id=child_project['storage_id']
                 )
                 child_project['thumbnails']['preview'] = self.project['thumbnails']['preview']
                 child_project['thumbnails']['preview']['storage_id'] = storage_id
@@ -797,23 +920,33 @@ class DuplicateProject(MethodView):
 
             # save timeline thumbnails
             timeline_thumbnails = []
+            # thumbnails packed into one file are copied once
+            copied_storage_ids = {}
             for thumbnail in self.project['thumbnails']['timeline']:
-                storage_id = app.fs.put(
-                    content=app.fs.get(thumbnail['storage_id']),
-                    filename=thumbnail['filename'],
-                    project_id=None,
-                    asset_type='thumbnails',
-                    storage_id=child_project['storage_id'],
-                    content_type=thumbnail['mimetype']
-                )
-                timeline_thumbnails.append({
+                if thumbnail['storage_id'] not in copied_storage_ids:
+                    # pack is named after a project's version
+                    filename = get_timeline_pack_filename(
+                        child_project, len(self.project['thumbnails']['timeline'])
+                    ) if 'offset' in thumbnail else os.path.basename(thumbnail['storage_id'])
+                    copied_storage_ids[thumbnail['storage_id']] = app.fs.copy(
+                        thumbnail['storage_id'],
+                        filename=filename,
+                        project_id=None,
+                        asset_type='thumbnails',
+                        storage_id=child_project['storage_id']
+                    )
+                storage_id = copied_storage_ids[thumbnail['storage_id']]
+                timeline_thumbnail = {
                     'filename': thumbnail['filename'],
                     'storage_id': storage_id,
                     'mimetype': thumbnail['mimetype'],
                     'width': thumbnail['width'],
                     'height': thumbnail['height'],
                     'size': thumbnail['size']
-                })
+                }
+                if 'offset' in thumbnail:
+                    timeline_thumbnail['offset'] = thumbnail['offset']
+                timeline_thumbnails.append(timeline_thumbnail)
             if timeline_thumbnails:
                 child_project = app.mongo.db.projects.find_one_and_update(
                     {'_id': child_project['_id']},
@@ -825,7 +958,7 @@ class DuplicateProject(MethodView):
 
         except Exception as e:
             # delete child_project dir
-            app.fs.delete_dir(storage_id)
+            delete_later(storage_id, directory=True)
             # remove record from db
             app.mongo.db.projects.delete_one({'_id': child_project['_id']})
             raise InternalServerError(str(e))
@@ -1013,13 +1146,13 @@ class RetrieveOrCreateThumbnails(MethodView):
               properties:
                 filename:
                   type: string
-                  example: 059ec59cd21543d2a014687619a85ca7_preview-custom.jpeg
+                  example: 059ec59cd21543d2a014687619a85ca7_preview-custom_1563354321123.jpeg
                 url:
                   type: string
                   example: http://localhost:5050/projects/5d2ee69cfe985e50884006f9/raw/thumbnail?type=preview
                 storage_id:
                   type: string
-                  example: 2019/7/17/5d2ee69cfe985e50884006f9/thumbnails/059ec59cd21543d2a014687619_preview-custom.jpeg
+                  example: 2019/7/17/5d2ee69cfe985e50884006f9/thumbnails/059ec59cd21543d2a014687619_preview-custom_1563354321123.jpeg  # noqa
                 mime_type:
                   type: string
                   example: video/mp4
@@ -1047,14 +1180,16 @@ class RetrieveOrCreateThumbnails(MethodView):
         """
 
         # validate request
+        request.upload_codecs = app.config.get('CODEC_SUPPORT_IMAGE')
         if 'file' not in request.files:
             # to avoid TypeError: cannot serialize '_io.BufferedRandom' error
             raise BadRequest({"file": ["required field"]})
         document = validate_document(request.files, self.SCHEMA_UPLOAD)
 
         # validate codec
-        file_stream = document['file'].stream.read()
-        metadata = get_video_editor().get_meta(file_stream)
+        file_stream = document['file'].stream
+        file_stream.flush()
+        metadata = get_video_editor().get_meta(file_stream.path)
         if metadata.get('codec_name') not in app.config.get('CODEC_SUPPORT_IMAGE'):
             raise BadRequest({'file': [f"Codec: '{metadata.get('codec_name')}' is not supported."]})
 
@@ -1063,23 +1198,24 @@ class RetrieveOrCreateThumbnails(MethodView):
             raise Conflict({"processing": ["Task get preview thumbnails is still processing"]})
 
         # save to fs
-        thumbnail_filename = "{filename}_preview-custom.{original_ext}".format(
+        # unique filename, so an old file can be deleted by a background task and is not served from a cache
+        thumbnail_filename = "{filename}_preview-custom_{_id}.{original_ext}".format(
             filename=os.path.splitext(self.project['filename'])[0],
+            _id=round(time() * 1000),
             original_ext=request.files['file'].filename.rsplit('.', 1)[-1].lower()
         )
         mimetype = app.config.get('CODEC_MIMETYPE_MAP')[metadata.get('codec_name')]
-        if self.project['thumbnails']['preview']:
-            # delete old file
-            app.fs.delete(self.project['thumbnails']['preview']['storage_id'])
-
-        storage_id = app.fs.put(
-            content=file_stream,
+        storage_id = app.fs.put_from_path(
+            file_path=file_stream.path,
             filename=thumbnail_filename,
             project_id=None,
             asset_type='thumbnails',
             storage_id=self.project['storage_id'],
             content_type=mimetype
         )
+        if self.project['thumbnails']['preview']:
+            # delete old file
+            delete_later(self.project['thumbnails']['preview']['storage_id'])
 
         # save new thumbnail info
         self.project = app.mongo.db.projects.find_one_and_update(
@@ -1149,6 +1285,9 @@ class RetrieveOrCreateThumbnails(MethodView):
         :return: json response
         :rtype: flask.wrappers.Response
         """
+        # video of a finished upload may be not joined yet
+        if self.project['processing']['video']:
+            raise Conflict({"processing": ["Task get video is still processing"]})
         # validate crop param
         if crop:
             if self.project['metadata']['width'] - crop['x'] < app.config.get('MIN_VIDEO_WIDTH'):
@@ -1184,16 +1323,30 @@ class RetrieveOrCreateThumbnails(MethodView):
 
 
 class GetRawVideo(MethodView):
+    SCHEMA_TIME = {
+        't': {
+            'type': 'float',
+            'coerce': float,
+            'min': 0,
+        }
+    }
+
     def get(self, project_id):
         """
         Get video stream.
         If `HTTP_RANGE` header is specified - return chunked video stream, else full file.
+        If `t` is specified - return chunked video stream from a keyframe preceding `t`, time of the keyframe
+        is in `X-Keyframe-Time` header. `t` is ignored if keyframe index of a video is not built yet.
         ---
         parameters:
         - in: path
           name: project_id
           type: string
           required: True
+        - in: query
+          name: t
+          type: number
+          description: Position in seconds to stream a video from.
         produces:
           - video/mp4
         responses:
@@ -1229,6 +1382,16 @@ class GetRawVideo(MethodView):
         # get stream file for video
         video_range = request.headers.environ.get('HTTP_RANGE')
         length = self.project['metadata'].get('size')
+        headers = {}
+        if not video_range and 't' in request.args:
+            # map time to a byte offset of a preceding keyframe
+            document = validate_document({'t': request.args['t']}, self.SCHEMA_TIME)
+            keyframes = load_keyframe_index(self.project)
+            if keyframes:
+                index = keyframes.floor(document['t'])
+                if keyframes.pos[index] >= 0:
+                    video_range = f'bytes={keyframes.pos[index]}-'
+                    headers['X-Keyframe-Time'] = keyframes.pts[index]
         if video_range:
             # http range bytes=0-
             _range = re.split('[= | -]', video_range)
@@ -1247,6 +1410,7 @@ class GetRawVideo(MethodView):
                     'Accept-Ranges': 'bytes',
                     'Content-Length': chunksize,
                     'Content-Type': self.project.get("mime_type"),
+                    **headers,
                 },
                 status=206,
                 start=start,
@@ -1289,9 +1453,11 @@ class GetRawPreviewThumbnail(MethodView):
         if not self.project['thumbnails']['preview']:
             raise NotFound()
 
-        return storage2response(
+        return cached_storage2response(
             storage_id=self.project['thumbnails']['preview']['storage_id'],
-            headers={'Content-Type': self.project['thumbnails']['preview']['mimetype']}
+            version=self.project['version'],
+            headers={'Content-Type': self.project['thumbnails']['preview']['mimetype']},
+            size=self.project['thumbnails']['preview'].get('size')
         )
 
 
@@ -1329,17 +1495,319 @@ class GetRawTimelineThumbnail(MethodView):
         except IndexError:
             raise NotFound()
 
-        return storage2response(
+        return cached_storage2response(
             storage_id=thumbnail['storage_id'],
-            headers={'Content-Type': thumbnail['mimetype']}
+            version=self.project['version'],
+            headers={'Content-Type': thumbnail['mimetype']},
+            size=thumbnail.get('size'),
+            # thumbnails are packed into one file
+            start=thumbnail.get('offset')
         )
 
 
+class CreateUpload(MethodView):
+    SCHEMA_UPLOAD = {
+        'filename': {
+            'type': 'string',
+            'required': True,
+            'empty': False
+        },
+        'length': {
+            'type': 'integer',
+            'required': True,
+            'min': 1
+        },
+        'mime_type': {
+            'type': 'string',
+            'required': False
+        }
+    }
+
+    def post(self):
+        """
+        Start a resumable upload of a video file.
+        Send file's chunks with `PATCH` request to the upload url, then finish the upload with `POST` request
+        to create a project.
+        ---
+        consumes:
+          - application/json
+        parameters:
+        - in: body
+          name: body
+          schema:
+            type: object
+            required:
+              - filename
+              - length
+            properties:
+              filename:
+                type: string
+                example: video.mp4
+              length:
+                type: integer
+                description: file size in bytes
+                example: 3221225472
+              mime_type:
+                type: string
+                example: video/mp4
+        responses:
+          201:
+            description: Upload details
+            schema:
+              type: object
+              properties:
+                _id:
+                  type: string
+                  example: 5cbd5acfe24f6045607e51aa
+                offset:
+                  type: integer
+                  example: 0
+                length:
+                  type: integer
+                  example: 3221225472
+                url:
+                  type: string
+                  example: http://localhost:5050/projects/uploads/5cbd5acfe24f6045607e51aa
+        """
+
+        document = validate_document(request.get_json() or {}, self.SCHEMA_UPLOAD)
+        upload_id = bson.ObjectId()
+        filename = create_file_name(ext=document['filename'].rsplit('.')[-1])
+        upload = {
+            '_id': upload_id,
+            # id of a project which will be created
+            'storage_id': app.fs.generate_storage_id(filename, project_id=upload_id),
+            'filename': filename,
+            'original_filename': document['filename'],
+            'mime_type': document.get('mime_type') or mimetypes.guess_type(document['filename'])[0],
+            'length': document['length'],
+            'offset': 0,
+            'parts': [],
+            'create_time': datetime.utcnow(),
+            'update_time': datetime.utcnow(),
+        }
+        app.mongo.db.uploads.insert_one(upload)
+        logger.info(f"New upload was started. ID: {upload_id}")
+
+        return RetrieveAppendFinishUpload.upload_response(upload, status=201)
+
+
+class RetrieveAppendFinishUpload(MethodView):
+
+    @staticmethod
+    def _get_upload_or_404(upload_id):
+        try:
+            upload = app.mongo.db.uploads.find_one({'_id': bson.ObjectId(upload_id)})
+        except bson.errors.InvalidId:
+            upload = None
+        if not upload:
+            raise NotFound(f"Upload with id '{upload_id}' was not found.")
+        return upload
+
+    @staticmethod
+    def upload_response(upload, status=200):
+        return json_response({
+            '_id': upload['_id'],
+            'offset': upload['offset'],
+            'length': upload['length'],
+            'url': url_for('projects.retrieve_append_finish_upload', upload_id=upload['_id'], _external=True)
+        }, status=status)
+
+    def get(self, upload_id):
+        """
+        Get upload's offset to resume it
+        ---
+        parameters:
+        - in: path
+          name: upload_id
+          type: string
+          required: True
+        responses:
+          200:
+            description: Upload details
+            schema:
+              type: object
+              properties:
+                _id:
+                  type: string
+                  example: 5cbd5acfe24f6045607e51aa
+                offset:
+                  type: integer
+                  example: 10485760
+                length:
+                  type: integer
+                  example: 3221225472
+        """
+
+        return self.upload_response(self._get_upload_or_404(upload_id))
+
+    def patch(self, upload_id):
+        """
+        Append a chunk of a file, request body is a raw chunk.
+        Each chunk is stored as a separate file in a storage, so it's never kept in memory.
+        ---
+        consumes:
+          - application/offset+octet-stream
+        parameters:
+        - in: path
+          name: upload_id
+          type: string
+          required: True
+        - in: header
+          name: Upload-Offset
+          type: integer
+          required: True
+          description: position of a chunk in a file, must be equal to upload's offset
+        responses:
+          200:
+            description: Upload details with a new offset
+          409:
+            description: Offset does not match upload's offset
+        """
+
+        upload = self._get_upload_or_404(upload_id)
+        try:
+            offset = int(request.headers['Upload-Offset'])
+        except (KeyError, ValueError):
+            raise BadRequest({'Upload-Offset': ['required integer header']})
+        if offset != upload['offset']:
+            raise Conflict({'Upload-Offset': [f"must be {upload['offset']}"]})
+
+        received = 0
+
+        def chunks():
+            nonlocal received
+            for chunk in iter_chunks(request.stream, length=upload['length'] - offset + 1):
+                received += len(chunk)
+                yield chunk
+
+        part_storage_id = app.fs.put(
+            content=chunks(),
+            filename=f'{offset:015d}_{uuid.uuid4().hex}.part',
+            project_id=None,
+            asset_type='parts',
+            storage_id=upload['storage_id']
+        )
+        if not received or offset + received > upload['length']:
+            app.fs.delete(part_storage_id)
+            raise BadRequest({'body': [f"chunk must be from 1 to {upload['length'] - offset} bytes"]})
+
+        upload = app.mongo.db.uploads.find_one_and_update(
+            {'_id': upload['_id'], 'offset': offset},
+            {
+                '$set': {'offset': offset + received, 'update_time': datetime.utcnow()},
+                '$push': {'parts': part_storage_id}
+            },
+            return_document=ReturnDocument.AFTER
+        )
+        if not upload:
+            # concurrent request has appended a chunk at the same offset
+            app.fs.delete(part_storage_id)
+            raise Conflict({'Upload-Offset': ['chunk at this offset was already appended']})
+
+        return self.upload_response(upload)
+
+    @staticmethod
+    def _read_head(upload, size):
+        """
+        Read leading bytes of an uploaded file from its chunks.
+        :param upload: upload doc
+        :type upload: dict
+        :param size: number of bytes to read
+        :type size: int
+        :return: leading bytes
+        :rtype: bytes
+        """
+
+        head = bytearray()
+        for part_storage_id in upload['parts']:
+            with app.fs.open_read(part_storage_id, length=size - len(head)) as part:
+                head += part.read(size - len(head))
+            if len(head) >= size:
+                break
+        return bytes(head)
+
+    def post(self, upload_id):
+        """
+        Finish an upload, a project is created and chunks are joined into its video by a background task.
+        Codec is checked by probing leading bytes of a file, if they are not enough (e.g. mp4 with an index
+        at the end), it's checked after chunks are joined and a project is removed if it's not supported.
+        ---
+        parameters:
+        - in: path
+          name: upload_id
+          type: string
+          required: True
+        responses:
+          201:
+            description: Created project details, see `POST /projects/`, `processing.video` is set
+                         until chunks are joined
+          400:
+            description: Upload is not complete or codec is not supported
+          409:
+            description: Upload is already being finished by another request
+        """
+
+        upload = self._get_upload_or_404(upload_id)
+        if upload['offset'] != upload['length']:
+            raise BadRequest({'offset': [f"{upload['length'] - upload['offset']} bytes were not uploaded"]})
+
+        # claim an upload, so concurrent requests don't join it and save a project twice
+        upload = app.mongo.db.uploads.find_one_and_update(
+            {'_id': upload['_id'], 'finishing': {'$ne': True}},
+            {'$set': {'finishing': True, 'update_time': datetime.utcnow()}},
+            return_document=ReturnDocument.AFTER
+        )
+        if not upload:
+            raise Conflict({'upload': ['upload is already being finished']})
+
+        # upload is released on failure, so finishing can be retried
+        try:
+            probe_size = app.config.get('UPLOAD_PROBE_SIZE')
+            head = self._read_head(upload, probe_size)
+            try:
+                metadata = get_video_editor().get_meta(head, probe_size=len(head))
+            except Exception as e:
+                # a whole file can't be probed
+                if upload['length'] <= probe_size:
+                    raise BadRequest({'file': [f"File can't be probed: {e}"]})
+                logger.info(f'RetrieveAppendFinishUpload:post:{upload_id}: {e}')
+                metadata = None
+            if metadata and metadata.get('codec_name') not in app.config.get('CODEC_SUPPORT_VIDEO'):
+                raise BadRequest({'file': [f"Codec: '{metadata.get('codec_name')}' is not supported."]})
+
+            project = ListUploadProject._new_project(
+                project_id=upload['_id'],
+                filename=upload['filename'],
+                metadata=metadata or {},
+                mime_type=upload['mime_type'],
+                original_filename=upload['original_filename'],
+                checksum=None
+            )
+            project['storage_id'] = upload['storage_id']
+            project['processing']['video'] = True
+            response = ListUploadProject._save_project(project)
+        except Exception:
+            app.mongo.db.uploads.update_one({'_id': upload['_id']}, {'$set': {'finishing': False}})
+            raise
+
+        join_upload.delay(upload, project)
+        return response
+
+
 # register all urls
 bp.add_url_rule(
     '/',
     view_func=ListUploadProject.as_view('list_upload_project')
 )
+bp.add_url_rule(
+    '/uploads',
+    view_func=CreateUpload.as_view('create_upload')
+)
+bp.add_url_rule(
+    '/uploads/<upload_id>',
+    view_func=RetrieveAppendFinishUpload.as_view('retrieve_append_finish_upload')
+)
 bp.add_url_rule(
     '/<project_id>',
     view_func=RetrieveEditDestroyProject.as_view('retrieve_edit_destroy_project')
@@ -1,118 +1,621 @@
+import hashlib
 import logging
+import os
+from contextlib import ExitStack, contextmanager
+from datetime import datetime, timedelta
 from time import time
 
 from bson import ObjectId
+from celery import chord
 from celery.exceptions import MaxRetriesExceededError
 from flask import current_app as app
 from pymongo import ReturnDocument
 
 from videoserver.celery_app import celery
-from videoserver.lib.video_editor import get_video_editor
+from videoserver.lib.utils import iter_chunks
+from videoserver.lib.video_editor import KeyframeIndex, get_video_editor
 
 logger = logging.getLogger(__name__)
 
 
+@contextmanager
+def open_video(storage_id):
+    """
+    Provide a video for a video editor.
+    Use a local file path if storage keeps files locally, so video editor doesn't copy it, otherwise a file stream.
+    :param storage_id: unique storage id
+    :type storage_id: str
+    :return: file path or file-like object
+    """
+
+    file_path = app.fs.local_path(storage_id)
+    if file_path:
+        yield file_path
+    else:
+        with app.fs.open_read(storage_id) as stream:
+            yield stream
+
+
+def get_keyframe_index_storage_id(project):
+    """
+    Return storage id of a keyframe index of a project's current version.
+    Index is kept in a storage next to a video, so project's document stays small.
+    :param project: project doc
+    :type project: dict
+    :return: storage id
+    :rtype: str
+    """
+
+    return app.fs.generate_storage_id(
+        f"{project['filename'].rsplit('.', 1)[0]}_v{project['version']}.keyframes",
+        asset_type='keyframes',
+        storage_id=project['storage_id']
+    )
+
+
+def get_timeline_pack_filename(project, amount):
+    """
+    Return filename of a timeline thumbnails pack of a project's current version.
+    Version makes filename unique, so old thumbnails deleted later and cached ones are not mixed up.
+    :param project: project doc
+    :type project: dict
+    :param amount: number of thumbnails
+    :type amount: int
+    :return: filename
+    :rtype: str
+    """
+
+    return f"{project['filename'].rsplit('.', 1)[0]}_timeline-{amount}_v{project['version']}.pack"
+
+
+def load_keyframe_index(project):
+    """
+    Load a keyframe index of a project's current version from a storage.
+    Index is loaded only by edit and seek requests, so it is not kept in `app.media_cache` next to thumbnails.
+    :param project: project doc
+    :type project: dict
+    :return: keyframe index or `None` if it was not built yet
+    :rtype: videoserver.lib.video_editor.KeyframeIndex
+    """
+
+    try:
+        data = app.fs.get(get_keyframe_index_storage_id(project))
+    except Exception:
+        return None
+    return KeyframeIndex.from_bytes(data)
+
+
+def save_keyframe_index(project, keyframes):
+    """
+    Save a keyframe index of a project's current version into a storage.
+    :param project: project doc
+    :type project: dict
+    :param keyframes: keyframe index
+    :type keyframes: videoserver.lib.video_editor.KeyframeIndex
+    """
+
+    app.fs.put(
+        content=keyframes.to_bytes(),
+        filename=os.path.basename(get_keyframe_index_storage_id(project)),
+        project_id=None,
+        asset_type='keyframes',
+        storage_id=project['storage_id'],
+        content_type='application/octet-stream'
+    )
+
+
+def get_segment_storage_id(project, index):
+    """
+    Return storage id of a segment of a project's video which is encoded by `encode_video_segment`.
+    All segments of a project are kept in one directory, so they are deleted together.
+    :param project: project doc
+    :type project: dict
+    :param index: segment number
+    :type index: int
+    :return: storage id
+    :rtype: str
+    """
+
+    name, ext = project['filename'].rsplit('.', 1)
+    return app.fs.generate_storage_id(
+        f"{name}_v{project['version']}_{index}.{ext}",
+        asset_type='segments',
+        storage_id=project['storage_id']
+    )
+
+
+def get_edit_segments(project, changes):
+    """
+    Split an edit which re-encodes a whole video into segments at keyframes, so they are encoded in parallel.
+    :param project: project doc
+    :type project: dict
+    :param changes: changes apply to the video
+    :type changes: dict
+    :return: segments' start and end or `None` if an edit is not split
+    :rtype: list
+    """
+
+    segment_duration = app.config.get('EDIT_SEGMENT_DURATION')
+    if not segment_duration:
+        return None
+    # rotate only and keyframe aligned trims are not re-encoded entirely
+    if not ('crop' in changes or 'scale' in changes
+            or ('trim' in changes and changes.get('trim_mode', 'encode') == 'encode')):
+        return None
+    trim = changes.get('trim') or {'start': 0, 'end': project['metadata']['duration']}
+    if trim['end'] - trim['start'] < 2 * segment_duration:
+        return None
+    keyframes = load_keyframe_index(project)
+    if not keyframes:
+        return None
+    segments = keyframes.split(trim['start'], trim['end'], segment_duration)
+    return segments if len(segments) > 1 else None
+
+
+def delete_later(*storage_ids, directory=False):
+    """
+    Record tombstones for files (or directories) and delete them from a storage by a background task.
+    :param storage_ids: storage ids of files to delete, or storage ids inside directories to delete
+    :type storage_ids: str
+    :param directory: delete an entire directory where storage id is located
+    :type directory: bool
+    """
+
+    # thumbnails packed into one file share a storage id
+    storage_ids = list(dict.fromkeys(storage_id for storage_id in storage_ids if storage_id))
+    if not storage_ids:
+        return
+
+    app.mongo.db.deletions.insert_many([
+        {'storage_id': storage_id, 'directory': directory, 'create_date': datetime.utcnow()}
+        for storage_id in storage_ids
+    ])
+    purge_deleted.delay()
+
+
+@celery.task
+def purge_deleted():
+    """
+    Drain tombstones recorded by `delete_later` in batches.
+    Files are deleted by one storage call per batch, tombstones which failed are kept for the next run.
+    A batch can fail partially, storage returns files which were not removed.
+    """
+
+    batch_size = app.config.get('STORAGE_DELETE_BATCH_SIZE')
+    failed = []
+    purged = 0
+    while True:
+        tombstones = list(
+            app.mongo.db.deletions.find({'_id': {'$nin': failed}}).sort('create_date', 1).limit(batch_size)
+        )
+        if not tombstones:
+            break
+
+        files = [tombstone for tombstone in tombstones if not tombstone['directory']]
+        dirs = [tombstone for tombstone in tombstones if tombstone['directory']]
+        done = []
+        if files:
+            try:
+                not_removed = set(app.fs.delete_many([tombstone['storage_id'] for tombstone in files]))
+                for tombstone in files:
+                    if tombstone['storage_id'] in not_removed:
+                        failed.append(tombstone['_id'])
+                    else:
+                        done.append(tombstone['_id'])
+            except Exception as e:
+                logger.exception(e)
+                failed.extend(tombstone['_id'] for tombstone in files)
+        for tombstone in dirs:
+            try:
+                app.fs.delete_dir(tombstone['storage_id'])
+                done.append(tombstone['_id'])
+            except Exception as e:
+                logger.exception(e)
+                failed.append(tombstone['_id'])
+
+        app.mongo.db.deletions.delete_many({'_id': {'$in': done}})
+        purged += len(done)
+
+    logger.info(f"Purged {purged} deleted files and directories from {app.fs.__class__.__name__}, "
+                f"{len(failed)} failed.")
+
+
+@celery.task
+def sweep_storage():
+    """
+    Find projects' directories in a storage which are not referenced by any project or upload and delete them.
+    Directories created within `STORAGE_SWEEP_GRACE_DAYS` are skipped, since a project can be saved after its files.
+    """
+
+    try:
+        dirs = app.fs.list_dirs()
+        # expire abandoned uploads, so their chunks are removed below
+        app.mongo.db.uploads.delete_many({
+            'update_time': {'$lt': datetime.utcnow() - timedelta(days=app.config.get('UPLOAD_EXPIRE_DAYS'))}
+        })
+        referenced = {
+            os.path.dirname(doc['storage_id'])
+            for collection in (app.mongo.db.projects, app.mongo.db.uploads)
+            for doc in collection.find({'storage_id': {'$exists': True}}, {'storage_id': 1})
+            if doc['storage_id']
+        }
+        grace_date = datetime.utcnow() - timedelta(days=app.config.get('STORAGE_SWEEP_GRACE_DAYS'))
+        orphans = []
+        for dir_storage_id in dirs:
+            try:
+                year, month, day = dir_storage_id.split('/')[:3]
+                if datetime(int(year), int(month), int(day)) >= grace_date:
+                    continue
+            except ValueError:
+                continue
+            if dir_storage_id not in referenced:
+                orphans.append(f'{dir_storage_id}/')
+    except NotImplementedError as e:
+        logger.warning(str(e))
+        return
+
+    delete_later(*orphans, directory=True)
+    logger.info(f"Found {len(orphans)} orphaned directories in {app.fs.__class__.__name__}.")
+
+
+@celery.task(bind=True, default_retry_delay=10)
+def generate_keyframe_index(self, project):
+    """
+    Build and save a keyframe index of a project's current version.
+    :param project: project doc
+    """
+
+    try:
+        with open_video(project['storage_id']) as video:
+            keyframes = get_video_editor().get_keyframe_index(video)
+        save_keyframe_index(project, keyframes)
+        logger.info(f"Saved keyframe index ({len(keyframes)} keyframes) of project {project.get('_id')}.")
+    except Exception as e:
+        logger.exception(e)
+        try:
+            raise self.retry(max_retries=app.config.get('MAX_RETRIES', 3))
+        except MaxRetriesExceededError:
+            pass
+
+
+def fail_upload(upload, project):
+    """
+    Remove a project which video failed to be joined from upload's chunks and release an upload,
+    so finishing can be retried. Chunks are kept until an upload expires.
+    :param upload: upload doc
+    :type upload: dict
+    :param project: project doc
+    :type project: dict
+    """
+
+    app.mongo.db.projects.delete_one({'_id': project['_id']})
+    delete_later(project['storage_id'])
+    app.mongo.db.uploads.update_one({'_id': upload['_id']}, {'$set': {'finishing': False}})
+
+
+@celery.task(bind=True, default_retry_delay=10)
+def join_upload(self, upload, project):
+    """
+    Join chunks of a resumable upload into a video of a project created by finishing an upload,
+    validate its codec, save its metadata and checksum and remove chunks.
+    :param upload: upload doc
+    :param project: project doc, its `processing.video` is set until a video is joined
+    """
+
+    checksum = hashlib.sha256()
+
+    def content():
+        for part_storage_id in upload['parts']:
+            with app.fs.open_read(part_storage_id) as part:
+                for chunk in iter_chunks(part):
+                    checksum.update(chunk)
+                    yield chunk
+
+    try:
+        app.fs.replace(content(), project['storage_id'], project['mime_type'])
+        with open_video(project['storage_id']) as video:
+            metadata = get_video_editor().get_meta(video)
+    except Exception as exc:
+        logger.exception(exc)
+        try:
+            self.retry(max_retries=app.config.get('MAX_RETRIES', 3))
+        except MaxRetriesExceededError:
+            fail_upload(upload, project)
+        return
+
+    if metadata.get('codec_name') not in app.config.get('CODEC_SUPPORT_VIDEO'):
+        logger.error(f"Codec '{metadata.get('codec_name')}' of upload {upload['_id']} is not supported.")
+        fail_upload(upload, project)
+        return
+
+    app.mongo.db.projects.update_one(
+        {'_id': project['_id']},
+        {'$set': {
+            'metadata': metadata,
+            'checksum': checksum.hexdigest(),
+            'processing.video': False,
+        }}
+    )
+    delete_later(*upload['parts'])
+    app.mongo.db.uploads.delete_one({'_id': upload['_id']})
+    logger.info(f"Joined {len(upload['parts'])} chunks of upload {upload['_id']} into {project['storage_id']}.")
+    generate_keyframe_index.delay({**project, 'metadata': metadata})
+
+
+def replace_edited_video(project, edited_video_path):
+    """
+    Replace project's video by an edited one.
+    :param project: project doc
+    :type project: dict
+    :param edited_video_path: path to edited video, it's adopted by a storage or removed if it fails
+    :type edited_video_path: str
+    :return: keyframe index of an edited video or `None` if it failed
+    :rtype: videoserver.lib.video_editor.KeyframeIndex
+    """
+
+    # index of an edited video is built before storage adopts it
+    try:
+        keyframes = get_video_editor().get_keyframe_index(edited_video_path)
+    except Exception as e:
+        logger.exception(e)
+        keyframes = None
+
+    try:
+        app.fs.replace_from_path(
+            edited_video_path,
+            project['storage_id'],
+            None
+        )
+    except Exception:
+        # storage may fail before it adopts or removes a file
+        if os.path.exists(edited_video_path):
+            os.remove(edited_video_path)
+        raise
+    logger.info(f"Replaced file {project['storage_id']} in {app.fs.__class__.__name__} "
+                f"in project {project.get('_id')}")
+    return keyframes
+
+
+def finish_edit(project, metadata, keyframes):
+    """
+    Update project after its video was replaced by an edited one: increase version, drop old timeline thumbnails
+    and keyframe index.
+    :param project: project doc
+    :type project: dict
+    :param metadata: metadata of edited video
+    :type metadata: dict
+    :param keyframes: keyframe index of edited video, it's built by a background task if it's `None`
+    :type keyframes: videoserver.lib.video_editor.KeyframeIndex
+    """
+
+    # delete old timeline thumbnails
+    old_timeline_thumbnails = project['thumbnails'].get('timeline', [])
+    delete_later(*(old_thumbnail.get('storage_id') for old_thumbnail in old_timeline_thumbnails))
+    logger.info(f"Removed {len(old_timeline_thumbnails)} old thumbnails from {app.fs.__class__.__name__} "
+                f"in project {project.get('_id')}")
+
+    # update project record
+    app.mongo.db.projects.find_one_and_update(
+        {'_id': project['_id']},
+        {'$set': {
+            'processing.video': False,
+            'metadata': metadata,
+            'thumbnails.timeline': [],
+            'version': project['version'] + 1
+        }},
+        return_document=ReturnDocument.BEFORE
+    )
+    logger.info(f"Finished editing for project {project.get('_id')}.")
+
+    # replace keyframe index of an old version
+    delete_later(get_keyframe_index_storage_id(project))
+    edited_project = {**project, 'version': project['version'] + 1}
+    if keyframes:
+        try:
+            save_keyframe_index(edited_project, keyframes)
+        except Exception as e:
+            logger.exception(e)
+            keyframes = None
+    if not keyframes:
+        generate_keyframe_index.delay(edited_project)
+
+
+def fail_edit(project):
+    """
+    Reset processing flag of a project which video failed to be edited.
+    :param project: project doc
+    :type project: dict
+    """
+
+    app.mongo.db.projects.update_one(
+        {'_id': ObjectId(project.get('_id'))},
+        {"$set": {
+            'processing.video': False,
+        }},
+        upsert=False
+    )
+
+
 @celery.task(bind=True, default_retry_delay=10)
 def edit_video(self, project, changes):
     """
     Task use tool for edit video and record the data and update status after finished,
+    long edits are split into segments which are encoded by `encode_video_segment` tasks in parallel
+    and joined by `concat_video_segments`.
     :param project: project doc
     :param changes: changes apply to the video
     """
 
+    segments = get_edit_segments(project, changes)
+    if segments:
+        chord(
+            encode_video_segment.s(project, changes, index, start, end)
+            for index, (start, end) in enumerate(segments)
+        )(concat_video_segments.s(project, changes))
+        logger.info(f"Editing of project {project.get('_id')} was split into {len(segments)} segments.")
+        return
+
     video_editor = get_video_editor()
 
     try:
         # Use tool for editing video
-        edited_video_stream, metadata = video_editor.edit_video(
-            stream_file=app.fs.get(project['storage_id']),
-            filename=project['filename'],
-            **changes
-        )
-
-        app.fs.replace(
-            edited_video_stream,
-            project['storage_id'],
-            None
-        )
-        logger.info(f"Replaced file {project['storage_id']} in {app.fs.__class__.__name__} "
-                    f"in project {project.get('_id')}")
+        with open_video(project['storage_id']) as video:
+            edited_video_path, metadata = video_editor.edit_video(
+                stream_file=video,
+                filename=project['filename'],
+                keyframes=load_keyframe_index(project),
+                **changes
+            )
+        keyframes = replace_edited_video(project, edited_video_path)
     except Exception as exc:
         logger.exception(exc)
         try:
             self.retry(max_retries=app.config.get('MAX_RETRIES', 3))
         except MaxRetriesExceededError:
-            app.mongo.db.projects.update_one(
-                {'_id': ObjectId(project.get('_id'))},
-                {"$set": {
-                    'processing.video': False,
-                }},
-                upsert=False
-            )
+            fail_edit(project)
     else:
-        # delete old timeline thumbnails
-        old_timeline_thumbnails = project['thumbnails'].get('timeline', [])
-        for old_thumbnail in old_timeline_thumbnails:
-            app.fs.delete(old_thumbnail.get('storage_id'))
-        logger.info(f"Removed {len(old_timeline_thumbnails)} old thumbnails from {app.fs.__class__.__name__} "
-                    f"in project {project.get('_id')}")
+        finish_edit(project, metadata, keyframes)
 
-        # update project record
-        app.mongo.db.projects.find_one_and_update(
-            {'_id': project['_id']},
-            {'$set': {
-                'processing.video': False,
-                'metadata': metadata,
-                'thumbnails.timeline': [],
-                'version': project['version'] + 1
-            }},
-            return_document=ReturnDocument.BEFORE
-        )
-        logger.info(f"Finished editing for project {project.get('_id')}.")
+
+@celery.task(bind=True, default_retry_delay=10)
+def encode_video_segment(self, project, changes, index, start, end):
+    """
+    Encode a segment of a video edit and save it into a storage, so any worker can join it.
+    :param project: project doc
+    :param changes: changes apply to the video
+    :param index: segment number
+    :param start: segment start in seconds
+    :param end: segment end in seconds
+    :return: storage id of a segment or `None` if it failed
+    """
+
+    segment_path = None
+    try:
+        with open_video(project['storage_id']) as video:
+            segment_path = get_video_editor().encode_segment(
+                stream_file=video,
+                filename=project['filename'],
+                start=start,
+                end=end,
+                crop=changes.get('crop'),
+                rotate=changes.get('rotate'),
+                scale=changes.get('scale'),
+                encoder_profile=changes.get('encoder_profile'),
+            )
+        storage_id = get_segment_storage_id(project, index)
+        app.fs.replace_from_path(segment_path, storage_id, None)
+        return storage_id
+    except Exception as e:
+        logger.exception(e)
+        if segment_path and os.path.exists(segment_path):
+            os.remove(segment_path)
+        try:
+            raise self.retry(max_retries=app.config.get('MAX_RETRIES', 3))
+        except MaxRetriesExceededError:
+            # joining task runs anyway and fails an edit
+            return None
 
 
 @celery.task(bind=True, default_retry_delay=10)
-def generate_timeline_thumbnails(self, project, amount):
-    timeline_thumbnails = []
+def concat_video_segments(self, segment_storage_ids, project, changes):
+    """
+    Join segments encoded by `encode_video_segment` tasks, replace project's video and remove segments.
+    :param segment_storage_ids: storage ids of segments in order, `None` for failed ones
+    :param project: project doc
+    :param changes: changes apply to the video
+    """
+
     video_editor = get_video_editor()
 
+    if not all(segment_storage_ids):
+        logger.error(f"Failed to encode segments of project {project.get('_id')}.")
+        delete_later(get_segment_storage_id(project, 0), directory=True)
+        fail_edit(project)
+        return
+
     try:
-        thumbnails_generator = video_editor.capture_timeline_thumbnails(
-            stream_file=app.fs.get(project['storage_id']),
-            filename=project['filename'],
-            duration=project['metadata']['duration'],
-            thumbnails_amount=amount)
+        with ExitStack() as stack:
+            video = stack.enter_context(open_video(project['storage_id']))
+            segments = [stack.enter_context(open_video(storage_id)) for storage_id in segment_storage_ids]
+            edited_video_path, metadata = video_editor.concat_segments(
+                stream_file=video,
+                filename=project['filename'],
+                segments=segments,
+                trim=changes.get('trim'),
+            )
+        keyframes = replace_edited_video(project, edited_video_path)
+    except Exception as exc:
+        logger.exception(exc)
+        try:
+            self.retry(max_retries=app.config.get('MAX_RETRIES', 3))
+        except MaxRetriesExceededError:
+            delete_later(get_segment_storage_id(project, 0), directory=True)
+            fail_edit(project)
+    else:
+        delete_later(get_segment_storage_id(project, 0), directory=True)
+        finish_edit(project, metadata, keyframes)
 
+
+@celery.task(bind=True, default_retry_delay=10)
+def generate_timeline_thumbnails(self, project, amount):
+    """
+    Capture timeline thumbnails and save them into a single pack file.
+    Thumbnails are appended one after another, offset and size of each one are kept in project's document,
+    so a thumbnail is read by `get_range` and all of them are created and deleted as one file.
+    :param project: project doc
+    :param amount: number of thumbnails
+    """
+
+    timeline_thumbnails = []
+    video_editor = get_video_editor()
+    pack_filename = get_timeline_pack_filename(project, amount)
+    pack_storage_id = None
+
+    def pack(thumbnails_generator):
+        offset = 0
         for count, (stream, meta) in enumerate(thumbnails_generator, 1):
             ext = app.config.get('CODEC_EXTENSION_MAP')[meta.get('codec_name')]
-            filename = f"{project['filename'].rsplit('.', 1)[0]}_timeline_{count}-{amount}.{ext}"
-            # save to storage
-            storage_id = app.fs.put(
-                content=stream,
-                filename=filename,
-                project_id=None,
-                asset_type='thumbnails',
-                storage_id=project['storage_id'],
-                content_type=meta.get('mimetype')
-            )
             timeline_thumbnails.append(
                 {
-                    'filename': filename,
-                    'storage_id': storage_id,
+                    'filename': f"{project['filename'].rsplit('.', 1)[0]}_timeline_{count}-{amount}.{ext}",
+                    'offset': offset,
                     'mimetype': meta.get('mimetype'),
                     'width': meta.get('width'),
                     'height': meta.get('height'),
-                    'size': meta.get('size')
+                    'size': len(stream)
                 }
             )
+            offset += len(stream)
+            yield stream
+
+    try:
+        with open_video(project['storage_id']) as video:
+            thumbnails_generator = video_editor.capture_timeline_thumbnails(
+                stream_file=video,
+                filename=project['filename'],
+                duration=project['metadata']['duration'],
+                thumbnails_amount=amount,
+                fast=app.config.get('TIMELINE_THUMBNAILS_FAST'),
+                keyframes=load_keyframe_index(project))
+            # save to storage
+            pack_storage_id = app.fs.put(
+                content=pack(thumbnails_generator),
+                filename=pack_filename,
+                project_id=None,
+                asset_type='thumbnails',
+                storage_id=project['storage_id'],
+                content_type='application/octet-stream'
+            )
+        for thumbnail in timeline_thumbnails:
+            thumbnail['storage_id'] = pack_storage_id
         logger.info(f"Created and saved {len(timeline_thumbnails)} thumbnails to {app.fs.__class__.__name__} "
                     f"in project {project.get('_id')}.")
     except Exception as e:
-        # delete just saved files
-        for thumbnail in timeline_thumbnails:
-            app.fs.delete(thumbnail.get('storage_id'))
-        logger.info(f"Due to exception, {len(timeline_thumbnails)} just created thumbnails were removed from "
-                    f"{app.fs.__class__.__name__} in project {project.get('_id')}")
+        # delete just saved file
+        if pack_storage_id:
+            delete_later(pack_storage_id)
+            logger.info(f"Due to exception, {len(timeline_thumbnails)} just created thumbnails were removed from "
+                        f"{app.fs.__class__.__name__} in project {project.get('_id')}")
         logger.exception(e)
 
         try:
@@ -128,8 +631,10 @@ def generate_timeline_thumbnails(self, project, amount):
     else:
         # remove an old thumbnails from a storage only if new thumbnails were created succesfully
         old_timeline_thumbnails = project['thumbnails'].get('timeline', [])
-        for old_thumbnail in old_timeline_thumbnails:
-            app.fs.delete(old_thumbnail.get('storage_id'))
+        delete_later(*(
+            old_thumbnail.get('storage_id') for old_thumbnail in old_timeline_thumbnails
+            if old_thumbnail.get('storage_id') != pack_storage_id
+        ))
         logger.info(f"Removed {len(old_timeline_thumbnails)} old thumbnails from {app.fs.__class__.__name__} "
                     f"in project {project.get('_id')}")
 
@@ -151,14 +656,15 @@ def generate_preview_thumbnail(self, project, position, crop, rotate):
     preview_thumbnail = None
 
     try:
-        stream, meta = video_editor.capture_thumbnail(
-            stream_file=app.fs.get(project['storage_id']),
-            filename=project['filename'],
-            duration=project['metadata']['duration'],
-            position=position,
-            crop=crop,
-            rotate=rotate,
-        )
+        with open_video(project['storage_id']) as video:
+            stream, meta = video_editor.capture_thumbnail(
+                stream_file=video,
+                filename=project['filename'],
+                duration=project['metadata']['duration'],
+                position=position,
+                crop=crop,
+                rotate=rotate,
+            )
         # Generate _id to ensure filename is unique, avoid fs.put raises error,
         # use of fs.replace will lead to lost original thumbnail if an error is occured
         _id = round(time() * 1000)
@@ -187,7 +693,7 @@ def generate_preview_thumbnail(self, project, position, crop, rotate):
     except Exception as e:
         # delete just saved file
         if preview_thumbnail:
-            app.fs.delete(preview_thumbnail.get('storage_id'))
+            delete_later(preview_thumbnail.get('storage_id'))
             logger.info(f"Due to exception, just created preview thumbnail at position {position} was removed from "
                         f"{app.fs.__class__.__name__} in project {project.get('_id')}")
         logger.exception(e)
@@ -206,7 +712,7 @@ def generate_preview_thumbnail(self, project, position, crop, rotate):
     else:
         # remove an old preview thumbnail from a storage only after a new thumbnail was created succesfully
         if project['thumbnails']['preview']:
-            app.fs.delete(project['thumbnails']['preview'].get('storage_id'))
+            delete_later(project['thumbnails']['preview'].get('storage_id'))
             logger.info(f"Removed old preview thumbnail at position {project['thumbnails']['preview']['position']} "
                         f"from {app.fs.__class__.__name__} in project {project.get('_id')}")
         # set preview thumbnail in db
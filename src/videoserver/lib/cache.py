@@ -0,0 +1,74 @@
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Thread safe in-memory cache of bytes limited by a total size, least recently used items are evicted first.
+    """
+
+    def __init__(self, max_size, max_item_size=None):
+        """
+        :param max_size: max total size of cached items in bytes, `0` disables cache
+        :type max_size: int
+        :param max_item_size: items bigger than this are not cached
+        :type max_item_size: int
+        """
+
+        self.max_size = max_size
+        self.max_item_size = max_item_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Return cached item and mark it as recently used.
+        :param key: hashable key
+        :return: item or `None` if it's not cached
+        :rtype: bytes
+        """
+
+        with self._lock:
+            value = self._items.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """
+        Put item into cache if it fits, evict least recently used items.
+        :param key: hashable key
+        :param value: item
+        :type value: bytes
+        :return: `True` if item was cached
+        :rtype: bool
+        """
+
+        if len(value) > self.max_size or (self.max_item_size is not None and len(value) > self.max_item_size):
+            return False
+
+        with self._lock:
+            old_value = self._items.pop(key, None)
+            if old_value is not None:
+                self.size -= len(old_value)
+            self._items[key] = value
+            self.size += len(value)
+            while self.size > self.max_size:
+                _, evicted = self._items.popitem(last=False)
+                self.size -= len(evicted)
+        return True
+
+    def stats(self):
+        """
+        Return cache statistics.
+        :return: number of items, size, hits and misses
+        :rtype: dict
+        """
+
+        return {'items': len(self._items), 'size': self.size, 'hits': self.hits, 'misses': self.misses}
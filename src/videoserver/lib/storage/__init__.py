@@ -1,4 +1,9 @@
+from .cached_storage import CachedStorage
+from .content_addressable_storage import ContentAddressableStorage
 from .file_system_storage import FileSystemStorage
+from .gridfs_storage import GridFSStorage
+from .s3_storage import S3Storage
+from .sharded_file_system_storage import ShardedFileSystemStorage
 
 
 def get_media_storage(name):
@@ -7,6 +12,12 @@ def get_media_storage(name):
     """
     if str.lower(name) == 'filesystem':
         return FileSystemStorage()
-    if str.lower(name) == 'amazon':
-        return None
+    if str.lower(name) == 'content_addressable':
+        return ContentAddressableStorage()
+    if str.lower(name) == 'sharded_filesystem':
+        return ShardedFileSystemStorage()
+    if str.lower(name) in ('s3', 'amazon'):
+        return S3Storage()
+    if str.lower(name) == 'gridfs':
+        return GridFSStorage()
     return None
@@ -0,0 +1,456 @@
+import hashlib
+import os
+import shutil
+import logging
+import threading
+import uuid
+from collections import OrderedDict
+
+from flask import current_app as app
+
+from videoserver.lib.utils import as_file, iter_chunks
+from .interface import MediaStorageInterface
+
+logger = logging.getLogger(__name__)
+
+
+class CachedStorage(MediaStorageInterface):
+    """
+    Storage wrapper which keeps a local disk cache of another storage.
+
+    Files are cached by fixed-size blocks (`STORAGE_CACHE_BLOCK_SIZE`) in
+    `<STORAGE_CACHE_PATH>/<storage_id>/<version>/<n>.block`, so a range request fetches and caches only blocks
+    covering it. Least recently used blocks are evicted when cache grows over `STORAGE_CACHE_SIZE` bytes.
+
+    Reads are read-through, `put` and `replace` write blocks into cache while content is passed to the storage,
+    `delete` and `delete_dir` invalidate cache. Version of a file is asked from the storage on every read, so blocks
+    of a file which was replaced by another node are not served anymore and removed when new blocks are cached.
+    Cache directory can be shared by processes on the same host, recency of blocks is kept in files' mtime,
+    but each process accounts only blocks it has seen.
+    """
+
+    TMP_DIR = '.tmp'
+
+    def __init__(self, storage):
+        """
+        :param storage: storage to cache
+        :type storage: MediaStorageInterface
+        """
+
+        self.storage = storage
+        self._lock = threading.Lock()
+        self._blocks = None
+        self._size = 0
+
+    @property
+    def block_size(self):
+        return app.config.get('STORAGE_CACHE_BLOCK_SIZE')
+
+    @staticmethod
+    def _get_cache_path(*parts):
+        """
+        Build and return full path inside cache directory.
+        :return: path
+        :rtype: str
+        """
+
+        return os.path.join(app.config.get('STORAGE_CACHE_PATH'), *parts)
+
+    def _get_version_dir(self, storage_id, version):
+        return self._get_cache_path(storage_id, hashlib.md5(str(version).encode()).hexdigest())
+
+    def _get_block_path(self, storage_id, version, n):
+        return os.path.join(self._get_version_dir(storage_id, version), f'{n}.block')
+
+    def _load(self):
+        """
+        Build LRU index of blocks which are already in cache, older blocks first.
+        """
+
+        blocks = []
+        for dir_path, dir_names, file_names in os.walk(self._get_cache_path()):
+            if dir_path == self._get_cache_path():
+                dir_names[:] = [name for name in dir_names if name != self.TMP_DIR]
+            for name in file_names:
+                path = os.path.join(dir_path, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                blocks.append((stat.st_mtime, path, stat.st_size))
+
+        self._blocks = OrderedDict((path, size) for _, path, size in sorted(blocks))
+        self._size = sum(self._blocks.values())
+
+    def _touch(self, path, size=None):
+        """
+        Mark block as the most recently used, add it into index if `size` is set and evict old blocks.
+        """
+
+        with self._lock:
+            if self._blocks is None:
+                self._load()
+            if size is not None:
+                self._size += size - self._blocks.pop(path, 0)
+                self._blocks[path] = size
+            elif path in self._blocks:
+                self._blocks.move_to_end(path)
+
+            while self._size > app.config.get('STORAGE_CACHE_SIZE') and len(self._blocks) > 1:
+                old_path, old_size = self._blocks.popitem(last=False)
+                self._size -= old_size
+                try:
+                    os.remove(old_path)
+                except FileNotFoundError:
+                    pass
+
+    def _forget(self, prefix):
+        """
+        Remove blocks under `prefix` path from index.
+        """
+
+        with self._lock:
+            if self._blocks is None:
+                return
+            for path in [path for path in self._blocks if path.startswith(prefix)]:
+                self._size -= self._blocks.pop(path)
+
+    def _invalidate(self, storage_id):
+        """
+        Drop cached blocks of a file.
+        """
+
+        dir_path = self._get_cache_path(storage_id)
+        shutil.rmtree(dir_path, ignore_errors=True)
+        self._forget(f'{dir_path}{os.sep}')
+
+    def _prune(self, storage_id, version):
+        """
+        Drop cached blocks of other versions of a file.
+        """
+
+        version_dir = self._get_version_dir(storage_id, version)
+        try:
+            names = os.listdir(self._get_cache_path(storage_id))
+        except FileNotFoundError:
+            return
+        for name in names:
+            dir_path = self._get_cache_path(storage_id, name)
+            if dir_path != version_dir:
+                shutil.rmtree(dir_path, ignore_errors=True)
+                self._forget(f'{dir_path}{os.sep}')
+
+    def _read_block(self, storage_id, version, n):
+        """
+        Return block `n` of a file, fetch it from storage and save into cache if it's not cached yet.
+        Block is shorter than `block_size` if it's the last one, empty if it's after the end of a file.
+        :param storage_id: unique starage id
+        :type storage_id: str
+        :param version: version of a file returned by the storage
+        :type version: str
+        :param n: block number
+        :type n: int
+        :return: block
+        :rtype: bytes
+        """
+
+        path = self._get_block_path(storage_id, version, n)
+        try:
+            with open(path, 'rb') as f:
+                block = f.read()
+            os.utime(path)
+            self._touch(path)
+            return block
+        except FileNotFoundError:
+            pass
+
+        self._prune(storage_id, version)
+        block = self.storage.get_range(storage_id, n * self.block_size, self.block_size)
+        if block:
+            self._write_block(path, block)
+        return block
+
+    def _write_block(self, path, block):
+        """
+        Atomically write a block into cache, cache errors never fail a request.
+        """
+
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                f.write(block)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"CachedStorage:_write_block:{path}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self._touch(path, len(block))
+
+    def _iter_range(self, storage_id, start=0, length=None):
+        """
+        Iterate over cached blocks which cover a range, data out of range is cut off.
+        :return: chunks generator
+        :rtype: generator
+        """
+
+        version = self.storage.get_version(storage_id)
+        end = start + length if length is not None else None
+        n = start // self.block_size
+        offset = start - n * self.block_size
+        while end is None or n * self.block_size < end:
+            block = self._read_block(storage_id, version, n)
+            last = len(block) < self.block_size
+            if end is not None:
+                block = block[:end - n * self.block_size]
+            block = block[offset:]
+            if block:
+                yield block
+            if last:
+                break
+            n += 1
+            offset = 0
+
+    def _iter_cached(self, content, blocks_dir):
+        """
+        Pass `content` through by blocks and save every block into `blocks_dir`.
+        """
+
+        buffer = b''
+        n = 0
+        for chunk in iter_chunks(content):
+            buffer += chunk
+            while len(buffer) >= self.block_size:
+                block, buffer = buffer[:self.block_size], buffer[self.block_size:]
+                self._write_block(os.path.join(blocks_dir, f'{n}.block'), block)
+                n += 1
+                yield block
+        if buffer:
+            self._write_block(os.path.join(blocks_dir, f'{n}.block'), buffer)
+            yield buffer
+
+    def _adopt_blocks(self, tmp_dir, storage_id):
+        """
+        Replace cached blocks of a file with blocks collected in `tmp_dir`, when a file is saved into the storage.
+        """
+
+        self._invalidate(storage_id)
+        if os.path.isdir(tmp_dir):
+            dir_path = self._get_version_dir(storage_id, self.storage.get_version(storage_id))
+            os.makedirs(os.path.dirname(dir_path), exist_ok=True)
+            os.replace(tmp_dir, dir_path)
+            with self._lock:
+                for path in [path for path in self._blocks if path.startswith(f'{tmp_dir}{os.sep}')]:
+                    self._blocks[path.replace(tmp_dir, dir_path, 1)] = self._blocks.pop(path)
+
+    def _write_through(self, write, content):
+        """
+        Call `write` with `content` which is cached by blocks while it's consumed.
+        Blocks are collected in a tmp directory and moved into cache when a file's `storage_id` is known.
+        :param write: callable which stores a content and returns its storage id
+        :type write: callable
+        :param content: file to save
+        :type content: bytes, file-like object or iterable of bytes
+        :return: storage id returned by `write`
+        :rtype: str
+        """
+
+        tmp_dir = self._get_cache_path(self.TMP_DIR, uuid.uuid4().hex)
+        try:
+            storage_id = write(as_file(self._iter_cached(content, tmp_dir)))
+            self._adopt_blocks(tmp_dir, storage_id)
+            return storage_id
+        finally:
+            if os.path.isdir(tmp_dir):
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+            self._forget(f'{tmp_dir}{os.sep}')
+
+    def get(self, storage_id):
+        """
+        Read and return a file based on `storage_id`
+        :param storage_id: unique starage id
+        :type storage_id: str
+        :return: file
+        :rtype: bytes
+        """
+
+        try:
+            return b''.join(self._iter_range(storage_id))
+        except Exception as e:
+            logger.error(f'CachedStorage:get:{storage_id}: {e}')
+            raise e
+
+    def open_read(self, storage_id, start=None, length=None):
+        """
+        Open a file based on `storage_id` for reading, blocks are read from cache or fetched while file is read.
+        :param storage_id: unique starage id
+        :type storage_id: str
+        :param start: file's position to start reading from
+        :type start: int
+        :param length: the number of bytes which will be read
+        :type length: int
+        :return: readable binary file-like object positioned at `start`, it must be closed by a caller
+        :rtype: io.BufferedIOBase
+        """
+
+        try:
+            # fail early if a file does not exist
+            first_block = self._iter_range(storage_id, start or 0, length)
+            chunk = next(first_block, b'')
+        except Exception as e:
+            logger.error(f'CachedStorage:open_read:{storage_id}: {e}')
+            raise e
+
+        def _chunks():
+            yield chunk
+            yield from first_block
+
+        return as_file(_chunks())
+
+    def local_path(self, storage_id):
+        return self.storage.local_path(storage_id)
+
+    def get_range(self, storage_id, start, length):
+        """
+        Read and return a file's chunks based on `storage_id`, only blocks covering the range are fetched
+        :param storage_id: unique starage id
+        :type storage_id: str
+        :param start: start file's position to read
+        :param length: the number of bytes to be read from the file
+        :return: file
+        :rtype: bytes
+        """
+
+        try:
+            return b''.join(self._iter_range(storage_id, start, length))
+        except Exception as e:
+            logger.error(f'CachedStorage:get_range:{storage_id}: {e}')
+            raise e
+
+    def put(self, content, filename, project_id=None, asset_type='project', storage_id=None, content_type=None,
+            override=True):
+        """
+        Save file into a storage and cache.
+        :param content: file to save
+        :type content: bytes, file-like object or iterable of bytes
+        :param filename: name which will be used when store a file
+        :type filename: str
+        :param project_id: unique project id
+        :type project_id: bson.objectid.ObjectId
+        :param asset_type: asset type
+        :type asset_type: str
+        :param storage_id: unique starage id of file
+        :type storage_id: str
+        :param content_type: content type of file
+        :type content_type: str
+        :return: storage id of just saved file
+        :rtype: str
+        """
+
+        return self._write_through(
+            lambda f: self.storage.put(f, filename, project_id, asset_type, storage_id, content_type, override),
+            content
+        )
+
+    def copy(self, src_storage_id, filename, project_id=None, asset_type='project', storage_id=None,
+             override=True):
+        """
+        Copy a file inside a storage, a copy is cached when it's read.
+        :param src_storage_id: storage id of file to copy
+        :type src_storage_id: str
+        :param filename: name which will be used when store a file
+        :type filename: str
+        :param project_id: unique project id
+        :type project_id: bson.objectid.ObjectId
+        :param asset_type: asset type
+        :type asset_type: str
+        :param storage_id: unique starage id of file
+        :type storage_id: str
+        :return: storage id of just copied file
+        :rtype: str
+        """
+
+        storage_id = self.storage.copy(src_storage_id, filename, project_id, asset_type, storage_id, override)
+        self._invalidate(storage_id)
+        return storage_id
+
+    def replace(self, content, storage_id, content_type=None):
+        """
+        Replace a file in the storage and cache
+        :param content: file to replace with
+        :type content: bytes, file-like object or iterable of bytes
+        :param storage_id: starage id of file for replacement
+        :type storage_id: str
+        :param content_type: content type of file
+        :type content_type: str
+        """
+
+        def _replace(f):
+            self.storage.replace(f, storage_id, content_type)
+            return storage_id
+
+        self._write_through(_replace, content)
+
+    def replace_from_path(self, file_path, storage_id, content_type=None):
+        """
+        Replace a file in the storage with a local file, which is removed afterwards.
+        File is cached before it's passed to the storage, so storage can still adopt it.
+        :param file_path: path to a local file to replace with
+        :type file_path: str
+        :param storage_id: starage id of file for replacement
+        :type storage_id: str
+        :param content_type: content type of file
+        :type content_type: str
+        """
+
+        tmp_dir = self._get_cache_path(self.TMP_DIR, uuid.uuid4().hex)
+        try:
+            with open(file_path, 'rb') as f:
+                for _ in self._iter_cached(f, tmp_dir):
+                    pass
+            self.storage.replace_from_path(file_path, storage_id, content_type)
+            self._adopt_blocks(tmp_dir, storage_id)
+        finally:
+            if os.path.isdir(tmp_dir):
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+            self._forget(f'{tmp_dir}{os.sep}')
+
+    def delete(self, storage_id):
+        """
+        Delete a file from the storage and cache
+        :param storage_id: starage id of file to remove
+        :type storage_id: str
+        """
+
+        self._invalidate(storage_id)
+        self.storage.delete(storage_id)
+
+    def delete_many(self, storage_ids):
+        """
+        Delete files from the storage and cache
+        :param storage_ids: starage ids of files to remove
+        :type storage_ids: list
+        :return: storage ids of files which were not removed
+        :rtype: list
+        """
+
+        storage_ids = list(storage_ids)
+        for storage_id in storage_ids:
+            self._invalidate(storage_id)
+        return self.storage.delete_many(storage_ids)
+
+    def list_dirs(self):
+        return self.storage.list_dirs()
+
+    def delete_dir(self, storage_id):
+        """
+        Delete an entire directory where `storage_id` is located from the storage and cache
+        :param storage_id: unique storage
+        :type storage_id: str
+        """
+
+        dir_path = os.path.dirname(self._get_cache_path(storage_id))
+        shutil.rmtree(dir_path, ignore_errors=True)
+        self._forget(f'{dir_path}{os.sep}')
+        self.storage.delete_dir(storage_id)
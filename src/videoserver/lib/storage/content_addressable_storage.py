@@ -0,0 +1,216 @@
+import hashlib
+import os
+import logging
+import uuid
+from tempfile import mkstemp
+
+from flask import current_app as app
+
+from videoserver.lib.utils import get_os_file_size, iter_chunks
+from .file_system_storage import FileSystemStorage
+
+logger = logging.getLogger(__name__)
+
+
+class ContentAddressableStorage(FileSystemStorage):
+    """
+    Content addressable file system storage.
+
+    Every unique content is stored only once as a blob in `.blobs/<sha256[:2]>/<sha256>`, blob's key is computed
+    while content is written. Files addressed by `storage_id` are hard links to blobs, so reading works exactly as
+    in `FileSystemStorage` and file system keeps a reference count of a blob (number of links - 1).
+    When the last file referencing a blob is deleted, blob is deleted too.
+
+    A symlink `.inodes/<inode>` -> `<sha256>` maps blob's inode back to its key, so a file opened from this storage
+    can be stored again (e.g. project duplicate) without reading its content.
+    File system must support hard links.
+    """
+
+    BLOBS_DIR = '.blobs'
+    INODES_DIR = '.inodes'
+    TMP_DIR = '.tmp'
+
+    @staticmethod
+    def _get_service_path(*parts):
+        """
+        Build and return full path inside storage's service directories.
+        :return: path
+        :rtype: str
+        """
+
+        return os.path.join(app.config.get('FS_MEDIA_STORAGE_PATH'), *parts)
+
+    def _get_blob_path(self, key):
+        """
+        Build and return full blob path based on content `key`.
+        :param key: sha256 hex digest of content
+        :type key: str
+        :return: file path
+        :rtype: str
+        """
+
+        return self._get_service_path(self.BLOBS_DIR, key[:2], key)
+
+    def _get_blob_path_by_inode(self, inode):
+        """
+        Return full blob path if file with `inode` is a blob of this storage.
+        :param inode: inode number
+        :type inode: int
+        :return: file path or `None`
+        :rtype: str
+        """
+
+        try:
+            blob_path = self._get_blob_path(os.readlink(self._get_service_path(self.INODES_DIR, str(inode))))
+            if os.stat(blob_path).st_ino == inode:
+                return blob_path
+        except FileNotFoundError:
+            pass
+        return None
+
+    def _link(self, src_path, dst_path):
+        """
+        Atomically create or replace `dst_path` with a hard link to `src_path`.
+        """
+
+        dst_dir = os.path.dirname(dst_path)
+        if not os.path.exists(dst_dir):
+            os.makedirs(dst_dir)
+        tmp_path = f'{dst_path}.{uuid.uuid4().hex}.tmp'
+        os.link(src_path, tmp_path)
+        os.replace(tmp_path, dst_path)
+
+    def _link_content(self, content, file_path):
+        """
+        Store `content` as a blob (if it does not exist yet) and link `file_path` to it.
+        :param content: file to write
+        :type content: bytes, file-like object or iterable of bytes
+        :param file_path: file path
+        :type file_path: str
+        """
+
+        # content is a file of this storage, no need to read it
+        if get_os_file_size(content) is not None:
+            blob_path = self._get_blob_path_by_inode(os.fstat(content.fileno()).st_ino)
+            if blob_path:
+                try:
+                    return self._link(blob_path, file_path)
+                except FileNotFoundError:
+                    # blob was released in the meantime, fall back to a regular write
+                    pass
+
+        # write content into tmp file and compute its key on the fly
+        tmp_dir = self._get_service_path(self.TMP_DIR)
+        if not os.path.exists(tmp_dir):
+            os.makedirs(tmp_dir)
+        fd, tmp_path = mkstemp(dir=tmp_dir)
+        try:
+            content_hash = hashlib.sha256()
+            with open(fd, 'wb') as f:
+                for chunk in iter_chunks(content):
+                    content_hash.update(chunk)
+                    f.write(chunk)
+            key = content_hash.hexdigest()
+            blob_path = self._get_blob_path(key)
+
+            try:
+                # same content was already stored, reuse it
+                return self._link(blob_path, file_path)
+            except FileNotFoundError:
+                pass
+
+            # file owns the content before blob is published, so concurrent release can't lose it
+            self._link(tmp_path, file_path)
+            try:
+                self._link(tmp_path, blob_path)
+                inode_link = self._get_service_path(self.INODES_DIR, str(os.stat(tmp_path).st_ino))
+                if not os.path.exists(os.path.dirname(inode_link)):
+                    os.makedirs(os.path.dirname(inode_link))
+                if os.path.lexists(inode_link):
+                    os.remove(inode_link)
+                os.symlink(key, inode_link)
+            except OSError as e:
+                # file is saved anyway, it's just not shared
+                logger.warning(f'ContentAddressableStorage:blob:{key}: {e}')
+        finally:
+            os.remove(tmp_path)
+
+    def _release(self, inode):
+        """
+        Delete a blob if no files reference it anymore.
+        :param inode: inode number of a deleted file
+        :type inode: int
+        """
+
+        blob_path = self._get_blob_path_by_inode(inode)
+        if blob_path and os.stat(blob_path).st_nlink == 1:
+            os.remove(blob_path)
+            os.remove(self._get_service_path(self.INODES_DIR, str(inode)))
+            logger.info(f"Removed blob '{blob_path}' from fs storage")
+
+    def _write(self, file_path, content):
+        """
+        Link `file_path` to a blob with `content`, release a blob `file_path` was linked to before.
+        :param file_path: file path
+        :type file_path: str
+        :param content: file to write
+        :type content: bytes, file-like object or iterable of bytes
+        """
+
+        old_inode = os.stat(file_path).st_ino if os.path.exists(file_path) else None
+        self._link_content(content, file_path)
+        if old_inode and old_inode != os.stat(file_path).st_ino:
+            self._release(old_inode)
+
+    def _adopt(self, src_path, dst_path):
+        """
+        Store a local file `src_path` as a blob, link `dst_path` to it and remove `src_path`.
+        :param src_path: source file path
+        :type src_path: str
+        :param dst_path: destination file path
+        :type dst_path: str
+        """
+
+        with open(src_path, 'rb') as f:
+            self._write(dst_path, f)
+        os.remove(src_path)
+
+    def _copy_file(self, src_path, dst_path):
+        """
+        Link `dst_path` to the blob of `src_path`.
+        :param src_path: source file path
+        :type src_path: str
+        :param dst_path: destination file path
+        :type dst_path: str
+        """
+
+        with open(src_path, 'rb') as f:
+            self._write(dst_path, f)
+
+    def delete(self, storage_id):
+        """
+        Delete a file from the storage and its blob if it's not referenced anymore
+        :param storage_id: starage id of file to remove
+        :type storage_id: str
+        """
+
+        file_path = self._get_file_path(storage_id)
+        inode = os.stat(file_path).st_ino if os.path.exists(file_path) else None
+        super().delete(storage_id)
+        if inode:
+            self._release(inode)
+
+    def delete_dir(self, storage_id):
+        """
+        Delete an entire folder where `storage_id` is located and blobs which are not referenced anymore
+        :param storage_id: unique storage
+        :type storage_id: str
+        """
+
+        inodes = set()
+        for root, _, files in os.walk(os.path.dirname(self._get_file_path(storage_id))):
+            for name in files:
+                inodes.add(os.stat(os.path.join(root, name)).st_ino)
+        super().delete_dir(storage_id)
+        for inode in inodes:
+            self._release(inode)
@@ -1,14 +1,19 @@
+import fcntl
 import os
 import shutil
 import logging
-from datetime import datetime
+import uuid
 
 from flask import current_app as app
 
+from videoserver.lib.utils import iter_chunks
 from .interface import MediaStorageInterface
 
 logger = logging.getLogger(__name__)
 
+#: ioctl request to share extents of a file (reflink), see ioctl_ficlone(2)
+FICLONE = 0x40049409
+
 
 class FileSystemStorage(MediaStorageInterface):
     """
@@ -28,6 +33,88 @@ class FileSystemStorage(MediaStorageInterface):
 
         return os.path.join(app.config.get('FS_MEDIA_STORAGE_PATH'), storage_id)
 
+    @staticmethod
+    def _get_tmp_path(file_path):
+        """
+        Create parent directory of `file_path` if it does not exist and return a unique tmp path next to it.
+        Files are written into tmp path and renamed, so a file is never seen half written and a new content
+        never changes files which share an inode with the old one (see `copy`).
+        :param file_path: file path
+        :type file_path: str
+        :return: tmp file path
+        :rtype: str
+        """
+
+        file_dir = os.path.dirname(file_path)
+        if not os.path.exists(file_dir):
+            os.makedirs(file_dir)
+
+        return f'{file_path}.{uuid.uuid4().hex}.tmp'
+
+    def _write(self, file_path, content):
+        """
+        Atomically write `content` into `file_path` chunk by chunk.
+        :param file_path: file path
+        :type file_path: str
+        :param content: file to write
+        :type content: bytes, file-like object or iterable of bytes
+        """
+
+        tmp_path = self._get_tmp_path(file_path)
+        try:
+            with open(tmp_path, "wb") as f:
+                for chunk in iter_chunks(content):
+                    f.write(chunk)
+            os.replace(tmp_path, file_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _adopt(self, src_path, dst_path):
+        """
+        Move a local file `src_path` into `dst_path`.
+        It's an atomic rename if both are on the same file system, otherwise a copy.
+        :param src_path: source file path
+        :type src_path: str
+        :param dst_path: destination file path
+        :type dst_path: str
+        """
+
+        try:
+            os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+            os.replace(src_path, dst_path)
+        except OSError:
+            with open(src_path, 'rb') as f:
+                self._write(dst_path, f)
+            os.remove(src_path)
+
+    def _copy_file(self, src_path, dst_path):
+        """
+        Atomically copy `src_path` into `dst_path` without reading it in python.
+        Try reflink (copy-on-write clone) first, then hard link, then in-kernel copy.
+        :param src_path: source file path
+        :type src_path: str
+        :param dst_path: destination file path
+        :type dst_path: str
+        """
+
+        tmp_path = self._get_tmp_path(dst_path)
+        try:
+            try:
+                with open(src_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+                    fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            except OSError:
+                os.remove(tmp_path)
+                try:
+                    # safe since files are never modified in place
+                    os.link(src_path, tmp_path)
+                except OSError:
+                    shutil.copyfile(src_path, tmp_path)
+            os.replace(tmp_path, dst_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
     def get(self, storage_id):
         """
         Read and return a file based on `storage_id`
@@ -46,6 +133,51 @@ class FileSystemStorage(MediaStorageInterface):
 
         return media_file
 
+    def open_read(self, storage_id, start=None, length=None):
+        """
+        Open a file based on `storage_id` for reading.
+        :param storage_id: unique starage id
+        :type storage_id: str
+        :param start: file's position to start reading from
+        :type start: int
+        :param length: the number of bytes which will be read, not used since a whole file is opened
+        :type length: int
+        :return: readable binary file object positioned at `start`, it must be closed by a caller
+        :rtype: io.BufferedReader
+        """
+
+        try:
+            media_file = open(self._get_file_path(storage_id), 'rb')
+            if start:
+                media_file.seek(start)
+            return media_file
+        except Exception as e:
+            logger.error(f'FileSystemStorage:open_read:{storage_id}: {e}')
+            raise e
+
+    def local_path(self, storage_id):
+        """
+        Return a path to a file based on `storage_id`
+        :param storage_id: unique starage id
+        :type storage_id: str
+        :return: file path
+        :rtype: str
+        """
+
+        return self._get_file_path(storage_id)
+
+    def get_version(self, storage_id):
+        """
+        Return a version of a file based on `storage_id`, it's built from inode, mtime and size of a file
+        :param storage_id: unique starage id
+        :type storage_id: str
+        :return: version
+        :rtype: str
+        """
+
+        stat = os.stat(self._get_file_path(storage_id))
+        return f'{stat.st_ino:x}-{stat.st_mtime_ns:x}-{stat.st_size:x}'
+
     def get_range(self, storage_id, start, length):
         """
         Read and return a file's chunks based on `storage_id`
@@ -81,7 +213,7 @@ class FileSystemStorage(MediaStorageInterface):
          - thumbnail:  2019/6/11/5cff82a6fe985e1e3bddb326/thumbnails/3ada91761c6048bdb3dd42a2463d5df8_timeline_00.png
 
         :param content: file to save
-        :type content: bytes
+        :type content: bytes, file-like object or iterable of bytes
         :param filename: name which will be used when store a file
         :type filename: str
         :param project_id: unique project id
@@ -96,33 +228,15 @@ class FileSystemStorage(MediaStorageInterface):
         :rtype: str
         """
 
-        if asset_type == 'project':
-            if not project_id:
-                raise ValueError("Argument 'project_id' is required when 'asset_type' is 'project'")
-            # generate storage_id for project
-            utcnow = datetime.utcnow()
-            storage_id = f'{utcnow.year}/{utcnow.month}/{utcnow.day}/{project_id}/{filename}'
-        else:
-            if not storage_id:
-                raise ValueError("Argument 'storage_id' is required when 'asset_type' is not 'project'")
-            # generate storage_id
-            storage_id = f'{os.path.dirname(storage_id)}/{asset_type}/{filename}'
-
+        storage_id = self.generate_storage_id(filename, project_id, asset_type, storage_id)
         file_path = self._get_file_path(storage_id)
-        # check if file exists
-        if os.path.exists(file_path):
-            if not override:
-                raise Exception(f'File {file_path} already exists, use "replace" method instead.')
-            self.replace(content, storage_id)
+        # check if file exists, it's overridden below
+        if os.path.exists(file_path) and not override:
+            raise Exception(f'File {file_path} already exists, use "replace" method instead.')
 
-        # check if dir exists, if not create it
-        file_dir = os.path.dirname(file_path)
-        if not os.path.exists(file_dir):
-            os.makedirs(file_dir)
         # write stream to file
         try:
-            with open(file_path, "wb") as f:
-                f.write(content)
+            self._write(file_path, content)
         except Exception as e:
             logger.error(f'FileSystemStorage:put:{storage_id}: {e}')
             raise e
@@ -130,11 +244,44 @@ class FileSystemStorage(MediaStorageInterface):
         logger.info(f"Saved file '{storage_id}' to fs storage")
         return storage_id
 
+    def copy(self, src_storage_id, filename, project_id=None, asset_type='project', storage_id=None,
+             override=True):
+        """
+        Copy a file inside a fs storage, file's content is not read by python.
+        Storage id of a new file is generated in the same way as in `put`.
+        :param src_storage_id: storage id of file to copy
+        :type src_storage_id: str
+        :param filename: name which will be used when store a file
+        :type filename: str
+        :param project_id: unique project id
+        :type project_id: bson.objectid.ObjectId
+        :param asset_type: asset type
+        :type asset_type: str
+        :param storage_id: unique starage id of file
+        :type storage_id: str
+        :return: storage id of just copied file
+        :rtype: str
+        """
+
+        storage_id = self.generate_storage_id(filename, project_id, asset_type, storage_id)
+        file_path = self._get_file_path(storage_id)
+        if os.path.exists(file_path) and not override:
+            raise Exception(f'File {file_path} already exists, use "replace" method instead.')
+
+        try:
+            self._copy_file(self._get_file_path(src_storage_id), file_path)
+        except Exception as e:
+            logger.error(f'FileSystemStorage:copy:{src_storage_id}:{storage_id}: {e}')
+            raise e
+
+        logger.info(f"Copied file '{src_storage_id}' to '{storage_id}' in fs storage")
+        return storage_id
+
     def replace(self, content, storage_id, content_type=None):
         """
         Replace a file in the storage
         :param content: file to replace with
-        :type content: bytes
+        :type content: bytes, file-like object or iterable of bytes
         :param storage_id: starage id of file for replacement
         :type storage_id: str
         :param content_type: content type of file
@@ -142,20 +289,36 @@ class FileSystemStorage(MediaStorageInterface):
         """
 
         file_path = self._get_file_path(storage_id)
-        # check if dir exists, if not create it
-        file_dir = os.path.dirname(file_path)
-        if not os.path.exists(file_dir):
-            os.makedirs(file_dir)
         # write stream to file
         try:
-            with open(file_path, "wb") as f:
-                f.write(content)
+            self._write(file_path, content)
         except Exception as e:
             logger.error(f'FileSystemStorage:replace:{storage_id}: {e}')
             raise e
         else:
             logger.info(f'Replaced file "{storage_id}" in fs storage')
 
+    def replace_from_path(self, file_path, storage_id, content_type=None):
+        """
+        Replace a file in the storage with a local file, file is moved into the storage
+        :param file_path: path to a local file to replace with
+        :type file_path: str
+        :param storage_id: starage id of file for replacement
+        :type storage_id: str
+        :param content_type: content type of file
+        :type content_type: str
+        """
+
+        try:
+            self._adopt(file_path, self._get_file_path(storage_id))
+        except Exception as e:
+            logger.error(f'FileSystemStorage:replace_from_path:{storage_id}: {e}')
+            if os.path.exists(file_path):
+                os.remove(file_path)
+            raise e
+        else:
+            logger.info(f'Replaced file "{storage_id}" in fs storage')
+
     def delete(self, storage_id):
         """
         Delete a file from the storage
@@ -171,6 +334,32 @@ class FileSystemStorage(MediaStorageInterface):
         else:
             logger.warning(f"File '{file_path}' was not found in fs storage.")
 
+    @staticmethod
+    def _list_dirs(root):
+        """
+        Return projects' directories under `root`, service directories (starting with '.') are skipped.
+        :param root: storage root path
+        :type root: str
+        :return: directories generator
+        :rtype: generator
+        """
+
+        for dir_path, dir_names, _ in os.walk(root):
+            dir_names[:] = [name for name in dir_names if not name.startswith('.')]
+            rel_path = os.path.relpath(dir_path, root)
+            if rel_path != os.curdir and rel_path.count(os.sep) == 3:
+                dir_names[:] = []
+                yield rel_path.replace(os.sep, '/')
+
+    def list_dirs(self):
+        """
+        Return projects' directories (<year>/<month>/<day>/<project-id>) which exist in the storage.
+        :return: directories generator
+        :rtype: generator
+        """
+
+        return self._list_dirs(app.config.get('FS_MEDIA_STORAGE_PATH'))
+
     def delete_dir(self, storage_id):
         """
         Delete an entire folder where `storage_id` is located
@@ -0,0 +1,287 @@
+import os
+import re
+import logging
+
+from flask import current_app as app
+from gridfs import GridFSBucket
+from gridfs.errors import NoFile
+
+from videoserver.lib.utils import as_file
+from .interface import MediaStorageInterface
+
+logger = logging.getLogger(__name__)
+
+
+class GridFSStorage(MediaStorageInterface):
+    """
+    GridFS storage.
+    Use mongo connection of the app (`app.mongo`) to store files in GridFS, so media is replicated together
+    with a database and no extra service is required.
+
+    `storage_id` is used as GridFS filename. Files are read and written by chunks, ranges are served by fetching
+    only chunks which cover a range.
+    """
+
+    @property
+    def bucket(self):
+        return GridFSBucket(
+            app.mongo.db,
+            bucket_name=app.config.get('GRIDFS_BUCKET_NAME'),
+            chunk_size_bytes=app.config.get('GRIDFS_CHUNK_SIZE')
+        )
+
+    @property
+    def files(self):
+        return app.mongo.db[f"{app.config.get('GRIDFS_BUCKET_NAME')}.files"]
+
+    @property
+    def chunks(self):
+        return app.mongo.db[f"{app.config.get('GRIDFS_BUCKET_NAME')}.chunks"]
+
+    def _open(self, storage_id):
+        """
+        Open the latest revision of a file, raise `FileNotFoundError` if it does not exist.
+        :param storage_id: unique starage id
+        :type storage_id: str
+        :return: gridfs file
+        :rtype: gridfs.grid_file.GridOut
+        """
+
+        try:
+            return self.bucket.open_download_stream_by_name(storage_id)
+        except NoFile:
+            raise FileNotFoundError(f"File '{storage_id}' was not found in gridfs storage.")
+
+    def _delete_files(self, query):
+        """
+        Delete files matching `query` and their chunks using two bulk requests.
+        :param query: query for files collection
+        :type query: dict
+        :return: number of deleted files
+        :rtype: int
+        """
+
+        ids = [doc['_id'] for doc in self.files.find(query, {'_id': 1})]
+        if ids:
+            self.files.delete_many({'_id': {'$in': ids}})
+            self.chunks.delete_many({'files_id': {'$in': ids}})
+        return len(ids)
+
+    def get(self, storage_id):
+        """
+        Read and return a file based on `storage_id`
+        :param storage_id: unique starage id
+        :type storage_id: str
+        :return: file
+        :rtype: bytes
+        """
+
+        try:
+            with self._open(storage_id) as grid_out:
+                return grid_out.read()
+        except Exception as e:
+            logger.error(f'GridFSStorage:get:{storage_id}: {e}')
+            raise e
+
+    def open_read(self, storage_id, start=None, length=None):
+        """
+        Open a file based on `storage_id` for reading, chunks are fetched while file is read.
+        :param storage_id: unique starage id
+        :type storage_id: str
+        :param start: file's position to start reading from
+        :type start: int
+        :param length: the number of bytes which will be read
+        :type length: int
+        :return: readable binary file-like object positioned at `start`, it must be closed by a caller
+        :rtype: gridfs.grid_file.GridOut
+        """
+
+        try:
+            grid_out = self._open(storage_id)
+            if start:
+                grid_out.seek(start)
+            return grid_out
+        except Exception as e:
+            logger.error(f'GridFSStorage:open_read:{storage_id}: {e}')
+            raise e
+
+    def get_version(self, storage_id):
+        """
+        Return a version of a file based on `storage_id`, it's id of the latest revision
+        :param storage_id: unique starage id
+        :type storage_id: str
+        :return: version
+        :rtype: str
+        """
+
+        file_doc = self.files.find_one({'filename': storage_id}, {'_id': 1}, sort=[('uploadDate', -1)])
+        if not file_doc:
+            raise FileNotFoundError(f"File '{storage_id}' was not found in gridfs storage.")
+        return str(file_doc['_id'])
+
+    def get_range(self, storage_id, start, length):
+        """
+        Read and return a file's chunks based on `storage_id`, only chunks covering the range are fetched
+        :param storage_id: unique starage id
+        :type storage_id: str
+        :param start: start file's position to read
+        :param length: the number of bytes to be read from the file
+        :return: file
+        :rtype: bytes
+        """
+
+        try:
+            file_doc = self.files.find_one({'filename': storage_id}, sort=[('uploadDate', -1)])
+            if not file_doc:
+                raise FileNotFoundError(f"File '{storage_id}' was not found in gridfs storage.")
+
+            end = min(start + length, file_doc['length'])
+            if start >= end:
+                return b''
+            chunk_size = file_doc['chunkSize']
+            first_chunk, last_chunk = start // chunk_size, (end - 1) // chunk_size
+            cursor = self.chunks.find(
+                {'files_id': file_doc['_id'], 'n': {'$gte': first_chunk, '$lte': last_chunk}},
+                {'data': 1}
+            ).sort('n', 1)
+            data = b''.join(chunk['data'] for chunk in cursor)
+        except Exception as e:
+            logger.error(f'GridFSStorage:get_range:{storage_id}: {e}')
+            raise e
+
+        offset = start - first_chunk * chunk_size
+        return data[offset:offset + end - start]
+
+    def put(self, content, filename, project_id=None, asset_type='project', storage_id=None, content_type=None,
+            override=True):
+        """
+        Save file into a gridfs storage, see `FileSystemStorage.put` for `storage_id` format.
+        :param content: file to save
+        :type content: bytes, file-like object or iterable of bytes
+        :param filename: name which will be used when store a file
+        :type filename: str
+        :param project_id: unique project id
+        :type project_id: bson.objectid.ObjectId
+        :param asset_type: asset type
+        :type asset_type: str
+        :param storage_id: unique starage id of file
+        :type storage_id: str
+        :param content_type: content type of file
+        :type content_type: str
+        :return: storage id of just saved file
+        :rtype: str
+        """
+
+        storage_id = self.generate_storage_id(filename, project_id, asset_type, storage_id)
+        if not override and self.files.count_documents({'filename': storage_id}, limit=1):
+            raise Exception(f'File {storage_id} already exists, use "replace" method instead.')
+
+        try:
+            self.replace(content, storage_id, content_type)
+        except Exception as e:
+            logger.error(f'GridFSStorage:put:{storage_id}: {e}')
+            raise e
+
+        logger.info(f"Saved file '{storage_id}' to gridfs storage")
+        return storage_id
+
+    def copy(self, src_storage_id, filename, project_id=None, asset_type='project', storage_id=None,
+             override=True):
+        """
+        Copy a file inside a gridfs storage chunk by chunk.
+        :param src_storage_id: storage id of file to copy
+        :type src_storage_id: str
+        :param filename: name which will be used when store a file
+        :type filename: str
+        :param project_id: unique project id
+        :type project_id: bson.objectid.ObjectId
+        :param asset_type: asset type
+        :type asset_type: str
+        :param storage_id: unique starage id of file
+        :type storage_id: str
+        :return: storage id of just copied file
+        :rtype: str
+        """
+
+        with self.open_read(src_storage_id) as grid_out:
+            content_type = (grid_out.metadata or {}).get('contentType')
+            return self.put(grid_out, filename, project_id, asset_type, storage_id, content_type, override)
+
+    def replace(self, content, storage_id, content_type=None):
+        """
+        Replace a file in the storage.
+        A new revision is uploaded first, then older revisions are deleted, so readers never see a partial file.
+        :param content: file to replace with
+        :type content: bytes, file-like object or iterable of bytes
+        :param storage_id: starage id of file for replacement
+        :type storage_id: str
+        :param content_type: content type of file
+        :type content_type: str
+        """
+
+        try:
+            file_id = self.bucket.upload_from_stream(
+                storage_id,
+                as_file(content),
+                metadata={'contentType': content_type} if content_type else None
+            )
+            self._delete_files({'filename': storage_id, '_id': {'$ne': file_id}})
+        except Exception as e:
+            logger.error(f'GridFSStorage:replace:{storage_id}: {e}')
+            raise e
+        else:
+            logger.info(f'Replaced file "{storage_id}" in gridfs storage')
+
+    def delete(self, storage_id):
+        """
+        Delete a file (all its revisions) from the storage
+        :param storage_id: starage id of file to remove
+        :type storage_id: str
+        """
+
+        if self._delete_files({'filename': storage_id}):
+            logger.info(f"Removed '{storage_id}' from gridfs storage")
+        else:
+            logger.warning(f"File '{storage_id}' was not found in gridfs storage.")
+
+    def delete_many(self, storage_ids):
+        """
+        Delete files (all their revisions) from the storage using bulk requests
+        :param storage_ids: starage ids of files to remove
+        :type storage_ids: list
+        :return: storage ids of files which were not removed
+        :rtype: list
+        """
+
+        removed = self._delete_files({'filename': {'$in': list(storage_ids)}})
+        logger.info(f"Removed {removed} files from gridfs storage")
+        return []
+
+    def list_dirs(self):
+        """
+        Return projects' directories (<year>/<month>/<day>/<project-id>) which exist in the storage.
+        :return: directories generator
+        :rtype: generator
+        """
+
+        seen = set()
+        for file_doc in self.files.find({}, {'filename': 1}):
+            parts = file_doc['filename'].split('/', 4)
+            if len(parts) == 5 and '/'.join(parts[:4]) not in seen:
+                seen.add('/'.join(parts[:4]))
+                yield '/'.join(parts[:4])
+
+    def delete_dir(self, storage_id):
+        """
+        Delete all files which have the same prefix (directory) as `storage_id`
+        :param storage_id: unique storage
+        :type storage_id: str
+        """
+
+        prefix = f'{os.path.dirname(storage_id)}/'
+        # anchored prefix regex uses filename index
+        removed = self._delete_files({'filename': {'$regex': f'^{re.escape(prefix)}'}})
+        if removed:
+            logger.info(f"Removed {removed} files with prefix '{prefix}' from gridfs storage")
+        else:
+            logger.warning(f"Prefix '{prefix}' was not found in gridfs storage.")
@@ -1,8 +1,41 @@
 import abc
+import os
+from datetime import datetime
 
 
 class MediaStorageInterface(metaclass=abc.ABCMeta):
 
+    @staticmethod
+    def generate_storage_id(filename, project_id=None, asset_type='project', storage_id=None):
+        """
+        Generate storage id for a new file.
+
+        Use <year>/<month>/<day>/<project-id>/<filename> if `asset_type` is 'project', `project_id` is required.
+        Use <year>/<month>/<day>/<project-id>/<asset_type>/<filename> if `asset_type` is not 'project', `storage_id`
+        of project's video is required.
+        :param filename: name which will be used when store a file
+        :type filename: str
+        :param project_id: unique project id
+        :type project_id: bson.objectid.ObjectId
+        :param asset_type: asset type
+        :type asset_type: str
+        :param storage_id: unique starage id of project's video
+        :type storage_id: str
+        :return: storage id
+        :rtype: str
+        """
+
+        if asset_type == 'project':
+            if not project_id:
+                raise ValueError("Argument 'project_id' is required when 'asset_type' is 'project'")
+            # generate storage_id for project
+            utcnow = datetime.utcnow()
+            return f'{utcnow.year}/{utcnow.month}/{utcnow.day}/{project_id}/{filename}'
+
+        if not storage_id:
+            raise ValueError("Argument 'storage_id' is required when 'asset_type' is not 'project'")
+        return f'{os.path.dirname(storage_id)}/{asset_type}/{filename}'
+
     @abc.abstractmethod
     def get(self, storage_id):
         """
@@ -14,12 +47,29 @@ class MediaStorageInterface(metaclass=abc.ABCMeta):
         """
         pass
 
+    @abc.abstractmethod
+    def open_read(self, storage_id, start=None, length=None):
+        """
+        Open a file based on `storage_id` for reading.
+        Use it instead of `get` for big files, so file is not loaded into memory at once.
+        :param storage_id: unique starage id
+        :type storage_id: str
+        :param start: file's position to start reading from
+        :type start: int
+        :param length: the number of bytes which will be read, a caller must not read more
+        :type length: int
+        :return: readable binary file-like object positioned at `start`, it must be closed by a caller
+        :rtype: io.BufferedIOBase
+        """
+        pass
+
     @abc.abstractmethod
     def put(self, content, filename, project_id, asset_type, storage_id=None, content_type=None):
         """
         Save file into a storage.
+        File-like objects and iterables are written chunk by chunk.
         :param content: file to save
-        :type content: bytes
+        :type content: bytes, file-like object or iterable of bytes
         :param filename: name which will be used when store a file
         :type filename: str
         :param project_id: unique project id
@@ -35,12 +85,31 @@ class MediaStorageInterface(metaclass=abc.ABCMeta):
         """
         pass
 
+    @abc.abstractmethod
+    def copy(self, src_storage_id, filename, project_id=None, asset_type='project', storage_id=None):
+        """
+        Copy a file inside a storage without transferring its content through the app when possible.
+        :param src_storage_id: storage id of file to copy
+        :type src_storage_id: str
+        :param filename: name which will be used when store a file
+        :type filename: str
+        :param project_id: unique project id
+        :type project_id: bson.objectid.ObjectId
+        :param asset_type: asset type
+        :type asset_type: str
+        :param storage_id: unique starage id of file
+        :type storage_id: str
+        :return: storage id of just copied file
+        :rtype: str
+        """
+        pass
+
     @abc.abstractmethod
     def replace(self, content, storage_id, content_type=None):
         """
         Replace a file in the storage
         :param content: file to replace with
-        :type content: bytes
+        :type content: bytes, file-like object or iterable of bytes
         :param storage_id: starage id of file for replacement
         :type storage_id: str
         :param content_type: content type of file
@@ -48,6 +117,68 @@ class MediaStorageInterface(metaclass=abc.ABCMeta):
         """
         pass
 
+    def local_path(self, storage_id):
+        """
+        Return a path to a file on a local file system based on `storage_id`,
+        so tools can read it directly without making a copy.
+        :param storage_id: unique starage id
+        :type storage_id: str
+        :return: file path or `None` if storage does not keep files on a local file system
+        :rtype: str
+        """
+        return None
+
+    def get_version(self, storage_id):
+        """
+        Return a token which changes whenever a file based on `storage_id` is replaced,
+        so copies of a file kept outside the storage can be validated.
+        :param storage_id: unique starage id
+        :type storage_id: str
+        :return: version or `None` if storage can't tell it
+        :rtype: str
+        """
+        return None
+
+    def replace_from_path(self, file_path, storage_id, content_type=None):
+        """
+        Replace a file in the storage with a local file, which is removed afterwards.
+        :param file_path: path to a local file to replace with
+        :type file_path: str
+        :param storage_id: starage id of file for replacement
+        :type storage_id: str
+        :param content_type: content type of file
+        :type content_type: str
+        """
+        try:
+            with open(file_path, 'rb') as f:
+                self.replace(f, storage_id, content_type)
+        finally:
+            os.remove(file_path)
+
+    def put_from_path(self, file_path, filename, project_id=None, asset_type='project', storage_id=None,
+                      content_type=None):
+        """
+        Save a local file into a storage, file is removed afterwards.
+        Storage id of a new file is generated in the same way as in `put`.
+        :param file_path: path to a local file to save
+        :type file_path: str
+        :param filename: name which will be used when store a file
+        :type filename: str
+        :param project_id: unique project id
+        :type project_id: bson.objectid.ObjectId
+        :param asset_type: asset type
+        :type asset_type: str
+        :param storage_id: unique starage id of file
+        :type storage_id: str
+        :param content_type: content type of file
+        :type content_type: str
+        :return: storage id of just saved file
+        :rtype: str
+        """
+        storage_id = self.generate_storage_id(filename, project_id, asset_type, storage_id)
+        self.replace_from_path(file_path, storage_id, content_type)
+        return storage_id
+
     @abc.abstractmethod
     def get_range(self, storage_id, start, length):
         """
@@ -70,6 +201,26 @@ class MediaStorageInterface(metaclass=abc.ABCMeta):
         """
         pass
 
+    def delete_many(self, storage_ids):
+        """
+        Delete files from the storage, storages which support batch requests override it
+        :param storage_ids: starage ids of files to remove
+        :type storage_ids: list
+        :return: storage ids of files which were not removed
+        :rtype: list
+        """
+        for storage_id in storage_ids:
+            self.delete(storage_id)
+        return []
+
+    def list_dirs(self):
+        """
+        Return projects' directories (<year>/<month>/<day>/<project-id>) which exist in the storage.
+        :return: directories generator
+        :rtype: generator
+        """
+        raise NotImplementedError(f'{self.__class__.__name__} does not support listing directories.')
+
     @abc.abstractmethod
     def delete_dir(self, storage_id):
         """
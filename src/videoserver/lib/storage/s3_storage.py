@@ -0,0 +1,383 @@
+import os
+import logging
+
+from flask import current_app as app
+
+from videoserver.lib.utils import as_file
+from .interface import MediaStorageInterface
+
+logger = logging.getLogger(__name__)
+
+
+class S3Storage(MediaStorageInterface):
+    """
+    S3 compatible object storage.
+    Use amazon s3 or any service with s3 protocol (e.g. minio) to store files, `boto3` is required.
+
+    HTTP connections are pooled by a single client, files bigger than `S3_MULTIPART_THRESHOLD` are uploaded
+    by parts in parallel, ranges are read with ranged GET requests.
+    """
+
+    #: max number of keys accepted by a single DeleteObjects request
+    DELETE_BATCH_SIZE = 1000
+
+    def __init__(self):
+        self._client = None
+        self._transfer_config = None
+
+    def _connect(self):
+        """
+        Lazily create s3 client and transfer config.
+        Client is thread safe and keeps a pool of http connections.
+        """
+
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+        from botocore.config import Config
+
+        self._client = boto3.client(
+            's3',
+            endpoint_url=app.config.get('S3_ENDPOINT_URL'),
+            region_name=app.config.get('S3_REGION_NAME'),
+            aws_access_key_id=app.config.get('S3_ACCESS_KEY_ID'),
+            aws_secret_access_key=app.config.get('S3_SECRET_ACCESS_KEY'),
+            config=Config(max_pool_connections=app.config.get('S3_MAX_POOL_CONNECTIONS'))
+        )
+        self._transfer_config = TransferConfig(
+            multipart_threshold=app.config.get('S3_MULTIPART_THRESHOLD'),
+            multipart_chunksize=app.config.get('S3_MULTIPART_CHUNKSIZE'),
+            max_concurrency=app.config.get('S3_MAX_CONCURRENCY'),
+            use_threads=True
+        )
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._connect()
+        return self._client
+
+    @property
+    def transfer_config(self):
+        if self._transfer_config is None:
+            self._connect()
+        return self._transfer_config
+
+    @property
+    def bucket(self):
+        return app.config.get('S3_BUCKET')
+
+    @staticmethod
+    def _is_error(exc, *codes):
+        """
+        Check if `exc` is a botocore client error with one of `codes`
+        """
+
+        return getattr(exc, 'response', {}).get('Error', {}).get('Code') in codes
+
+    def _get_object(self, storage_id, **kwargs):
+        """
+        Send GET request for an object, raise `FileNotFoundError` if it does not exist.
+        :param storage_id: unique starage id
+        :type storage_id: str
+        :return: get_object response
+        :rtype: dict
+        """
+
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=storage_id, **kwargs)
+        except Exception as e:
+            if self._is_error(e, 'NoSuchKey', '404'):
+                raise FileNotFoundError(f"Object '{storage_id}' was not found in s3 storage.")
+            raise e
+
+    def _exists(self, storage_id):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=storage_id)
+        except Exception as e:
+            if self._is_error(e, 'NoSuchKey', '404'):
+                return False
+            raise e
+        return True
+
+    def _upload(self, content, storage_id, content_type=None):
+        """
+        Upload `content` by parts in parallel if it's big enough.
+        """
+
+        extra_args = {'ContentType': content_type} if content_type else None
+        self.client.upload_fileobj(
+            as_file(content), self.bucket, storage_id, ExtraArgs=extra_args, Config=self.transfer_config
+        )
+
+    def get(self, storage_id):
+        """
+        Read and return a file based on `storage_id`
+        :param storage_id: unique starage id
+        :type storage_id: str
+        :return: file
+        :rtype: bytes
+        """
+
+        try:
+            return self._get_object(storage_id)['Body'].read()
+        except Exception as e:
+            logger.error(f'S3Storage:get:{storage_id}: {e}')
+            raise e
+
+    def open_read(self, storage_id, start=None, length=None):
+        """
+        Open a file based on `storage_id` for reading, only requested range is fetched.
+        :param storage_id: unique starage id
+        :type storage_id: str
+        :param start: file's position to start reading from
+        :type start: int
+        :param length: the number of bytes which will be read
+        :type length: int
+        :return: readable binary file-like object, it must be closed by a caller
+        :rtype: botocore.response.StreamingBody
+        """
+
+        kwargs = {}
+        if start or length is not None:
+            end = (start or 0) + length - 1 if length is not None else ''
+            kwargs['Range'] = f'bytes={start or 0}-{end}'
+
+        try:
+            return self._get_object(storage_id, **kwargs)['Body']
+        except Exception as e:
+            logger.error(f'S3Storage:open_read:{storage_id}: {e}')
+            raise e
+
+    def get_version(self, storage_id):
+        """
+        Return a version of an object based on `storage_id`, it's ETag and modification time of an object
+        :param storage_id: unique starage id
+        :type storage_id: str
+        :return: version
+        :rtype: str
+        """
+
+        try:
+            response = self.client.head_object(Bucket=self.bucket, Key=storage_id)
+        except Exception as e:
+            if self._is_error(e, 'NoSuchKey', '404'):
+                raise FileNotFoundError(f"Object '{storage_id}' was not found in s3 storage.")
+            raise e
+        etag = response['ETag'].strip('"')
+        return f"{etag}-{response['LastModified'].timestamp()}"
+
+    def get_range(self, storage_id, start, length):
+        """
+        Read and return a file's chunks based on `storage_id` using ranged GET
+        :param storage_id: unique starage id
+        :type storage_id: str
+        :param start: start file's position to read
+        :param length: the number of bytes to be read from the file
+        :return: file
+        :rtype: bytes
+        """
+
+        try:
+            return self._get_object(storage_id, Range=f'bytes={start}-{start + length - 1}')['Body'].read()
+        except Exception as e:
+            # range starts after the end of a file
+            if self._is_error(e, 'InvalidRange'):
+                return b''
+            logger.error(f'S3Storage:get_range:{storage_id}: {e}')
+            raise e
+
+    def put(self, content, filename, project_id=None, asset_type='project', storage_id=None, content_type=None,
+            override=True):
+        """
+        Save file into a s3 storage, see `FileSystemStorage.put` for `storage_id` format.
+        :param content: file to save
+        :type content: bytes, file-like object or iterable of bytes
+        :param filename: name which will be used when store a file
+        :type filename: str
+        :param project_id: unique project id
+        :type project_id: bson.objectid.ObjectId
+        :param asset_type: asset type
+        :type asset_type: str
+        :param storage_id: unique starage id of file
+        :type storage_id: str
+        :param content_type: content type of file
+        :type content_type: str
+        :return: storage id of just saved file
+        :rtype: str
+        """
+
+        storage_id = self.generate_storage_id(filename, project_id, asset_type, storage_id)
+        if not override and self._exists(storage_id):
+            raise Exception(f'Object {storage_id} already exists, use "replace" method instead.')
+
+        try:
+            self._upload(content, storage_id, content_type)
+        except Exception as e:
+            logger.error(f'S3Storage:put:{storage_id}: {e}')
+            raise e
+
+        logger.info(f"Saved file '{storage_id}' to s3 storage")
+        return storage_id
+
+    def copy(self, src_storage_id, filename, project_id=None, asset_type='project', storage_id=None,
+             override=True):
+        """
+        Copy a file inside a s3 storage, data is copied by s3 server (by parts if it's big).
+        :param src_storage_id: storage id of file to copy
+        :type src_storage_id: str
+        :param filename: name which will be used when store a file
+        :type filename: str
+        :param project_id: unique project id
+        :type project_id: bson.objectid.ObjectId
+        :param asset_type: asset type
+        :type asset_type: str
+        :param storage_id: unique starage id of file
+        :type storage_id: str
+        :return: storage id of just copied file
+        :rtype: str
+        """
+
+        storage_id = self.generate_storage_id(filename, project_id, asset_type, storage_id)
+        if not override and self._exists(storage_id):
+            raise Exception(f'Object {storage_id} already exists, use "replace" method instead.')
+
+        try:
+            self.client.copy(
+                {'Bucket': self.bucket, 'Key': src_storage_id}, self.bucket, storage_id, Config=self.transfer_config
+            )
+        except Exception as e:
+            logger.error(f'S3Storage:copy:{src_storage_id}:{storage_id}: {e}')
+            raise e
+
+        logger.info(f"Copied file '{src_storage_id}' to '{storage_id}' in s3 storage")
+        return storage_id
+
+    def replace(self, content, storage_id, content_type=None):
+        """
+        Replace a file in the storage
+        :param content: file to replace with
+        :type content: bytes, file-like object or iterable of bytes
+        :param storage_id: starage id of file for replacement
+        :type storage_id: str
+        :param content_type: content type of file
+        :type content_type: str
+        """
+
+        try:
+            self._upload(content, storage_id, content_type)
+        except Exception as e:
+            logger.error(f'S3Storage:replace:{storage_id}: {e}')
+            raise e
+        else:
+            logger.info(f'Replaced file "{storage_id}" in s3 storage')
+
+    def replace_from_path(self, file_path, storage_id, content_type=None):
+        """
+        Replace a file in the storage with a local file, which is removed afterwards.
+        Parts of a big file are read and uploaded in parallel.
+        :param file_path: path to a local file to replace with
+        :type file_path: str
+        :param storage_id: starage id of file for replacement
+        :type storage_id: str
+        :param content_type: content type of file
+        :type content_type: str
+        """
+
+        extra_args = {'ContentType': content_type} if content_type else None
+        try:
+            self.client.upload_file(
+                file_path, self.bucket, storage_id, ExtraArgs=extra_args, Config=self.transfer_config
+            )
+        except Exception as e:
+            logger.error(f'S3Storage:replace_from_path:{storage_id}: {e}')
+            raise e
+        else:
+            logger.info(f'Replaced file "{storage_id}" in s3 storage')
+        finally:
+            os.remove(file_path)
+
+    def delete(self, storage_id):
+        """
+        Delete a file from the storage
+        :param storage_id: starage id of file to remove
+        :type storage_id: str
+        """
+
+        self.client.delete_object(Bucket=self.bucket, Key=storage_id)
+        logger.info(f"Removed '{storage_id}' from s3 storage")
+
+    def _delete_objects(self, keys):
+        """
+        Send DeleteObjects request, in quiet mode failed keys are reported only in `Errors` of a response.
+        :param keys: keys of objects to remove
+        :type keys: list
+        :return: keys of objects which were not removed
+        :rtype: list
+        """
+
+        response = self.client.delete_objects(
+            Bucket=self.bucket, Delete={'Objects': [{'Key': key} for key in keys], 'Quiet': True}
+        )
+        errors = response.get('Errors', [])
+        for error in errors:
+            logger.error(f"Failed to remove '{error['Key']}' from s3 storage: "
+                         f"{error.get('Code')} {error.get('Message')}")
+        return [error['Key'] for error in errors]
+
+    def delete_many(self, storage_ids):
+        """
+        Delete objects from the storage using batch requests
+        :param storage_ids: starage ids of objects to remove
+        :type storage_ids: list
+        :return: storage ids of objects which were not removed
+        :rtype: list
+        """
+
+        storage_ids = list(storage_ids)
+        failed = []
+        for i in range(0, len(storage_ids), self.DELETE_BATCH_SIZE):
+            failed.extend(self._delete_objects(storage_ids[i:i + self.DELETE_BATCH_SIZE]))
+        logger.info(f"Removed {len(storage_ids) - len(failed)} objects from s3 storage")
+        return failed
+
+    def list_dirs(self):
+        """
+        Return projects' directories (<year>/<month>/<day>/<project-id>) which exist in the storage.
+        :return: directories generator
+        :rtype: generator
+        """
+
+        seen = set()
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket):
+            for obj in page.get('Contents', []):
+                parts = obj['Key'].split('/', 4)
+                if len(parts) == 5 and '/'.join(parts[:4]) not in seen:
+                    seen.add('/'.join(parts[:4]))
+                    yield '/'.join(parts[:4])
+
+    def delete_dir(self, storage_id):
+        """
+        Delete all objects which have the same prefix (directory) as `storage_id`, using batch requests
+        :param storage_id: unique storage
+        :type storage_id: str
+        """
+
+        prefix = f'{os.path.dirname(storage_id)}/'
+        paginator = self.client.get_paginator('list_objects_v2')
+        removed = 0
+        failed = []
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix,
+                                       PaginationConfig={'PageSize': self.DELETE_BATCH_SIZE}):
+            keys = [obj['Key'] for obj in page.get('Contents', [])]
+            if keys:
+                errors = self._delete_objects(keys)
+                failed.extend(errors)
+                removed += len(keys) - len(errors)
+
+        if failed:
+            raise OSError(f"Failed to remove {len(failed)} objects with prefix '{prefix}' from s3 storage.")
+        if removed:
+            logger.info(f"Removed {removed} objects with prefix '{prefix}' from s3 storage")
+        else:
+            logger.warning(f"Prefix '{prefix}' was not found in s3 storage.")
@@ -0,0 +1,170 @@
+import bisect
+import hashlib
+import os
+import shutil
+import logging
+
+from flask import current_app as app
+
+from .file_system_storage import FileSystemStorage
+
+logger = logging.getLogger(__name__)
+
+
+class ShardedFileSystemStorage(FileSystemStorage):
+    """
+    File system storage sharded across multiple roots (e.g. mount points of different disks).
+
+    Roots are listed in `FS_MEDIA_STORAGE_PATHS`. Project's directory <year>/<month>/<day>/<project-id> is placed
+    on a root chosen by consistent hashing, so all assets of a project are on the same shard and adding a root moves
+    only ~1/N of projects. Files which are not moved yet are found on other roots, use `rebalance` to move them.
+    """
+
+    #: number of points of every root on a hash ring
+    VIRTUAL_NODES = 128
+
+    def __init__(self):
+        self._rings = {}
+
+    @staticmethod
+    def _hash(key):
+        return int(hashlib.md5(key.encode()).hexdigest()[:16], 16)
+
+    @staticmethod
+    def _get_shard_key(storage_id):
+        """
+        Return project's directory of `storage_id`, files are sharded by it.
+        :param storage_id: unique starage id
+        :type storage_id: str
+        :return: shard key
+        :rtype: str
+        """
+
+        return '/'.join(storage_id.split('/', 4)[:4])
+
+    @property
+    def roots(self):
+        return tuple(app.config.get('FS_MEDIA_STORAGE_PATHS') or (app.config.get('FS_MEDIA_STORAGE_PATH'),))
+
+    def _get_ring(self, roots):
+        """
+        Build (once for `roots`) and return a hash ring.
+        :param roots: storage roots
+        :type roots: tuple
+        :return: sorted hashes, roots of hashes
+        :rtype: tuple
+        """
+
+        if roots not in self._rings:
+            points = sorted(
+                (self._hash(f'{root}#{i}'), root) for root in roots for i in range(self.VIRTUAL_NODES)
+            )
+            self._rings[roots] = ([point[0] for point in points], [point[1] for point in points])
+        return self._rings[roots]
+
+    def _get_root(self, storage_id):
+        """
+        Return a root where `storage_id` belongs to.
+        :param storage_id: unique starage id
+        :type storage_id: str
+        :return: root path
+        :rtype: str
+        """
+
+        hashes, ring_roots = self._get_ring(self.roots)
+        index = bisect.bisect(hashes, self._hash(self._get_shard_key(storage_id))) % len(hashes)
+        return ring_roots[index]
+
+    def _get_file_path(self, storage_id):
+        """
+        Build and return full file path based on `storage_id`.
+        If a file is not on its shard yet, but exists on another root (not rebalanced), path to it is returned.
+        :param storage_id: unique starage id
+        :type storage_id: str
+        :return: file path
+        :rtype: str
+        """
+
+        root = self._get_root(storage_id)
+        file_path = os.path.join(root, storage_id)
+        if os.path.exists(file_path):
+            return file_path
+
+        for other_root in self.roots:
+            if other_root != root and os.path.exists(os.path.join(other_root, storage_id)):
+                return os.path.join(other_root, storage_id)
+        return file_path
+
+    def list_dirs(self):
+        """
+        Return projects' directories (<year>/<month>/<day>/<project-id>) which exist on any root.
+        :return: directories generator
+        :rtype: generator
+        """
+
+        seen = set()
+        for root in self.roots:
+            for dir_storage_id in self._list_dirs(root):
+                if dir_storage_id not in seen:
+                    seen.add(dir_storage_id)
+                    yield dir_storage_id
+
+    def delete_dir(self, storage_id):
+        """
+        Delete an entire folder where `storage_id` is located on all roots
+        :param storage_id: unique storage
+        :type storage_id: str
+        """
+
+        removed = False
+        for root in self.roots:
+            dir_path = os.path.dirname(os.path.join(root, storage_id))
+            if os.path.isdir(dir_path):
+                shutil.rmtree(dir_path)
+                logger.info(f"Removed '{dir_path}' from fs storage")
+                removed = True
+
+        if not removed:
+            logger.warning(f"Directory '{os.path.dirname(storage_id)}' was not found in fs storage.")
+
+    def rebalance(self):
+        """
+        Move projects' directories which are not on their shards, e.g. after a root was added.
+        Files are renamed if roots share a file system, otherwise copied and removed.
+        :return: number of moved projects
+        :rtype: int
+        """
+
+        moved = 0
+        for root in self.roots:
+            for dir_storage_id in list(self._list_dirs(root)):
+                target_root = self._get_root(dir_storage_id)
+                if target_root == root:
+                    continue
+                self._move_dir(os.path.join(root, dir_storage_id), os.path.join(target_root, dir_storage_id))
+                moved += 1
+                logger.info(f"Moved '{dir_storage_id}' from '{root}' to '{target_root}'")
+
+        return moved
+
+    def _move_dir(self, src_dir, dst_dir):
+        """
+        Move all files from `src_dir` into `dst_dir` and remove empty directories of `src_dir`.
+        Files which are being written are left in place, so a project can be moved while it's edited.
+        """
+
+        for dir_path, _, file_names in os.walk(src_dir):
+            target_dir = os.path.join(dst_dir, os.path.relpath(dir_path, src_dir))
+            os.makedirs(target_dir, exist_ok=True)
+            for name in file_names:
+                # skip files which are being written: tmp files of a storage and hidden outputs of a video editor,
+                # which are adopted by a storage when they are complete
+                if name.endswith('.tmp') or name.startswith('.'):
+                    continue
+                self._adopt(os.path.join(dir_path, name), os.path.join(target_dir, name))
+
+        for dir_path, _, _ in os.walk(src_dir, topdown=False):
+            try:
+                os.rmdir(dir_path)
+            except OSError:
+                pass
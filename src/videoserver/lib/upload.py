@@ -0,0 +1,115 @@
+import hashlib
+import logging
+import os
+from tempfile import mkstemp
+
+from flask import Request as BaseRequest
+from flask import current_app as app
+from werkzeug.exceptions import BadRequest
+
+from .video_editor import get_video_editor
+
+logger = logging.getLogger(__name__)
+
+
+class UploadFile:
+    """
+    Named tmp file which receives an uploaded file and computes its checksum while it's written.
+    Uploaded video is written only once: it's probed in place and then adopted by a storage
+    (renamed if `UPLOAD_TMP_PATH` is on the same file system as a storage).
+
+    If `codecs` are set, leading `probe_size` bytes are probed as soon as they are received and an upload with
+    an unsupported codec is rejected before the rest of it is received.
+    """
+
+    def __init__(self, dir=None, codecs=None, probe_size=None):
+        """
+        :param dir: directory for a tmp file, system tmp directory is used if not set
+        :type dir: str
+        :param codecs: supported codecs
+        :type codecs: tuple
+        :param probe_size: number of leading bytes to probe
+        :type probe_size: int
+        """
+
+        if dir:
+            os.makedirs(dir, exist_ok=True)
+        fd, self.path = mkstemp(dir=dir, suffix='.upload')
+        self._file = os.fdopen(fd, 'w+b')
+        self._hash = hashlib.sha256()
+        self._codecs = codecs
+        self._probe_size = probe_size
+        self._head = bytearray() if codecs and probe_size else None
+
+    @property
+    def checksum(self):
+        """
+        :return: sha256 hex digest of written content
+        :rtype: str
+        """
+
+        return self._hash.hexdigest()
+
+    def write(self, data):
+        self._hash.update(data)
+        if self._head is not None:
+            self._head += data
+            if len(self._head) >= self._probe_size:
+                head, self._head = bytes(self._head), None
+                self._check_codec(head)
+        return self._file.write(data)
+
+    def _check_codec(self, head):
+        """
+        Probe leading bytes of a file, close and remove a file if its codec is not supported.
+        :param head: leading bytes of a file
+        :type head: bytes
+        """
+
+        try:
+            codec_name = get_video_editor().get_meta(head, probe_size=len(head)).get('codec_name')
+        except Exception as e:
+            # e.g. mp4 with an index at the end, codec is checked when the whole file is received
+            logger.info(f'UploadFile:_check_codec:{self.path}: {e}')
+            return
+
+        if codec_name not in self._codecs:
+            self.close()
+            raise BadRequest({'file': [f"Codec: '{codec_name}' is not supported."]})
+
+    def close(self):
+        """
+        Close file and remove it unless it was adopted by a storage.
+        """
+
+        self._file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class Request(BaseRequest):
+    """
+    Request which receives uploaded files into `UploadFile`.
+    """
+
+    #: codecs supported by a view, set it before accessing `files` to reject unsupported uploads early
+    upload_codecs = None
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return UploadFile(
+            dir=app.config.get('UPLOAD_TMP_PATH'),
+            codecs=self.upload_codecs,
+            probe_size=app.config.get('UPLOAD_PROBE_SIZE')
+        )
@@ -1,14 +1,17 @@
+import io
 import json
+import os
 import uuid
 from datetime import datetime
 from tempfile import mkstemp
 import logging
 
 import bson
-from flask import Response, make_response
+from flask import Response
 from flask import current_app as app
-from flask import url_for
+from flask import request, url_for
 from werkzeug.exceptions import BadRequest
+from werkzeug.wsgi import wrap_file
 
 from .validator import Validator
 
@@ -240,11 +243,83 @@ def get_request_address(request_headers):
     return request_headers.get('HTTP_X_FORWARDED_FOR') or request_headers.get('REMOTE_ADDR')
 
 
+def iter_chunks(content, chunk_size=None, length=None):
+    """
+    Iterate over `content` chunk by chunk, without loading it into memory at once.
+    :param content: bytes, file-like object or iterable of bytes
+    :type content: bytes, file-like object or iterable
+    :param chunk_size: max size of chunk to read from a file-like object
+    :type chunk_size: int
+    :param length: max number of bytes to read from a file-like object, read until EOF if not set
+    :type length: int
+    :return: chunks generator
+    :rtype: generator
+    """
+
+    if chunk_size is None:
+        chunk_size = app.config.get('STORAGE_CHUNK_SIZE')
+
+    if isinstance(content, (bytes, bytearray, memoryview)):
+        yield content if length is None else content[:length]
+    elif hasattr(content, 'read'):
+        remaining = length
+        while remaining is None or remaining > 0:
+            chunk = content.read(chunk_size if remaining is None else min(chunk_size, remaining))
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+    else:
+        for chunk in content:
+            yield chunk
+
+
+class ChunksReader(io.RawIOBase):
+    """
+    Readable file-like object over an iterable of bytes
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer:
+            try:
+                self._buffer = next(self._chunks)
+            except StopIteration:
+                return 0
+        size = min(len(b), len(self._buffer))
+        b[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
+def as_file(content):
+    """
+    Represent `content` as a readable file-like object
+    :param content: bytes, file-like object or iterable of bytes
+    :type content: bytes, file-like object or iterable
+    :return: file-like object
+    :rtype: file-like object
+    """
+
+    if isinstance(content, (bytes, bytearray, memoryview)):
+        return io.BytesIO(content)
+    if hasattr(content, 'read'):
+        return content
+    return io.BufferedReader(ChunksReader(content))
+
+
 def create_temp_file(file_stream, suffix=None):
     """
     Saves `file_stream` into /tmp directory
     :param file_stream: file to save
-    :type file_stream: bytes
+    :type file_stream: bytes, file-like object or iterable of bytes
     :param suffix: the file name will end with that suffix, otherwise there will be no suffix.
     :type suffix: str
     :return: file path
@@ -254,14 +329,34 @@ def create_temp_file(file_stream, suffix=None):
     fd, path = mkstemp(suffix=suffix)
 
     with open(fd, "wb") as f:
-        f.write(file_stream)
+        for chunk in iter_chunks(file_stream):
+            f.write(chunk)
 
     return path
 
 
+def get_os_file_size(file_obj):
+    """
+    Return size of a file backed by an OS file descriptor.
+    :param file_obj: file-like object
+    :type file_obj: file-like object
+    :return: file size or `None` if `file_obj` is not backed by an OS file
+    :rtype: int
+    """
+
+    try:
+        return os.fstat(file_obj.fileno()).st_size
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return None
+
+
 def storage2response(storage_id, headers=None, status=200, start=None, length=None):
     """
-    Fetch binary using `storage_id` and return http response.
+    Open binary using `storage_id` and return http response which streams it.
+
+    If the requested part of a file lasts until the end of a file and storage returns an OS file,
+    the file is handed over to `wsgi.file_wrapper`, so WSGI server can send it with `sendfile`
+    and no copies are made in user space. Otherwise file is streamed chunk by chunk.
 
     :param storage_id: Unique storage id
     :type storage_id: str
@@ -280,11 +375,69 @@ def storage2response(storage_id, headers=None, status=200, start=None, length=No
     if not headers:
         headers = {}
 
-    if start is not None:
-        bytes = app.fs.get_range(storage_id, start, length)
-    else:
-        bytes = app.fs.get(storage_id)
+    media_file = app.fs.open_read(storage_id, start=start, length=length)
+    chunk_size = app.config.get('STORAGE_CHUNK_SIZE')
+
+    file_size = get_os_file_size(media_file)
+    if file_size is not None and (length is None or (start or 0) + length >= file_size):
+        # file wrapper reads until EOF, it's fine since tail of a file is requested
+        return Response(wrap_file(request.environ, media_file, chunk_size), headers=headers,
+                        direct_passthrough=True), status
+
+    def generate():
+        # response body is consumed after the request context is gone, so file is closed here
+        with media_file:
+            yield from iter_chunks(media_file, chunk_size=chunk_size, length=length)
 
-    resp = make_response(bytes)
-    resp.headers = headers
+    resp = Response(generate(), headers=headers, direct_passthrough=True)
     return resp, status
+
+
+def cached_storage2response(storage_id, version, headers=None, size=None, start=None):
+    """
+    Return http response with a small file (or a part of a pack file), which is kept in `app.media_cache`
+    after it was read. Files bigger than `MEDIA_CACHE_MAX_ITEM_SIZE` are streamed by `storage2response`,
+    so are files which size is neither given nor known from an OS file.
+
+    :param storage_id: Unique storage id
+    :type storage_id: str
+    :param version: version of a project, files are cached per version
+    :type version: int
+    :param headers: header for response
+    :type headers: dict
+    :param size: file size if it's known, required if `start` is set
+    :type size: int
+    :param start: position of a file inside a pack file
+    :type start: int
+    :return: response
+    :rtype: flask.wrappers.Response
+    """
+
+    length = size if start is not None else None
+    cache = app.media_cache
+    max_item_size = cache.max_item_size or cache.max_size
+    if not cache.max_size or (size is not None and size > max_item_size):
+        return storage2response(storage_id, headers, start=start, length=length)
+
+    headers = dict(headers or {})
+    key = (storage_id, version, start)
+    content = cache.get(key)
+    if content is not None:
+        headers['X-Cache'] = 'HIT'
+        return Response(content, headers=headers), 200
+
+    if start is not None:
+        content = app.fs.get_range(storage_id, start, length)
+    else:
+        media_file = app.fs.open_read(storage_id)
+        with media_file:
+            if size is None:
+                size = get_os_file_size(media_file)
+            if size is not None and size <= max_item_size:
+                content = media_file.read()
+        if content is None:
+            return storage2response(storage_id, headers)
+    cache.set(key, content)
+    headers['X-Cache'] = 'MISS'
+
+    return Response(content, headers=headers), 200
@@ -1,6 +1,7 @@
 from flask import current_app as app
 
 from .ffmpeg import FFMPEGVideoEditor
+from .keyframe_index import KeyframeIndex
 from .moviepy import MoviePyVideoEditor
 
 
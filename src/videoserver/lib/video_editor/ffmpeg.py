@@ -1,13 +1,20 @@
 import json
 import logging
 import os
+import re
 import shlex
+import shutil
+import struct
 import subprocess
+import tempfile
+import uuid
+from contextlib import ExitStack, contextmanager
 
 from flask import current_app as app
 
 from videoserver.lib.utils import create_temp_file
 from .interface import VideoEditorInterface
+from .keyframe_index import KeyframeIndex
 
 logger = logging.getLogger(__name__)
 
@@ -28,114 +35,556 @@ class FFMPEGVideoEditor(VideoEditorInterface):
       https://trac.ffmpeg.org/wiki/Scaling
     """
 
-    def get_meta(self, filestream, extension='tmp'):
+    #: max duration of media (in microseconds) ffprobe analyzes when only leading bytes of a file are probed
+    PROBE_ANALYZE_DURATION = 5 * 1000 * 1000
+    #: timeline thumbnails which are closer (in seconds) are captured by decoding a video once,
+    #: otherwise by seeking to every thumbnail, which decodes a video from a previous keyframe
+    TIMELINE_SEEK_MIN_INTERVAL = 10
+    #: x264 constant rate factor of GOPs re-encoded by a smart trim, visually lossless to blend with copied ones
+    SMART_TRIM_CRF = 18
+    #: ffprobe h264 profiles and matching x264 profiles, other profiles are trimmed by re-encoding a whole video
+    X264_PROFILES = {
+        'Constrained Baseline': 'baseline',
+        'Baseline': 'baseline',
+        'Main': 'main',
+        'High': 'high',
+        'High 10': 'high10',
+        'High 4:2:2': 'high422',
+        'High 4:4:4 Predictive': 'high444',
+    }
+    #: containers which keep a display matrix, a video in them is rotated without re-encoding
+    DISPLAY_MATRIX_EXTENSIONS = ('mp4', 'mov', 'm4v', '3gp')
+    #: streams kept by an edit: the first video, all audio and subtitle streams, muxers can't write copied data
+    #: streams, e.g. mov/mp4 muxer writes a timecode track from video's metadata instead
+    EDIT_STREAMS_MAP = ('-map', '0:v:0', '-map', '0:a?', '-map', '0:s?')
+    #: `ffmpeg -h` output by topic, capabilities of ffmpeg binary are probed once per process
+    _ffmpeg_help = {}
+
+    @staticmethod
+    @contextmanager
+    def _local_file(stream_file, suffix=None):
+        """
+        Provide a local file path for `stream_file`.
+        If `stream_file` is already a path, use it as is, otherwise save it into a tmp file while context lasts.
+        :param stream_file: file or path to a local file
+        :type stream_file: str, bytes or file-like object
+        :param suffix: tmp file suffix
+        :type suffix: str
+        :return: file path
+        :rtype: str
+        """
+
+        if isinstance(stream_file, str):
+            yield stream_file
+            return
+
+        path = create_temp_file(stream_file, suffix=suffix)
+        try:
+            yield path
+        finally:
+            os.remove(path)
+
+    def get_meta(self, filestream, extension='tmp', probe_size=None):
         """
         Use ffmpeg tool for getting metadata of file
-        :param filestream: file to get meta from
-        :type filestream: bytes
+        :param filestream: file to get meta from or path to a local file
+        :type filestream: str, bytes or file-like object
+        :param probe_size: if set, only leading `probe_size` bytes are piped into ffprobe without saving a file,
+                           e.g. to check a codec of a partially received upload. `size` is not returned
+        :type probe_size: int
         :return: metadata
         :rtype: dict
         """
 
-        file_temp_path = create_temp_file(filestream)
-        try:
-            metadata = self._get_meta(file_temp_path)
-        finally:
-            os.remove(file_temp_path)
+        if probe_size:
+            if isinstance(filestream, str):
+                with open(filestream, 'rb') as f:
+                    head = f.read(probe_size)
+            elif isinstance(filestream, (bytes, bytearray)):
+                head = bytes(filestream[:probe_size])
+            else:
+                head = filestream.read(probe_size)
+            return self._get_meta('pipe:0', head=head)
 
-        return metadata
+        with self._local_file(filestream) as file_path:
+            return self._get_meta(file_path)
 
-    def edit_video(self, stream_file, filename, trim=None, crop=None, rotate=None, scale=None):
+    def edit_video(self, stream_file, filename, trim=None, crop=None, rotate=None, scale=None, trim_mode=None,
+                   keyframes=None, encoder_profile=None):
         """
-        Use ffmpeg tool for edit video
-        :param stream_file: file to edit
-        :type stream_file: bytes
+        Use ffmpeg tool for edit video.
+        If `stream_file` is a path, edited file is created in the same directory, so storage can adopt it
+        by renaming, otherwise in a tmp directory.
+        :param stream_file: file to edit or path to a local file
+        :type stream_file: str, bytes or file-like object
         :param filename: filename for tmp file
         :type filename: str
         :param trim: trim editing rules
         :type trim: dict
         :param crop: crop editing rules
         :type crop: dict
-        :param video_rotate: rotate degree
+        :param video_rotate: rotate degree, if a video isn't re-encoded because of other rules,
+                             only its display matrix is changed
         :type video_rotate: int
         :param scale: width scale to
         :type scale: int
-        :return:
+        :param trim_mode: 'encode' (default) to cut exactly and re-encode a video, 'copy' to copy streams
+                          without re-encoding, cut points are snapped to keyframes and returned in metadata's `trim`,
+                          'smart' to cut exactly, re-encoding only GOPs around cut points
+        :type trim_mode: str
+        :param keyframes: keyframe index of a video, it's built if it's required
+        :type keyframes: videoserver.lib.video_editor.keyframe_index.KeyframeIndex
+        :param encoder_profile: name of a profile in `FFMPEG_ENCODER_PROFILES`, `FFMPEG_ENCODER_PROFILE` if not set
+        :type encoder_profile: str
+        :return: path to edited file (must be removed or adopted by a caller), metadata
+        :rtype: str, dict
         """
 
         # file extension is required by ffmpeg
-        path_input = create_temp_file(stream_file, suffix=f".{filename.rsplit('.', 1)[-1]}")
-        path_output = '{}_edit.{}'.format(*path_input.rsplit('.', 1))
-        filter_string = ''
-        try:
-            # get option for trim
-            trim_option = (
-                '-ss', str(trim['start']),
-                '-t', str(trim['end'] - trim['start']),
-                '-qscale', '0',
-            ) if trim else tuple()
-            # crop
-            # https://ffmpeg.org/ffmpeg-filters.html#crop
-            if crop:
-                filter_string += f'crop={crop["width"]}:{crop["height"]}:{crop["x"]}:{crop["y"]}'
-            # scale
-            # http://ffmpeg.org/ffmpeg-filters.html#scale
-            # https://trac.ffmpeg.org/wiki/Scaling
-            if scale:
-                filter_string += ',' if filter_string != '' else ''
-                # avoid width not divisible by 2
-                if scale % 2 == 1:
-                    scale -= 1
-                filter_string += f"scale={scale}:-2"
-            # rotate
-            # https://ffmpeg.org/ffmpeg-all.html#transpose
-            # 0 = 90CounterCLockwise and Vertical Flip (default)
-            # 1 = 90Clockwise
-            # 2 = 90CounterClockwise
-            # 3 = 90Clockwise and Vertical Flip
-            if rotate:
-                rotate_string = ''
-                if rotate == 90:
-                    rotate_string = 'transpose=1'
-                elif rotate == -90:
-                    rotate_string = 'transpose=2'
-                elif rotate == 180:
-                    rotate_string = 'transpose=1,transpose=1'
-                elif rotate == -180:
-                    rotate_string = 'transpose=2,transpose=2'
-                elif rotate == 270:
-                    rotate_string = 'transpose=1,transpose=1,transpose=1'
-                elif rotate == -270:
-                    rotate_string = 'transpose=2,transpose=2,transpose=2'
-                filter_string += ',' if filter_string != '' else ''
-                filter_string += rotate_string
-            # get option for filter
-            filter_option = ('-filter:v', filter_string) if filter_string else tuple()
-            # run ffmpeg
-            if filter_option or trim_option:
-                # combine trim and filter to run one time
+        ext = filename.rsplit('.', 1)[-1]
+        output_dir = os.path.dirname(stream_file) if isinstance(stream_file, str) else tempfile.gettempdir()
+        path_output = os.path.join(output_dir, f'.{uuid.uuid4().hex}_edit.{ext}')
+        with self._local_file(stream_file, suffix=f'.{ext}') as path_input:
+            try:
+                # rotate by a display matrix if video is copied
+                rotation_preoptions, rotation_options = tuple(), tuple()
+                rotate_by_matrix = rotate and not (crop or scale) and (not trim or trim_mode == 'copy') \
+                    and ext.lower() in self.DISPLAY_MATRIX_EXTENSIONS
+                if rotate_by_matrix:
+                    rotation_preoptions, rotation_options = self._get_rotation_options(
+                        self._get_display_rotation(path_input, rotate)
+                    )
+                    rotate = None
+                if trim and trim_mode == 'copy' and not rotate:
+                    # copy streams from a keyframe preceding start up to a keyframe following end
+                    if not keyframes:
+                        keyframes = self.get_keyframe_index(path_input)
+                    start, end = keyframes.snap(trim['start'], trim['end'])
+                    self._run_ffmpeg(
+                        path_input=path_input,
+                        path_output=path_output,
+                        preoptions=(*rotation_preoptions, '-ss', str(start)),
+                        options=(
+                            '-t', str(end - start),
+                            *self.EDIT_STREAMS_MAP,
+                            *rotation_options,
+                            '-c', 'copy',
+                            '-avoid_negative_ts', 'make_zero',
+                        ),
+                    )
+                    metadata_edit_file = self._get_meta(path_output)
+                    metadata_edit_file['trim'] = {'start': start, 'end': end}
+                    return path_output, metadata_edit_file
+                if rotate_by_matrix:
+                    self._run_ffmpeg(
+                        path_input=path_input,
+                        path_output=path_output,
+                        preoptions=rotation_preoptions,
+                        options=(*self.EDIT_STREAMS_MAP, *rotation_options, '-c', 'copy'),
+                    )
+                    return path_output, self._get_meta(path_output)
+                if trim and trim_mode == 'smart':
+                    if not keyframes:
+                        keyframes = self.get_keyframe_index(path_input)
+                    if self._smart_trim(path_input, path_output, trim['start'], trim['end'], keyframes):
+                        return path_output, self._get_meta(path_output)
+                    logger.info(f'FFMPEGVideoEditor:edit_video:{filename}: smart trim is not possible, '
+                                f'video is re-encoded')
+
+                # get option for trim
+                trim_option = (
+                    '-ss', str(trim['start']),
+                    '-t', str(trim['end'] - trim['start']),
+                    '-qscale', '0',
+                ) if trim else tuple()
+                # get option for filter
+                filter_string = self._get_filter_string(crop, rotate, scale)
+                filter_option = ('-filter:v', filter_string) if filter_string else tuple()
+                # run ffmpeg
+                if filter_option or trim_option:
+                    # combine trim and filter to run one time
+                    self._run_ffmpeg(
+                        path_input=path_input,
+                        path_output=path_output,
+                        options=(
+                            *trim_option,
+                            *filter_option,
+                            *self.EDIT_STREAMS_MAP,
+                            # only video is changed, audio is re-encoded only if it's cut
+                            *(('-c:a', 'copy') if not trim_option else ()),
+                            '-c:s', 'copy',
+                            '-threads', str(app.config.get('FFMPEG_THREADS')),
+                            *self._get_encoder_options(path_input, encoder_profile),
+                        )
+                    )
+                else:
+                    shutil.copyfile(path_input, path_output)
+                metadata_edit_file = self._get_meta(path_output)
+            except Exception:
+                if os.path.exists(path_output):
+                    os.remove(path_output)
+                raise
+        return path_output, metadata_edit_file
+
+    def encode_segment(self, stream_file, filename, start, end, crop=None, rotate=None, scale=None,
+                       encoder_profile=None):
+        """
+        Encode video of a part of a file with the same filters and encoder options as `edit_video` does, so parts
+        encoded separately (e.g. by different workers) are joined by `concat_segments` without re-encoding.
+        If `stream_file` is a path, segment is created in the same directory, otherwise in a tmp directory.
+        :param stream_file: file to encode or path to a local file
+        :type stream_file: str, bytes or file-like object
+        :param filename: filename for tmp file
+        :type filename: str
+        :param start: segment start in seconds, a keyframe, so decoding starts right at it
+        :type start: float
+        :param end: segment end in seconds
+        :type end: float
+        :param crop: crop editing rules
+        :type crop: dict
+        :param rotate: rotate degree
+        :type rotate: int
+        :param scale: width scale to
+        :type scale: int
+        :param encoder_profile: name of a profile in `FFMPEG_ENCODER_PROFILES`, `FFMPEG_ENCODER_PROFILE` if not set
+        :type encoder_profile: str
+        :return: path to encoded segment (must be removed or adopted by a caller)
+        :rtype: str
+        """
+
+        ext = filename.rsplit('.', 1)[-1]
+        output_dir = os.path.dirname(stream_file) if isinstance(stream_file, str) else tempfile.gettempdir()
+        path_output = os.path.join(output_dir, f'.{uuid.uuid4().hex}_segment.{ext}')
+        filter_string = self._get_filter_string(crop, rotate, scale)
+        with self._local_file(stream_file, suffix=f'.{ext}') as path_input:
+            try:
                 self._run_ffmpeg(
                     path_input=path_input,
                     path_output=path_output,
+                    preoptions=('-ss', str(start)),
                     options=(
-                        *trim_option,
-                        *filter_option,
+                        '-t', str(end - start),
+                        '-map', '0:v:0',
+                        *(('-filter:v', filter_string) if filter_string else ()),
                         '-threads', str(app.config.get('FFMPEG_THREADS')),
-                        '-preset', app.config.get('FFMPEG_PRESET')
+                        *self._get_encoder_options(path_input, encoder_profile),
+                    )
+                )
+                # validate segment
+                self._get_meta(path_output)
+            except Exception:
+                if os.path.exists(path_output):
+                    os.remove(path_output)
+                raise
+        return path_output
+
+    def concat_segments(self, stream_file, filename, segments, trim=None):
+        """
+        Join video segments encoded by `encode_segment` without re-encoding and mux them with audio and subtitle
+        streams of an original file, audio is re-encoded only if it's trimmed.
+        If `stream_file` is a path, edited file is created in the same directory, otherwise in a tmp directory.
+        :param stream_file: original file or path to a local file
+        :type stream_file: str, bytes or file-like object
+        :param filename: filename for tmp file
+        :type filename: str
+        :param segments: segments in order, files or paths to local files
+        :type segments: list
+        :param trim: trim editing rules, segments cover it
+        :type trim: dict
+        :return: path to edited file (must be removed or adopted by a caller), metadata
+        :rtype: str, dict
+        """
+
+        ext = filename.rsplit('.', 1)[-1]
+        output_dir = os.path.dirname(stream_file) if isinstance(stream_file, str) else tempfile.gettempdir()
+        path_output = os.path.join(output_dir, f'.{uuid.uuid4().hex}_edit.{ext}')
+        trim_option = ('-ss', str(trim['start']), '-t', str(trim['end'] - trim['start'])) if trim else tuple()
+        with ExitStack() as stack:
+            path_input = stack.enter_context(self._local_file(stream_file, suffix=f'.{ext}'))
+            segment_paths = [stack.enter_context(self._local_file(segment, suffix=f'.{ext}')) for segment in segments]
+            # https://ffmpeg.org/ffmpeg-formats.html#concat-1
+            path_list = create_temp_file(''.join(
+                "file '{}'\n".format(os.path.abspath(path).replace("'", "'\\''")) for path in segment_paths
+            ).encode(), suffix='.txt')
+            stack.callback(os.remove, path_list)
+            try:
+                # segments are the first input, other streams are taken from the second one
+                self._run_ffmpeg(
+                    path_input=path_list,
+                    path_output=path_output,
+                    preoptions=('-f', 'concat', '-safe', '0'),
+                    options=(
+                        *trim_option,
+                        '-i', path_input,
+                        '-map', '0:v',
+                        '-map', '1:a?',
+                        '-map', '1:s?',
+                        '-c:v', 'copy',
+                        *(('-c:a', 'copy') if not trim_option else ()),
+                        '-c:s', 'copy',
                     )
                 )
-            content = open(path_input, 'rb+').read()
-            metadata_edit_file = self._get_meta(path_input)
+                metadata_edit_file = self._get_meta(path_output)
+            except Exception:
+                if os.path.exists(path_output):
+                    os.remove(path_output)
+                raise
+        return path_output, metadata_edit_file
+
+    @staticmethod
+    def _get_filter_string(crop=None, rotate=None, scale=None):
+        """
+        Get video filtergraph of edit rules.
+        :param crop: crop editing rules
+        :type crop: dict
+        :param rotate: rotate degree
+        :type rotate: int
+        :param scale: width scale to
+        :type scale: int
+        :return: filtergraph, empty if there are no rules
+        :rtype: str
+        """
+
+        filter_string = ''
+        # crop
+        # https://ffmpeg.org/ffmpeg-filters.html#crop
+        if crop:
+            filter_string += f'crop={crop["width"]}:{crop["height"]}:{crop["x"]}:{crop["y"]}'
+        # scale
+        # http://ffmpeg.org/ffmpeg-filters.html#scale
+        # https://trac.ffmpeg.org/wiki/Scaling
+        if scale:
+            filter_string += ',' if filter_string != '' else ''
+            # avoid width not divisible by 2
+            if scale % 2 == 1:
+                scale -= 1
+            filter_string += f"scale={scale}:-2"
+        # rotate
+        # https://ffmpeg.org/ffmpeg-all.html#transpose
+        # 0 = 90CounterCLockwise and Vertical Flip (default)
+        # 1 = 90Clockwise
+        # 2 = 90CounterClockwise
+        # 3 = 90Clockwise and Vertical Flip
+        if rotate:
+            rotate_string = ''
+            if rotate == 90:
+                rotate_string = 'transpose=1'
+            elif rotate == -90:
+                rotate_string = 'transpose=2'
+            elif rotate == 180:
+                rotate_string = 'transpose=1,transpose=1'
+            elif rotate == -180:
+                rotate_string = 'transpose=2,transpose=2'
+            elif rotate == 270:
+                rotate_string = 'transpose=1,transpose=1,transpose=1'
+            elif rotate == -270:
+                rotate_string = 'transpose=2,transpose=2,transpose=2'
+            filter_string += ',' if filter_string != '' else ''
+            filter_string += rotate_string
+        return filter_string
+
+    def _smart_trim(self, path_input, path_output, start, end, keyframes):
+        """
+        Trim a video exactly, re-encoding only frames from `start` to a following keyframe and from a keyframe
+        preceding `end` to `end` with the same profile, level and pixel format, video between those keyframes and
+        other streams are copied.
+        Segments are joined as a raw H.264 stream and muxed with copied audio, so only constant frame rate H.264
+        videos are supported. Copied video is cut by `noise` bitstream filter expressions, which require ffmpeg 5+.
+        :param path_input: input file path
+        :type path_input: str
+        :param path_output: output file path
+        :type path_output: str
+        :param start: trim start in seconds
+        :type start: float
+        :param end: trim end in seconds
+        :type end: float
+        :param keyframes: keyframe index of a video
+        :type keyframes: videoserver.lib.video_editor.keyframe_index.KeyframeIndex
+        :return: `False` if a video can't be trimmed this way or ffmpeg failed, nothing is written then
+        :rtype: bool
+        """
+
+        if not re.search(r'^\s*-drop\s', self._get_ffmpeg_help('bsf=noise'), re.MULTILINE):
+            return False
+        streams = self._get_streams(path_input)
+        stream = next((s for s in streams if s.get('codec_type') == 'video'), {})
+        profile = self.X264_PROFILES.get(stream.get('profile'))
+        if stream.get('codec_name') != 'h264' or not profile \
+                or stream.get('r_frame_rate') != stream.get('avg_frame_rate'):
+            return False
+        numerator, denominator = map(int, stream['r_frame_rate'].split('/'))
+        fps = numerator / denominator
+
+        # copied part is [copy_start, copy_end), frames closer than half of a frame to a cut point belong to it
+        epsilon = 0.5 / fps
+        copy_start_index = keyframes.ceil(start - epsilon)
+        if copy_start_index >= len(keyframes):
+            return False
+        copy_start = keyframes.pts[copy_start_index]
+        copy_end = keyframes.pts[keyframes.floor(end + epsilon)]
+        if copy_end <= copy_start:
+            return False
+
+        encode_options = (
+            '-map', '0:v:0',
+            '-c:v', 'libx264',
+            '-profile:v', profile,
+            '-pix_fmt', stream['pix_fmt'],
+            '-crf', str(self.SMART_TRIM_CRF),
+            '-threads', str(app.config.get('FFMPEG_THREADS')),
+            '-preset', app.config.get('FFMPEG_PRESET'),
+            *(('-level:v', f"{stream['level'] // 10}.{stream['level'] % 10}") if stream.get('level', 0) > 0 else ()),
+            '-f', 'h264',
+        )
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            segments = []
+            if copy_start - start >= epsilon:
+                segments.append(self._run_ffmpeg(
+                    path_input=path_input,
+                    path_output=os.path.join(tmp_dir, 'head.h264'),
+                    preoptions=('-noautorotate', '-ss', str(start)),
+                    options=('-frames:v', str(round((copy_start - start) * fps)), *encode_options),
+                ))
+            # `-t` stops copying by decoding time, so frames shown after `copy_end` are dropped by their pts
+            duration = copy_end - copy_start
+            segments.append(self._run_ffmpeg(
+                path_input=path_input,
+                path_output=os.path.join(tmp_dir, 'copy.h264'),
+                preoptions=('-ss', str(copy_start)),
+                options=(
+                    '-t', str(duration),
+                    '-map', '0:v:0',
+                    '-c:v', 'copy',
+                    '-bsf:v', f'noise=drop=lt(pts\\,0)+gte(pts*tb\\,{duration - epsilon:.6f}),h264_mp4toannexb',
+                    '-f', 'h264',
+                ),
+            ))
+            if end - copy_end >= epsilon:
+                segments.append(self._run_ffmpeg(
+                    path_input=path_input,
+                    path_output=os.path.join(tmp_dir, 'tail.h264'),
+                    preoptions=('-noautorotate', '-ss', str(copy_end)),
+                    options=('-frames:v', str(round((end - copy_end) * fps)), *encode_options),
+                ))
+
+            path_video = os.path.join(tmp_dir, 'video.h264')
+            with open(path_video, 'wb') as video:
+                for segment in segments:
+                    with open(segment, 'rb') as f:
+                        shutil.copyfileobj(f, video)
+            audio_options = tuple()
+            if any(s.get('codec_type') == 'audio' for s in streams):
+                # output seeking, input seeking would start copying at a video keyframe preceding `start`
+                path_audio = self._run_ffmpeg(
+                    path_input=path_input,
+                    path_output=os.path.join(tmp_dir, 'audio.mka'),
+                    options=('-ss', str(start), '-t', str(end - start), '-map', '0:a', '-c', 'copy'),
+                )
+                audio_options = ('-i', path_audio, '-map', '1:a')
+            # segments are encoded as stored, a raw stream has no display matrix, so it's restored
+            rotation = self._get_rotation(stream)
+            rotation_preoptions, rotation_options = self._get_rotation_options(rotation) if rotation else ((), ())
+            self._run_ffmpeg(
+                path_input=path_video,
+                path_output=path_output,
+                preoptions=(*rotation_preoptions, '-framerate', stream['r_frame_rate']),
+                options=(*audio_options, '-map', '0:v', *rotation_options, '-c', 'copy',
+                         '-avoid_negative_ts', 'make_zero'),
+            )
+        except RuntimeError as e:
+            logger.warning(f'FFMPEGVideoEditor:_smart_trim:{path_input}: {e}')
+            if os.path.exists(path_output):
+                os.remove(path_output)
+            return False
         finally:
-            if path_input:
-                os.remove(path_input)
-        return content, metadata_edit_file
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        return True
+
+    def _get_encoder_options(self, path_input, encoder_profile=None):
+        """
+        Get options of an encoder profile for a codec of a video.
+        :param path_input: input file path
+        :type path_input: str
+        :param encoder_profile: name of a profile in `FFMPEG_ENCODER_PROFILES`, `FFMPEG_ENCODER_PROFILE` if not set
+        :type encoder_profile: str
+        :return: encoder options, empty if profile has no options for a codec
+        :rtype: tuple
+        """
+
+        profile = app.config.get('FFMPEG_ENCODER_PROFILES')[
+            encoder_profile or app.config.get('FFMPEG_ENCODER_PROFILE')
+        ]
+        stream = next((s for s in self._get_streams(path_input) if s.get('codec_type') == 'video'), {})
+        return tuple(profile.get(stream.get('codec_name'), ()))
+
+    def _get_rotation_options(self, display_rotation):
+        """
+        Get ffmpeg options which set a display matrix of a copied video.
+        `-display_rotation` input option is used if ffmpeg supports it (ffmpeg 6+), otherwise `rotate` metadata of
+        a video stream, which older mov/mp4 muxer writes into a display matrix.
+        :param display_rotation: counterclockwise rotation degree
+        :type display_rotation: int
+        :return: input options, output options
+        :rtype: tuple
+        """
+
+        if '-display_rotation' in self._get_ffmpeg_help('long'):
+            return ('-display_rotation', str(display_rotation)), tuple()
+        # `rotate` metadata is clockwise
+        return tuple(), ('-metadata:s:v:0', f'rotate={-display_rotation % 360}')
+
+    @classmethod
+    def _get_ffmpeg_help(cls, topic):
+        """
+        Get `ffmpeg -h` output, it's cached, so ffmpeg capabilities are probed once.
+        :param topic: help topic, e.g. 'long' or 'bsf=noise'
+        :type topic: str
+        :return: help output
+        :rtype: str
+        """
+
+        if topic not in cls._ffmpeg_help:
+            proc = subprocess.run(('ffmpeg', '-hide_banner', '-h', topic),
+                                  stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            cls._ffmpeg_help[topic] = proc.stdout.decode('utf-8', 'replace')
+        return cls._ffmpeg_help[topic]
+
+    def _get_display_rotation(self, path_input, rotate):
+        """
+        Get display matrix rotation of a video rotated by `rotate` degrees.
+        `-display_rotation` replaces a rotation of a video, so it's combined with the current one.
+        :param path_input: input file path
+        :type path_input: str
+        :param rotate: clockwise rotate degree
+        :type rotate: int
+        :return: counterclockwise rotation in [-180, 180)
+        :rtype: int
+        """
+
+        stream = next((s for s in self._get_streams(path_input) if s.get('codec_type') == 'video'), {})
+        return (self._get_rotation(stream) - rotate + 180) % 360 - 180
+
+    @staticmethod
+    def _get_rotation(stream):
+        """
+        Get counterclockwise rotation of a video stream from its display matrix.
+        :param stream: ffprobe stream
+        :type stream: dict
+        :return: rotation degree
+        :rtype: int
+        """
+
+        for side_data in stream.get('side_data_list', []):
+            if 'rotation' in side_data:
+                return round(float(side_data['rotation']))
+        return 0
 
     def capture_thumbnail(self, stream_file, filename, duration, position, crop=None, rotate=0):
         """
         Use ffmpeg tool to capture video frame at a position.
-        :param stream_file: video file
-        :type stream_file: bytes
+        :param stream_file: video file or path to a local file
+        :type stream_file: str, bytes or file-like object
         :param filename: tmp video's file name
         :type filename: str
         :param duration: video's duration
@@ -150,13 +599,12 @@ class FFMPEGVideoEditor(VideoEditorInterface):
         :rtype: bytes, dict
         """
 
-        path_video = create_temp_file(stream_file)
-        try:
+        with self._local_file(stream_file) as path_video:
             # avoid the last frame, it is null
             if int(duration) <= int(position):
                 position = duration - 0.1
             # create output file path
-            output_file = f"{path_video}_preview_thumbnail.png"
+            output_file = os.path.join(tempfile.gettempdir(), f"{uuid.uuid4().hex}_preview_thumbnail.png")
 
             vfilter = ''
             if crop:
@@ -168,16 +616,15 @@ class FFMPEGVideoEditor(VideoEditorInterface):
 
             try:
                 # run ffmpeg command
+                # seek on input to a previous keyframe, frames from it up to position are decoded and dropped
                 self._run_ffmpeg(
                     path_input=path_video,
                     path_output=output_file,
-                    preoptions=('-y', '-accurate_seek'),
+                    preoptions=('-y', '-accurate_seek', '-ss', str(position)),
                     options=(
-                        '-ss', str(position),
                         '-vframes', '1',
                         *shlex.split(vfilter),
                     ),
-                    override=False,
                 )
                 # get metadata
                 thumbnail_metadata = self._get_meta(output_file)
@@ -190,55 +637,161 @@ class FFMPEGVideoEditor(VideoEditorInterface):
                 if os.path.exists(output_file):
                     # delete temp thumbnail file
                     os.remove(output_file)
-        finally:
-            os.remove(path_video)
 
-    def capture_timeline_thumbnails(self, stream_file, filename, duration, thumbnails_amount):
+    def capture_timeline_thumbnails(self, stream_file, filename, duration, thumbnails_amount, fast=False,
+                                    keyframes=None):
         """
         Capture thumbnails for timeline.
-        :param stream_file: video file
-        :type stream_file: bytes
+        :param stream_file: video file or path to a local file
+        :type stream_file: str, bytes or file-like object
         :param filename: tmp video's file name
         :type filename: str
         :param duration: video's duration
         :type duration: int
         :param thumbnails_amount: total number of thumbnails to capture
         :type thumbnails_amount: int
-        :return: file stream, metadata generator
+        :param fast: capture nearest keyframes instead of exact positions, only keyframes are decoded
+        :type fast: bool
+        :param keyframes: keyframe index of a video, it's used to plan seeking and built if it's required
+        :type keyframes: videoserver.lib.video_editor.keyframe_index.KeyframeIndex
+        :return: file stream, metadata generator, frames which could not be captured are skipped
         :return: bytes, generator
         """
 
-        path_video = create_temp_file(stream_file)
-        try:
+        with self._local_file(stream_file) as path_video:
             # time period between two frames
             if thumbnails_amount == 1:
                 frame_per_second = (duration - 0.05)
             else:
                 frame_per_second = (duration - 0.05) / (thumbnails_amount - 1)
 
-            # capture list frame via script capture_list_frames.sh
-            path_script = os.path.dirname(__file__) + '/script/capture_list_frames.sh'
-            # create output file path
-            output_file = f"{path_video}_"
-            # subprocess bash -> ffmpeg in the loop
-            subprocess.run([path_script, path_video, output_file, str(frame_per_second), str(thumbnails_amount)])
-            for i in range(0, thumbnails_amount):
-                thumbnail_path = f'{output_file}{i}.png'
-                try:
-                    # get metadata
-                    thumbnail_metadata = self._get_meta(thumbnail_path)
-                    thumbnail_metadata['mimetype'] = 'image/png'
-                    # read binary
-                    with open(thumbnail_path, "rb") as f:
+            positions = [frame_per_second * i for i in range(thumbnails_amount)]
+            # index of a captured frame for every thumbnail and position of every captured frame
+            frame_indexes = list(range(thumbnails_amount))
+            frame_positions = positions
+
+            # all frames are captured by a single ffmpeg process
+            output_dir = tempfile.mkdtemp()
+            if keyframes:
+                # seeking decodes a video from a previous keyframe of every position
+                seek = sum(position - keyframes.pts[keyframes.floor(position)] for position in positions) < duration
+            else:
+                seek = frame_per_second >= self.TIMELINE_SEEK_MIN_INTERVAL
+
+            if fast:
+                # snap positions to nearest keyframes, decode only keyframes (in low resolution if decoder
+                # supports it) and select those keyframes
+                if not keyframes:
+                    keyframes = self.get_keyframe_index(path_video)
+                snapped = [keyframes.pts[keyframes.nearest(position)] for position in positions]
+                selected = sorted(set(snapped))
+                frame_indexes = [selected.index(keyframe) for keyframe in snapped]
+                frame_positions = selected
+                select = '+'.join(f'between(t\\,{keyframe - 0.0005:.6f}\\,{keyframe + 0.0005:.6f})'
+                                  for keyframe in selected)
+                cmd = (
+                    '-skip_frame', 'nokey', '-lowres', '2', '-i', path_video,
+                    '-vf', f'select={select},scale=-1:50',
+                    '-vsync', 'vfr', '-frames:v', str(len(selected)),
+                    '-start_number', '0', os.path.join(output_dir, '%d.png'),
+                )
+            elif not seek:
+                # frames are close to each other, decode a video once and select first frames at positions
+                cmd = (
+                    '-i', path_video,
+                    '-vf', f'select=gte(t\\,{frame_per_second:.3f}*selected_n),scale=-1:50',
+                    '-vsync', 'vfr', '-frames:v', str(thumbnails_amount),
+                    '-start_number', '0', os.path.join(output_dir, '%d.png'),
+                )
+            else:
+                # every position is a separate input seeked to a previous keyframe and decoded from there,
+                # so the whole video is not decoded
+                inputs, filters, outputs = [], [], []
+                for i, position in enumerate(positions):
+                    inputs.extend(('-ss', f'{position:.3f}', '-i', path_video))
+                    filters.append(f'[{i}:v:0]scale=-1:50[v{i}]')
+                    outputs.extend(('-map', f'[v{i}]', '-frames:v', '1', os.path.join(output_dir, f'{i}.png')))
+                cmd = (*inputs, '-filter_complex', ';'.join(filters), *outputs)
+            try:
+                proc = subprocess.run(('ffmpeg', '-v', 'error', '-y', *cmd))
+                if proc.returncode != 0:
+                    logger.warning(f'FFMPEGVideoEditor:capture_timeline_thumbnails:{filename}: '
+                                   f'ffmpeg has failed with code {proc.returncode}')
+                for i in frame_indexes:
+                    output_file = os.path.join(output_dir, f'{i}.png')
+                    if not os.path.isfile(output_file) or not os.path.getsize(output_file):
+                        # frame was not captured (e.g. a select filter passed less frames), seek to it
+                        subprocess.run(('ffmpeg', '-v', 'error', '-y', '-ss', f'{frame_positions[i]:.3f}',
+                                        '-i', path_video, '-vf', 'scale=-1:50', '-frames:v', '1', output_file))
+                    if not os.path.isfile(output_file) or not os.path.getsize(output_file):
+                        logger.warning(f'FFMPEGVideoEditor:capture_timeline_thumbnails:{filename}: '
+                                       f'frame at {frame_positions[i]:.3f} was not captured')
+                        continue
+                    with open(output_file, 'rb') as f:
                         content = f.read()
-                    yield content, thumbnail_metadata
-                finally:
-                    # delete temp thumbnail file
-                    os.remove(thumbnail_path)
-        finally:
-            os.remove(path_video)
+                    yield content, self._get_png_meta(content)
+            finally:
+                shutil.rmtree(output_dir)
 
-    def _run_ffmpeg(self, path_input, path_output, preoptions=tuple(), options=tuple(), override=True):
+    def get_keyframe_index(self, stream_file):
+        """
+        Use `ffprobe` to build a keyframe index of a video, packets are only demuxed, not decoded.
+        Timestamps are relative to a start time of a container, as positions used for seeking and trimming are.
+        :param stream_file: video file or path to a local file
+        :type stream_file: str, bytes or file-like object
+        :return: keyframe index
+        :rtype: videoserver.lib.video_editor.keyframe_index.KeyframeIndex
+        """
+
+        with self._local_file(stream_file) as file_path:
+            cmd = ('ffprobe', '-v', 'error', '-select_streams', 'v:0',
+                   '-show_entries', 'packet=pts_time,pos,flags:format=start_time', '-print_format', 'compact=p=0',
+                   file_path)
+            with subprocess.Popen(cmd, stdout=subprocess.PIPE) as proc:
+                (output, _) = proc.communicate()
+                if proc.returncode != 0:
+                    raise RuntimeError(f"Subprocess with command: '{cmd}' has failed.")
+
+        keyframes = []
+        start_time = 0.0
+        for line in output.decode('utf-8').splitlines():
+            packet = dict(field.split('=', 1) for field in line.split('|') if '=' in field)
+            if packet.get('start_time', 'N/A') != 'N/A':
+                start_time = float(packet['start_time'])
+            elif packet.get('flags', '').startswith('K') and packet.get('pts_time', 'N/A') != 'N/A':
+                pos = packet.get('pos', 'N/A')
+                keyframes.append((float(packet['pts_time']), int(pos) if pos != 'N/A' else -1))
+        if not keyframes:
+            raise Exception(f'Keyframes were not found. File: {stream_file}')
+
+        keyframes.sort()
+        return KeyframeIndex(
+            # ffprobe prints microseconds
+            pts=(round(pts - start_time, 6) for pts, _ in keyframes),
+            pos=(pos for _, pos in keyframes)
+        )
+
+    @staticmethod
+    def _get_png_meta(content):
+        """
+        Get metadata of png image from its header without running `ffprobe`
+        :param content: png image
+        :type content: bytes
+        :return: metadata
+        :rtype: dict
+        """
+
+        # IHDR chunk follows 8 bytes signature, width and height are its first fields
+        width, height = struct.unpack('>II', content[16:24])
+        return {
+            'codec_name': 'png',
+            'mimetype': 'image/png',
+            'width': width,
+            'height': height,
+            'size': len(content),
+        }
+
+    def _run_ffmpeg(self, path_input, path_output, preoptions=tuple(), options=tuple()):
         """
         Subprocess `ffmpeg` command.
         :param path_input: input file path
@@ -249,36 +802,55 @@ class FFMPEGVideoEditor(VideoEditorInterface):
         :type preoptions: tuple
         :param options: options for ffmpeg cmd
         :type options: tuple
-        :param override: replace input file with output file
-        :type override: bool
         :return: file path to edited file
         :rtype: str
         """
-        try:
-            # run ffmpeg with provided options
-            subprocess.run(["ffmpeg", "-loglevel", "error", *preoptions, "-i", path_input, *options, path_output])
-            if not override:
-                return path_output
-            # replace tmp origin
-            subprocess.run(["cp", "-r", path_output, path_input])
-            return path_input
-        finally:
-            if override:
-                # delete old tmp input file
-                os.remove(path_output)
 
-    def _get_meta(self, file_path):
+        # run ffmpeg with provided options
+        cmd = ("ffmpeg", "-loglevel", "error", *preoptions, "-i", path_input, *options, path_output)
+        proc = subprocess.run(cmd)
+        if proc.returncode != 0:
+            raise RuntimeError(f"Subprocess with command: '{cmd}' has failed.")
+        return path_output
+
+    def _get_streams(self, file_path):
+        """
+        Get streams and their encoding parameters using `ffprobe` command
+        :param file_path: path to a file
+        :type file_path: str
+        :return: codec_type, codec_name, profile, level, pix_fmt, r_frame_rate, avg_frame_rate
+                 and display matrix rotation of every stream
+        :rtype: list
+        """
+
+        cmd = ('ffprobe', '-v', 'error', '-show_entries',
+               'stream=codec_type,codec_name,profile,level,pix_fmt,r_frame_rate,avg_frame_rate'
+               ':stream_side_data=rotation', '-print_format', 'json', file_path)
+        proc = subprocess.run(cmd, stdout=subprocess.PIPE)
+        if proc.returncode != 0:
+            raise RuntimeError(f"Subprocess with command: '{cmd}' has failed.")
+        return json.loads(proc.stdout.decode('utf-8'))['streams']
+
+    def _get_meta(self, file_path, head=None):
         """
         Get metada using `ffprobe` command
-        :param file_path: path to a file to retrieve a metadata
+        :param file_path: path to a file to retrieve a metadata or `pipe:0` if `head` is given
         :type file_path: str
+        :param head: leading bytes of a file which are piped into ffprobe, probing is bounded by their size
+        :type head: bytes
         :return: metadata
         :rtype: dict
         """
 
-        cmd = ('ffprobe', '-v', 'error', '-print_format', 'json', '-show_streams', '-show_format', file_path)
-        with subprocess.Popen(cmd, stdout=subprocess.PIPE) as proc:
-            (output, _) = proc.communicate()
+        probe_options = (
+            '-probesize', str(max(len(head), 32)),
+            '-analyzeduration', str(self.PROBE_ANALYZE_DURATION),
+        ) if head is not None else tuple()
+        cmd = ('ffprobe', '-v', 'error', *probe_options, '-print_format', 'json', '-show_streams', '-show_format',
+               file_path)
+        with subprocess.Popen(cmd, stdin=subprocess.PIPE if head is not None else None,
+                              stdout=subprocess.PIPE) as proc:
+            (output, _) = proc.communicate(head)
             if proc.returncode != 0:
                 raise RuntimeError(f"Subprocess with command: '{cmd}' has failed.")
 
@@ -297,8 +869,11 @@ class FFMPEGVideoEditor(VideoEditorInterface):
                            'nb_frames', 'duration')
 
         metadata = {key: data.get(key) for key in video_meta_keys}
+        # report dimensions of a displayed video
+        if self._get_rotation(data) % 180:
+            metadata['width'], metadata['height'] = metadata['height'], metadata['width']
         metadata['format_name'] = video_data['format']['format_name']
-        metadata['size'] = video_data['format']['size']
+        metadata['size'] = video_data['format'].get('size')
 
         # some videos don't have duration in video stream
         if not metadata['duration']:
@@ -3,23 +3,29 @@ import abc
 
 class VideoEditorInterface(metaclass=abc.ABCMeta):
 
+    #: extensions of containers in which a video is rotated without re-encoding
+    DISPLAY_MATRIX_EXTENSIONS = ()
+
     @abc.abstractmethod
-    def get_meta(self, filestream):
+    def get_meta(self, filestream, probe_size=None):
         """
         Get metadata of file
-        :param filestream: file to get meta from
-        :type filestream: bytes
+        :param filestream: file to get meta from or path to a local file
+        :type filestream: str, bytes or file-like object
+        :param probe_size: probe only leading `probe_size` bytes of a file
+        :type probe_size: int
         :return: metadata
         :rtype: dict
         """
         pass
 
     @abc.abstractmethod
-    def edit_video(self, stream_file, filename, trim=None, crop=None, rotate=None, scale=None):
+    def edit_video(self, stream_file, filename, trim=None, crop=None, rotate=None, scale=None, trim_mode=None,
+                   keyframes=None, encoder_profile=None):
         """
         Edit video.
-        :param stream_file: file to edit
-        :type stream_file: bytes
+        :param stream_file: file to edit or path to a local file
+        :type stream_file: str, bytes or file-like object
         :param filename: filename for tmp file
         :type filename: str
         :param trim: trim editing rules
@@ -30,7 +36,57 @@ class VideoEditorInterface(metaclass=abc.ABCMeta):
         :type video_rotate: int
         :param scale: width scale to
         :type scale: int
-        :return:
+        :param trim_mode: how to trim a video: 'encode', 'copy' or 'smart'
+        :type trim_mode: str
+        :param keyframes: keyframe index of a video
+        :type keyframes: videoserver.lib.video_editor.keyframe_index.KeyframeIndex
+        :param encoder_profile: name of encoder options profile, default profile is used if not set
+        :type encoder_profile: str
+        :return: path to edited file (must be removed or adopted by a caller), metadata
+        :rtype: str, dict
+        """
+        pass
+
+    @abc.abstractmethod
+    def encode_segment(self, stream_file, filename, start, end, crop=None, rotate=None, scale=None,
+                       encoder_profile=None):
+        """
+        Encode video of a part of a file, so parts encoded separately are joined without re-encoding.
+        :param stream_file: file to encode or path to a local file
+        :type stream_file: str, bytes or file-like object
+        :param filename: filename for tmp file
+        :type filename: str
+        :param start: segment start in seconds
+        :type start: float
+        :param end: segment end in seconds
+        :type end: float
+        :param crop: crop editing rules
+        :type crop: dict
+        :param rotate: rotate degree
+        :type rotate: int
+        :param scale: width scale to
+        :type scale: int
+        :param encoder_profile: name of encoder options profile, default profile is used if not set
+        :type encoder_profile: str
+        :return: path to encoded segment (must be removed or adopted by a caller)
+        :rtype: str
+        """
+        pass
+
+    @abc.abstractmethod
+    def concat_segments(self, stream_file, filename, segments, trim=None):
+        """
+        Join encoded segments and other streams of an original file.
+        :param stream_file: original file or path to a local file
+        :type stream_file: str, bytes or file-like object
+        :param filename: filename for tmp file
+        :type filename: str
+        :param segments: segments in order, files or paths to local files
+        :type segments: list
+        :param trim: trim editing rules
+        :type trim: dict
+        :return: path to edited file (must be removed or adopted by a caller), metadata
+        :rtype: str, dict
         """
         pass
 
@@ -38,8 +94,8 @@ class VideoEditorInterface(metaclass=abc.ABCMeta):
     def capture_thumbnail(self, stream_file, filename, duration, position, crop, rotate):
         """
         Capture video frame at a position.
-        :param stream_file: video file
-        :type stream_file: bytes
+        :param stream_file: video file or path to a local file
+        :type stream_file: str, bytes or file-like object
         :param filename: tmp video's file name
         :type filename: str
         :param duration: video's duration
@@ -56,18 +112,34 @@ class VideoEditorInterface(metaclass=abc.ABCMeta):
         pass
 
     @abc.abstractmethod
-    def capture_timeline_thumbnails(self, stream_file, filename, duration, thumbnails_amount):
+    def capture_timeline_thumbnails(self, stream_file, filename, duration, thumbnails_amount, fast=False,
+                                    keyframes=None):
         """
         Capture thumbnails for timeline.
-        :param stream_file: video file
-        :type stream_file: bytes
+        :param stream_file: video file or path to a local file
+        :type stream_file: str, bytes or file-like object
         :param filename: tmp video's file name
         :type filename: str
         :param duration: video's duration
         :type duration: int
         :param thumbnails_amount: total number of thumbnails to capture
         :type thumbnails_amount: int
+        :param fast: trade precise positions for speed
+        :type fast: bool
+        :param keyframes: keyframe index of a video
+        :type keyframes: videoserver.lib.video_editor.keyframe_index.KeyframeIndex
         :return: file stream, metadata generator
         :return: bytes, generator
         """
         pass
+
+    @abc.abstractmethod
+    def get_keyframe_index(self, stream_file):
+        """
+        Build a keyframe index of a video.
+        :param stream_file: video file or path to a local file
+        :type stream_file: str, bytes or file-like object
+        :return: keyframe index
+        :rtype: videoserver.lib.video_editor.keyframe_index.KeyframeIndex
+        """
+        pass
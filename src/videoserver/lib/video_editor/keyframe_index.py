@@ -0,0 +1,136 @@
+import bisect
+import struct
+import sys
+from array import array
+
+
+class KeyframeIndex:
+    """
+    Keyframes of a video: presentation time (in seconds) and byte offset in a file of every keyframe.
+    Both are kept in typed arrays, so an index of a long video is compact and (de)serialized without parsing.
+    """
+
+    #: serialized index is a number of keyframes followed by all times and all offsets (little-endian)
+    HEADER = struct.Struct('<I')
+
+    def __init__(self, pts=(), pos=()):
+        """
+        :param pts: sorted keyframes times in seconds
+        :type pts: iterable
+        :param pos: keyframes byte offsets, `-1` if unknown
+        :type pos: iterable
+        """
+
+        self.pts = array('d', pts)
+        self.pos = array('q', pos)
+
+    def __len__(self):
+        return len(self.pts)
+
+    def to_bytes(self):
+        """
+        Serialize index.
+        :return: serialized index
+        :rtype: bytes
+        """
+
+        pts, pos = array('d', self.pts), array('q', self.pos)
+        if sys.byteorder == 'big':
+            pts.byteswap()
+            pos.byteswap()
+        return self.HEADER.pack(len(pts)) + pts.tobytes() + pos.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        Deserialize index.
+        :param data: serialized index
+        :type data: bytes
+        :return: index
+        :rtype: KeyframeIndex
+        """
+
+        (count,) = cls.HEADER.unpack_from(data)
+        index = cls()
+        offset = cls.HEADER.size
+        index.pts.frombytes(data[offset:offset + count * index.pts.itemsize])
+        offset += count * index.pts.itemsize
+        index.pos.frombytes(data[offset:offset + count * index.pos.itemsize])
+        if sys.byteorder == 'big':
+            index.pts.byteswap()
+            index.pos.byteswap()
+        return index
+
+    def floor(self, time):
+        """
+        Return index of the last keyframe at or before `time`, the first keyframe if `time` precedes it.
+        :param time: time in seconds
+        :type time: float
+        :return: keyframe index
+        :rtype: int
+        """
+
+        return max(bisect.bisect_right(self.pts, time) - 1, 0)
+
+    def ceil(self, time):
+        """
+        Return index of the first keyframe at or after `time`, `len(self)` if there is no such keyframe.
+        :param time: time in seconds
+        :type time: float
+        :return: keyframe index
+        :rtype: int
+        """
+
+        return bisect.bisect_left(self.pts, time)
+
+    def snap(self, start, end):
+        """
+        Widen a time range to keyframes: `start` to a preceding keyframe and `end` to a following one,
+        `end` is kept if there is no keyframe after it (end of a video).
+        :param start: range start in seconds
+        :type start: float
+        :param end: range end in seconds
+        :type end: float
+        :return: start, end
+        :rtype: tuple
+        """
+
+        end_index = self.ceil(end)
+        return self.pts[self.floor(start)], self.pts[end_index] if end_index < len(self.pts) else end
+
+    def split(self, start, end, duration):
+        """
+        Split a time range at keyframes into parts which are at least `duration` long,
+        the last part is at least half of `duration` long.
+        :param start: range start in seconds
+        :type start: float
+        :param end: range end in seconds
+        :type end: float
+        :param duration: min part duration in seconds
+        :type duration: float
+        :return: parts' start and end
+        :rtype: list
+        """
+
+        points = [start]
+        for keyframe in self.pts[self.ceil(start):self.ceil(end)]:
+            if keyframe - points[-1] >= duration and end - keyframe >= duration / 2:
+                points.append(keyframe)
+        points.append(end)
+        return list(zip(points, points[1:]))
+
+    def nearest(self, time):
+        """
+        Return index of a keyframe nearest to `time`.
+        :param time: time in seconds
+        :type time: float
+        :return: keyframe index
+        :rtype: int
+        """
+
+        i = bisect.bisect_left(self.pts, time)
+        if i == 0:
+            return 0
+        if i == len(self.pts):
+            return i - 1
+        return i if self.pts[i] - time < time - self.pts[i - 1] else i - 1
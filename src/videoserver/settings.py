@@ -63,9 +63,18 @@ BROKER_URL = env('CELERY_BROKER_URL', RABBIT_MQ_URL)
 CELERY_BROKER_URL = BROKER_URL
 CELERY_TASK_ALWAYS_EAGER = strtobool(env('CELERY_TASK_ALWAYS_EAGER', 'False'))
 CELERY_TASK_SERIALIZER = 'bson'
+#: celery result backend, e.g. 'redis://localhost:6379/0', it's required by segmented edits
+CELERY_RESULT_BACKEND = env('CELERY_RESULT_BACKEND', None)
 #: number retry when task fail
 MAX_RETRIES = int(env('MAX_RETRIES', 3))
 BROKER_CONNECTION_MAX_RETRIES = MAX_RETRIES
+#: periodic tasks, run `celery -A videoserver.worker beat`
+CELERY_BEAT_SCHEDULE = {
+    'sweep_storage': {
+        'task': 'videoserver.apps.projects.tasks.sweep_storage',
+        'schedule': int(env('STORAGE_SWEEP_INTERVAL', 24 * 60 * 60)),
+    },
+}
 
 #: Codec support
 CODEC_SUPPORT_VIDEO = ('vp8', 'vp9', 'h264', 'theora', 'av1')
@@ -82,9 +91,55 @@ CODEC_MIMETYPE_MAP = {
 }
 
 #: media storage
+#: options: 'filesystem', 'content_addressable' (filesystem with deduplicated content),
+#: 'sharded_filesystem' (filesystem spread across `FS_MEDIA_STORAGE_PATHS`), 's3' ('amazon'), 'gridfs'
 MEDIA_STORAGE = env('MEDIA_STORAGE', 'filesystem')
 DEFAULT_PATH = os.path.join(BASE_PATH, 'media', 'projects')
 FS_MEDIA_STORAGE_PATH = env('FS_MEDIA_STORAGE_PATH', DEFAULT_PATH)
+#: comma separated roots for 'sharded_filesystem' storage, `FS_MEDIA_STORAGE_PATH` is used if not set
+#: run `flask rebalance-storage` after a root was added
+FS_MEDIA_STORAGE_PATHS = [path for path in env('FS_MEDIA_STORAGE_PATHS', '').split(',') if path]
+#: size of a chunk (in bytes) used for streaming files from/to storage
+STORAGE_CHUNK_SIZE = int(env('STORAGE_CHUNK_SIZE', 1024 * 1024))
+#: resumable uploads which were not updated for this number of days are removed
+UPLOAD_EXPIRE_DAYS = int(env('UPLOAD_EXPIRE_DAYS', 7))
+#: directory where uploaded files are received, system tmp directory is used if not set
+#: use a directory on the same file system as `FS_MEDIA_STORAGE_PATH`, so uploads are moved into storage without copying
+UPLOAD_TMP_PATH = env('UPLOAD_TMP_PATH', None)
+#: number of leading bytes of an uploaded file which are probed to reject an unsupported codec before
+#: the rest of a file is received, 0 disables it
+UPLOAD_PROBE_SIZE = int(env('UPLOAD_PROBE_SIZE', 2 * 1024 * 1024))
+#: in-memory cache of small media files (thumbnails) of api process, in bytes, 0 disables it
+MEDIA_CACHE_SIZE = int(env('MEDIA_CACHE_SIZE', 64 * 1024 * 1024))
+MEDIA_CACHE_MAX_ITEM_SIZE = int(env('MEDIA_CACHE_MAX_ITEM_SIZE', 512 * 1024))
+#: number of deleted files removed from storage by a single request
+STORAGE_DELETE_BATCH_SIZE = int(env('STORAGE_DELETE_BATCH_SIZE', 100))
+#: directories not referenced by projects are removed from storage only if they are older (in days)
+STORAGE_SWEEP_GRACE_DAYS = int(env('STORAGE_SWEEP_GRACE_DAYS', 2))
+#: cache media storage by blocks on a local disk, useful for remote storages
+STORAGE_CACHE_ENABLED = strtobool(env('STORAGE_CACHE_ENABLED', 'False'))
+STORAGE_CACHE_PATH = env('STORAGE_CACHE_PATH', os.path.join(BASE_PATH, 'media', 'cache'))
+#: max size of a cache in bytes, least recently used blocks are evicted
+STORAGE_CACHE_SIZE = int(env('STORAGE_CACHE_SIZE', 10 * 1024 * 1024 * 1024))
+STORAGE_CACHE_BLOCK_SIZE = int(env('STORAGE_CACHE_BLOCK_SIZE', 4 * 1024 * 1024))
+
+#: s3 compatible media storage, `boto3` is required
+S3_BUCKET = env('S3_BUCKET', 'videoserver')
+#: custom endpoint for s3 compatible services (e.g. minio), amazon s3 is used if not set
+S3_ENDPOINT_URL = env('S3_ENDPOINT_URL')
+S3_REGION_NAME = env('S3_REGION_NAME')
+S3_ACCESS_KEY_ID = env('S3_ACCESS_KEY_ID')
+S3_SECRET_ACCESS_KEY = env('S3_SECRET_ACCESS_KEY')
+#: max number of pooled http connections
+S3_MAX_POOL_CONNECTIONS = int(env('S3_MAX_POOL_CONNECTIONS', 50))
+#: files bigger than threshold are uploaded by parts in parallel threads
+S3_MULTIPART_THRESHOLD = int(env('S3_MULTIPART_THRESHOLD', 64 * 1024 * 1024))
+S3_MULTIPART_CHUNKSIZE = int(env('S3_MULTIPART_CHUNKSIZE', 16 * 1024 * 1024))
+S3_MAX_CONCURRENCY = int(env('S3_MAX_CONCURRENCY', 8))
+
+#: gridfs media storage, uses app's mongo connection
+GRIDFS_BUCKET_NAME = env('GRIDFS_BUCKET_NAME', 'media')
+GRIDFS_CHUNK_SIZE = int(env('GRIDFS_CHUNK_SIZE', 255 * 1024))
 
 #: media tool
 DEFAULT_MEDIA_TOOL = env('DEFAULT_MEDIA_TOOL', 'ffmpeg')
@@ -92,6 +147,9 @@ DEFAULT_MEDIA_TOOL = env('DEFAULT_MEDIA_TOOL', 'ffmpeg')
 #: pagination, items per page
 ITEMS_PER_PAGE = int(env('ITEMS_PER_PAGE', 25))
 DEFAULT_TOTAL_TIMELINE_THUMBNAILS = int(env('DEFAULT_TOTAL_TIMELINE_THUMBNAILS', 40))
+#: capture timeline thumbnails from nearest keyframes, only keyframes are decoded, which is much faster
+#: for long and high resolution videos, but thumbnails are not at exact positions
+TIMELINE_THUMBNAILS_FAST = strtobool(env('TIMELINE_THUMBNAILS_FAST', 'False'))
 
 #: set PORT for video server
 VIDEO_SERVER_PORT = env('VIDEO_SERVER_PORT', 5050)
@@ -103,6 +161,11 @@ FILE_STREAM_PROXY_URL = env('FILE_STREAM_PROXY_URL', '')
 if FILE_STREAM_PROXY_ENABLED and not FILE_STREAM_PROXY_URL:
     raise ValueError('FILE_STREAM_PROXY_URL is required if FILE_STREAM_PROXY_ENABLED')
 
+#: edits which re-encode a whole video are split at keyframes into segments of about this duration (in seconds),
+#: segments are encoded by workers in parallel and joined without re-encoding.
+#: Only videos longer than two segments are split, 0 disables it, `CELERY_RESULT_BACKEND` is required
+EDIT_SEGMENT_DURATION = int(env('EDIT_SEGMENT_DURATION', 0))
+
 #: video edit constraints
 ALLOW_INTERPOLATION = strtobool(env('ALLOW_INTERPOLATION', 'True'))
 INTERPOLATION_LIMIT = env('INTERPOLATION_LIMIT', 1280)
@@ -121,3 +184,33 @@ FFMPEG_THREADS = env('FFMPEG_THREADS', '0')
 # but the file size will be larger when compared to medium. The visual quality will be the same.
 # Valid presets are ultrafast, superfast, veryfast, faster, fast, medium, slow, slower, veryslow and placebo.
 FFMPEG_PRESET = env('FFMPEG_PRESET', 'medium')
+#: video encoder options by a profile name and a codec of an edited video, a profile is selected
+#: by `encoder_profile` of an edit request, `FFMPEG_ENCODER_PROFILE` is used if it's not set.
+#: Codec is kept, videos in codecs without options are encoded by a default encoder of a container
+FFMPEG_ENCODER_PROFILE = env('FFMPEG_ENCODER_PROFILE', 'balanced')
+FFMPEG_ENCODER_PROFILES = {
+    # interactive edits: realtime speed, bigger files
+    'fast': {
+        'h264': ('-c:v', 'libx264', '-preset', 'veryfast', '-crf', '23'),
+        'vp8': ('-c:v', 'libvpx', '-deadline', 'realtime', '-cpu-used', '8', '-crf', '10', '-b:v', '4M'),
+        'vp9': ('-c:v', 'libvpx-vp9', '-deadline', 'realtime', '-cpu-used', '8', '-row-mt', '1',
+                '-crf', '32', '-b:v', '0'),
+        'av1': ('-c:v', 'libaom-av1', '-usage', 'realtime', '-cpu-used', '8', '-row-mt', '1',
+                '-crf', '32', '-b:v', '0'),
+    },
+    'balanced': {
+        'h264': ('-c:v', 'libx264', '-preset', FFMPEG_PRESET),
+        'vp8': ('-c:v', 'libvpx', '-deadline', 'good', '-cpu-used', '4', '-crf', '10', '-b:v', '4M'),
+        'vp9': ('-c:v', 'libvpx-vp9', '-deadline', 'good', '-cpu-used', '4', '-row-mt', '1',
+                '-crf', '32', '-b:v', '0'),
+        'av1': ('-c:v', 'libaom-av1', '-cpu-used', '6', '-row-mt', '1', '-crf', '32', '-b:v', '0'),
+    },
+    # smallest files of the best quality, slow
+    'archival': {
+        'h264': ('-c:v', 'libx264', '-preset', 'slow', '-crf', '18'),
+        'vp8': ('-c:v', 'libvpx', '-deadline', 'good', '-cpu-used', '0', '-crf', '4', '-b:v', '10M'),
+        'vp9': ('-c:v', 'libvpx-vp9', '-deadline', 'good', '-cpu-used', '1', '-row-mt', '1',
+                '-crf', '24', '-b:v', '0'),
+        'av1': ('-c:v', 'libaom-av1', '-cpu-used', '3', '-row-mt', '1', '-crf', '24', '-b:v', '0'),
+    },
+}
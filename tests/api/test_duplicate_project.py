@@ -42,8 +42,8 @@ def test_duplicate_project_success(test_app, client, projects):
 
 
 @pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': False},)], indirect=True)
-@mock.patch('videoserver.apps.projects.routes.app.fs.put', side_effect=Exception('Some error'))
-def test_duplicate_project_broken_fs_put(mock_fs_put, test_app, client, projects):
+@mock.patch('videoserver.apps.projects.routes.app.fs.copy', side_effect=Exception('Some error'))
+def test_duplicate_project_broken_fs_copy(mock_fs_copy, test_app, client, projects):
     project = projects[0]
 
     with test_app.test_request_context():
@@ -104,6 +104,10 @@ def test_duplicate_project_with_thumbnails(test_app, client, projects):
         assert len(resp_data['thumbnails']['timeline']) == amount
         for thumbn_data in resp_data['thumbnails']['timeline']:
             assert test_app.fs.get(thumbn_data['storage_id']).__class__ is bytes
+        # pack is named after a version of a duplicate
+        assert resp_data['thumbnails']['timeline'][0]['storage_id'].endswith(
+            f"_timeline-{amount}_v{resp_data['version']}.pack"
+        )
 
 
 @pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': False},)], indirect=True)
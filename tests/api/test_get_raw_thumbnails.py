@@ -1,4 +1,7 @@
+from unittest import mock
+
 import pytest
+from bson import ObjectId
 from flask import url_for
 
 
@@ -19,6 +22,33 @@ def test_get_raw_timeline_thumbnail_success(test_app, client, projects):
 
         assert resp.status == '200 OK'
         assert resp.mimetype == 'image/png'
+        assert resp.data.startswith(b'\x89PNG')
+
+
+@pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': False},)], indirect=True)
+def test_get_raw_timeline_thumbnail_packed(test_app, client, projects):
+    project = projects[0]
+    test_app.config['MEDIA_CACHE_SIZE'] = 0
+
+    with test_app.test_request_context():
+        # capture timeline thumbnails
+        amount = 3
+        url = url_for(
+            'projects.retrieve_or_create_thumbnails', project_id=project['_id']
+        ) + f'?type=timeline&amount={amount}'
+        client.get(url)
+        thumbnails = client.get(url).json['thumbnails']
+        # all thumbnails are in one file
+        assert len({thumbnail['storage_id'] for thumbnail in thumbnails}) == 1
+        pack = test_app.fs.get(thumbnails[0]['storage_id'])
+        assert len(pack) == sum(thumbnail['size'] for thumbnail in thumbnails)
+
+        for index, thumbnail in enumerate(thumbnails):
+            url = url_for('projects.get_raw_timeline_thumbnail', project_id=project['_id'], index=index)
+            resp = client.get(url)
+            assert resp.status == '200 OK'
+            assert resp.data == pack[thumbnail['offset']:thumbnail['offset'] + thumbnail['size']]
+            assert resp.data.startswith(b'\x89PNG')
 
 
 @pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': False},)], indirect=True)
@@ -39,6 +69,32 @@ def test_get_raw_timeline_thumbnail_wrong_index(test_app, client, projects):
         assert resp.status == '404 NOT FOUND'
 
 
+@pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': False},)], indirect=True)
+def test_get_raw_timeline_thumbnail_cached(test_app, client, projects):
+    project = projects[0]
+
+    with test_app.test_request_context():
+        # capture timeline thumbnails
+        amount = 3
+        url = url_for(
+            'projects.retrieve_or_create_thumbnails', project_id=project['_id']
+        ) + f'?type=timeline&amount={amount}'
+        client.get(url)
+        # get raw timeline thumbnail
+        url = url_for('projects.get_raw_timeline_thumbnail', project_id=project['_id'], index=1)
+        resp = client.get(url)
+        assert resp.headers['X-Cache'] == 'MISS'
+        content = resp.data
+
+        # next request doesn't touch storage
+        test_app.fs.delete_dir(project['storage_id'])
+        resp = client.get(url)
+        assert resp.status == '200 OK'
+        assert resp.headers['X-Cache'] == 'HIT'
+        assert resp.data == content
+        assert test_app.media_cache.stats()['hits'] == 1
+
+
 @pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': False},)], indirect=True)
 def test_get_raw_preview_thumbnail_success(test_app, client, projects):
     project = projects[0]
@@ -57,6 +113,41 @@ def test_get_raw_preview_thumbnail_success(test_app, client, projects):
         assert resp.mimetype == 'image/png'
 
 
+@pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': False},)], indirect=True)
+def test_get_raw_preview_thumbnail_unknown_size(test_app, client, projects):
+    project = projects[0]
+
+    with test_app.test_request_context():
+        # capture preview thumbnail
+        url = url_for(
+            'projects.retrieve_or_create_thumbnails', project_id=project['_id']
+        ) + '?type=preview&position=5'
+        client.get(url)
+        test_app.mongo.db.projects.update_one(
+            {'_id': ObjectId(project['_id'])}, {'$unset': {'thumbnails.preview.size': 1}}
+        )
+        url = url_for('projects.get_raw_preview_thumbnail', project_id=project['_id'])
+
+        # size is unknown and file is not an OS file, so it's streamed
+        with mock.patch.object(test_app.media_cache, 'max_item_size', 16 * 1024 * 1024), \
+                mock.patch('videoserver.lib.utils.get_os_file_size', return_value=None):
+            resp = client.get(url)
+        assert resp.status == '200 OK'
+        assert 'X-Cache' not in resp.headers
+        content = resp.data
+
+        # file is bigger than a cache item
+        resp = client.get(url)
+        assert 'X-Cache' not in resp.headers
+        assert len(content) > test_app.media_cache.max_item_size
+
+        # size is taken from an OS file
+        with mock.patch.object(test_app.media_cache, 'max_item_size', 16 * 1024 * 1024):
+            resp = client.get(url)
+        assert resp.headers['X-Cache'] == 'MISS'
+        assert resp.data == content
+
+
 @pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': False},)], indirect=True)
 def test_get_raw_preview_thumbnail_404(test_app, client, projects):
     project = projects[0]
@@ -52,3 +52,38 @@ def test_get_raw_video_409_resp(test_app, client, projects):
         resp = client.get(url)
 
         assert resp.status == '409 CONFLICT'
+
+
+@pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': False},)], indirect=True)
+def test_get_raw_video_range_content(test_app, client, projects):
+    project = projects[0]
+    video = test_app.fs.get(project['storage_id'])
+
+    with test_app.test_request_context():
+        url = url_for('projects.get_raw_video', project_id=project['_id'])
+        # bounded range
+        resp = client.get(url, headers={"Range": "bytes=100-1099"})
+        assert resp.status == '206 PARTIAL CONTENT'
+        assert resp.data == video[100:1100]
+        # tail of a file
+        resp = client.get(url, headers={"Range": "bytes=2000000-"})
+        assert resp.status == '206 PARTIAL CONTENT'
+        assert resp.data == video[2000000:]
+
+
+@pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': False},)], indirect=True)
+def test_get_raw_video_from_time(test_app, client, projects):
+    project = projects[0]
+    video = test_app.fs.get(project['storage_id'])
+
+    with test_app.test_request_context():
+        url = url_for('projects.get_raw_video', project_id=project['_id'])
+        # sample has keyframes at 0, 8.4 and 12.96 seconds
+        resp = client.get(f'{url}?t=10')
+        assert resp.status == '206 PARTIAL CONTENT'
+        assert resp.headers['X-Keyframe-Time'] == '8.4'
+        assert resp.headers['Content-Range'] == f'bytes 1945446-{len(video) - 1}/{len(video)}'
+        assert resp.data == video[1945446:]
+
+        resp = client.get(f'{url}?t=abc')
+        assert resp.status == '400 BAD REQUEST'
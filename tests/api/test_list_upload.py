@@ -1,4 +1,6 @@
+import hashlib
 import json
+import os
 from io import BytesIO
 from unittest import mock
 
@@ -6,6 +8,8 @@ import pytest
 from flask import url_for
 from pymongo.errors import ServerSelectionTimeoutError
 
+from videoserver.lib.video_editor import FFMPEGVideoEditor
+
 
 @pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
 def test_upload_project_success(test_app, client, filestreams):
@@ -36,6 +40,8 @@ def test_upload_project_success(test_app, client, filestreams):
         assert resp_data['processing'] == {'video': False, 'thumbnail_preview': False, 'thumbnails_timeline': False}
         assert resp_data['thumbnails'] == {'timeline': [], 'preview': {}}
         assert resp_data['url'] == url_for('projects.get_raw_video', project_id=resp_data["_id"], _external=True)
+        assert resp_data['checksum'] == hashlib.sha256(mp4_stream).hexdigest()
+        assert test_app.fs.get(resp_data['storage_id']) == mp4_stream
 
 
 @pytest.mark.parametrize('filestreams', [('sample_0.jpg',)], indirect=True)
@@ -58,6 +64,56 @@ def test_upload_project_wrong_codec(test_app, client, filestreams):
         assert resp_data['file'] == ["Codec: 'mjpeg' is not supported."]
 
 
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4', 'sample_0.jpg')], indirect=True)
+def test_upload_project_probe_head(test_app, client, filestreams):
+    test_app.config['UPLOAD_PROBE_SIZE'] = 4096
+    get_meta = FFMPEGVideoEditor._get_meta
+
+    with test_app.test_request_context():
+        url = url_for('projects.list_upload_project')
+        with mock.patch.object(FFMPEGVideoEditor, '_get_meta', autospec=True, side_effect=get_meta) as mock_get_meta:
+            resp = client.post(
+                url,
+                data={
+                    'file': (BytesIO(filestreams[1]), 'sample_0.jpg')
+                },
+                content_type='multipart/form-data'
+            )
+            assert resp.status == '400 BAD REQUEST'
+            assert json.loads(resp.data)['file'] == ["Codec: 'mjpeg' is not supported."]
+            # codec was rejected by probing a head only
+            assert [call.args[1] for call in mock_get_meta.call_args_list] == ['pipe:0']
+
+            # mp4 index is at the end, so codec is checked when file is received
+            resp = client.post(
+                url,
+                data={
+                    'file': (BytesIO(filestreams[0]), 'sample_0.mp4')
+                },
+                content_type='multipart/form-data'
+            )
+            assert resp.status == '201 CREATED'
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4', 'sample_0.jpg')], indirect=True)
+def test_upload_project_tmp_file_removed(test_app, client, filestreams, tmp_path):
+    test_app.config['UPLOAD_TMP_PATH'] = str(tmp_path)
+
+    with test_app.test_request_context():
+        url = url_for('projects.list_upload_project')
+        for stream, filename, status in zip(filestreams, ('sample_0.mp4', 'sample_0.jpg'), ('201', '400')):
+            resp = client.post(
+                url,
+                data={
+                    'file': (BytesIO(stream), filename)
+                },
+                content_type='multipart/form-data'
+            )
+            assert resp.status.startswith(status)
+            # received file is either moved into storage or removed
+            assert os.listdir(tmp_path) == []
+
+
 @pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
 def test_upload_project_bad_request(test_app, client, filestreams):
     mp4_stream = filestreams[0]
@@ -0,0 +1,99 @@
+import hashlib
+import json
+from unittest import mock
+
+import pytest
+from flask import url_for
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
+def test_resumable_upload_success(test_app, client, filestreams):
+    mp4_stream = filestreams[0]
+    filename = 'sample_0.mp4'
+    chunk_size = len(mp4_stream) // 3 + 1
+
+    with test_app.test_request_context():
+        url = url_for('projects.create_upload')
+        resp = client.post(url, data=json.dumps({'filename': filename, 'length': len(mp4_stream)}),
+                           content_type='application/json')
+        resp_data = json.loads(resp.data)
+        assert resp.status == '201 CREATED'
+        assert resp_data['offset'] == 0
+        upload_url = resp_data['url']
+
+        # finish incomplete upload
+        resp = client.post(upload_url)
+        assert resp.status == '400 BAD REQUEST'
+
+        for offset in range(0, len(mp4_stream), chunk_size):
+            resp = client.patch(upload_url, data=mp4_stream[offset:offset + chunk_size],
+                                headers={'Upload-Offset': str(offset)})
+            assert resp.status == '200 OK'
+            assert json.loads(resp.data)['offset'] == min(offset + chunk_size, len(mp4_stream))
+            # resend of a chunk
+            resp = client.patch(upload_url, data=mp4_stream[offset:offset + chunk_size],
+                                headers={'Upload-Offset': str(offset)})
+            assert resp.status == '409 CONFLICT'
+
+        resp = client.get(upload_url)
+        assert json.loads(resp.data)['offset'] == len(mp4_stream)
+
+        # project is removed and upload is kept if chunks are not joined, so finishing can be retried
+        with mock.patch('videoserver.apps.projects.tasks.get_video_editor', side_effect=RuntimeError('probe')):
+            resp = client.post(upload_url)
+        assert resp.status == '201 CREATED'
+        project_url = url_for('projects.retrieve_edit_destroy_project', project_id=json.loads(resp.data)['_id'])
+        assert client.get(project_url).status == '404 NOT FOUND'
+        assert client.get(upload_url).status == '200 OK'
+        with pytest.raises(FileNotFoundError):
+            test_app.fs.get(json.loads(resp.data)['storage_id'])
+
+        # upload which is being finished by another request is not joined again
+        test_app.mongo.db.uploads.update_one({}, {'$set': {'finishing': True}})
+        resp = client.post(upload_url)
+        assert resp.status == '409 CONFLICT'
+        test_app.mongo.db.uploads.update_one({}, {'$set': {'finishing': False}})
+
+        resp = client.post(upload_url)
+        resp_data = json.loads(resp.data)
+        assert resp.status == '201 CREATED'
+        # chunks are joined by a background task
+        assert resp_data['processing']['video']
+        resp = client.get(project_url)
+        resp_data = json.loads(resp.data)
+        assert not resp_data['processing']['video']
+        assert resp_data['mime_type'] == 'video/mp4'
+        assert resp_data['original_filename'] == filename
+        assert resp_data['metadata']['codec_name'] == 'h264'
+        assert test_app.fs.get(resp_data['storage_id']) == mp4_stream
+        assert resp_data['checksum'] == hashlib.sha256(mp4_stream).hexdigest()
+        # chunks are removed
+        assert list(test_app.fs.list_dirs()) == [resp_data['storage_id'].rsplit('/', 1)[0]]
+        assert client.get(upload_url).status == '404 NOT FOUND'
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.jpg',)], indirect=True)
+def test_resumable_upload_wrong_chunk(test_app, client, filestreams):
+    jpg_stream = filestreams[0]
+
+    with test_app.test_request_context():
+        url = url_for('projects.create_upload')
+        resp = client.post(url, data=json.dumps({'filename': 'sample_0.jpg', 'length': 10}),
+                           content_type='application/json')
+        upload_url = json.loads(resp.data)['url']
+
+        # chunk is bigger than a file
+        resp = client.patch(upload_url, data=jpg_stream, headers={'Upload-Offset': '0'})
+        assert resp.status == '400 BAD REQUEST'
+        resp = client.patch(upload_url, data=jpg_stream[:10])
+        assert resp.status == '400 BAD REQUEST'
+        resp = client.patch(upload_url, data=jpg_stream[:10], headers={'Upload-Offset': '0'})
+        assert resp.status == '200 OK'
+
+        resp = client.post(upload_url)
+        assert resp.status == '400 BAD REQUEST'
+        # joined file is removed, chunks are kept until upload expires
+        upload = test_app.mongo.db.uploads.find_one()
+        with pytest.raises(FileNotFoundError):
+            test_app.fs.get(upload['storage_id'])
+        assert test_app.fs.get(upload['parts'][0]) == jpg_stream[:10]
@@ -1,9 +1,14 @@
 import json
+import os
+from unittest import mock
 from bson import ObjectId
 
 import pytest
 from flask import url_for
 
+from videoserver.apps.projects.tasks import get_keyframe_index_storage_id, get_segment_storage_id, load_keyframe_index
+from videoserver.lib.video_editor.ffmpeg import FFMPEGVideoEditor
+
 
 @pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': False},)], indirect=True)
 def test_retrieve_project_success(test_app, client, projects):
@@ -64,6 +69,10 @@ def test_destroy_project_success(test_app, client, projects):
         url = url_for('projects.retrieve_edit_destroy_project', project_id=project['_id'])
         resp = client.delete(url)
         assert resp.status == '204 NO CONTENT'
+        # files are removed by a task, it's executed immediately in tests
+        with pytest.raises(FileNotFoundError):
+            test_app.fs.get(project['storage_id'])
+        assert test_app.mongo.db.deletions.count_documents({}) == 0
 
 
 @pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': False},)], indirect=True)
@@ -182,6 +191,237 @@ def test_edit_project_trim_success(test_app, client, projects):
         assert resp_data['metadata']['duration'] == old_duration - start
 
 
+@pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': True},)], indirect=True)
+def test_edit_project_keyframe_index(test_app, client, projects):
+    project = projects[0]
+
+    with test_app.test_request_context():
+        # index is built after upload and copied to a duplicate
+        keyframes = load_keyframe_index(project)
+        assert list(keyframes.pts) == [0.0, 8.4, 12.96]
+        # index doesn't take space of thumbnails in http cache
+        assert test_app.media_cache.get(get_keyframe_index_storage_id(project)) is None
+
+        url = url_for('projects.retrieve_edit_destroy_project', project_id=project['_id'])
+        resp = client.put(url, data=json.dumps({"trim": "2.0,6.0"}), content_type='application/json')
+        assert resp.status == '202 ACCEPTED'
+
+        # index of a new version replaces an old one
+        edited_project = test_app.mongo.db.projects.find_one({'_id': ObjectId(project['_id'])})
+        assert edited_project['version'] == 3
+        assert load_keyframe_index(edited_project).pts[0] == 0.0
+        with pytest.raises(Exception):
+            test_app.fs.get(get_keyframe_index_storage_id(project))
+
+
+@pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': True},)], indirect=True)
+def test_edit_project_trim_copy(test_app, client, projects):
+    project = projects[0]
+
+    with test_app.test_request_context():
+        url = url_for('projects.retrieve_edit_destroy_project', project_id=project['_id'])
+        # copy mode can't be combined with filters
+        resp = client.put(
+            url,
+            data=json.dumps({"trim": "9.0,11.0", "trim_mode": "copy", "scale": 640}),
+            content_type='application/json'
+        )
+        assert resp.status == '400 BAD REQUEST'
+
+        resp = client.put(
+            url,
+            data=json.dumps({"trim": "9.0,11.0", "trim_mode": "copy"}),
+            content_type='application/json'
+        )
+        resp_data = json.loads(resp.data)
+        assert resp.status == '202 ACCEPTED'
+        # trim is widened to keyframes at 8.4 and 12.96 seconds
+        assert resp_data == {'processing': True, 'trim': {'start': 8.4, 'end': 12.96}}
+
+        resp = client.get(url)
+        resp_data = json.loads(resp.data)
+        assert not resp_data['processing']['video']
+        assert resp_data['metadata']['trim'] == {'start': 8.4, 'end': 12.96}
+        assert resp_data['metadata']['duration'] == pytest.approx(12.96 - 8.4, abs=0.2)
+
+
+@pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': True},)], indirect=True)
+def test_edit_project_trim_copy_rotate(test_app, client, projects):
+    project = projects[0]
+
+    with test_app.test_request_context():
+        url = url_for('projects.retrieve_edit_destroy_project', project_id=project['_id'])
+        # container without display matrix can't be rotated by copying
+        with mock.patch.object(FFMPEGVideoEditor, 'DISPLAY_MATRIX_EXTENSIONS', ()):
+            resp = client.put(
+                url,
+                data=json.dumps({"trim": "9.0,11.0", "trim_mode": "copy", "rotate": 90}),
+                content_type='application/json'
+            )
+        assert resp.status == '400 BAD REQUEST'
+
+        resp = client.put(
+            url,
+            data=json.dumps({"trim": "9.0,11.0", "trim_mode": "copy", "rotate": 90}),
+            content_type='application/json'
+        )
+        assert resp.status == '202 ACCEPTED'
+
+        resp = client.get(url)
+        resp_data = json.loads(resp.data)
+        assert not resp_data['processing']['video']
+        assert resp_data['metadata']['trim'] == {'start': 8.4, 'end': 12.96}
+        assert resp_data['metadata']['width'] == 720
+        assert resp_data['metadata']['height'] == 1280
+
+
+@pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': True},)], indirect=True)
+def test_edit_project_trim_smart(test_app, client, projects):
+    project = projects[0]
+
+    with test_app.test_request_context():
+        url = url_for('projects.retrieve_edit_destroy_project', project_id=project['_id'])
+        # smart mode can't be combined with filters
+        resp = client.put(
+            url,
+            data=json.dumps({"trim": "5.0,14.0", "trim_mode": "smart", "scale": 640}),
+            content_type='application/json'
+        )
+        assert resp.status == '400 BAD REQUEST'
+
+        resp = client.put(
+            url,
+            data=json.dumps({"trim": "5.0,14.0", "trim_mode": "smart"}),
+            content_type='application/json'
+        )
+        assert resp.status == '202 ACCEPTED'
+        assert json.loads(resp.data) == {'processing': True}
+
+        resp = client.get(url)
+        resp_data = json.loads(resp.data)
+        assert not resp_data['processing']['video']
+        assert resp_data['metadata']['duration'] == 9.0
+
+
+@pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': True},)], indirect=True)
+def test_edit_project_encoder_profile(test_app, client, projects):
+    project = projects[0]
+
+    with test_app.test_request_context():
+        url = url_for('projects.retrieve_edit_destroy_project', project_id=project['_id'])
+        resp = client.put(
+            url,
+            data=json.dumps({"scale": 640, "encoder_profile": "unknown"}),
+            content_type='application/json'
+        )
+        assert resp.status == '400 BAD REQUEST'
+        assert 'encoder_profile' in json.loads(resp.data)
+
+        # profile is not an edit rule
+        resp = client.put(
+            url,
+            data=json.dumps({"encoder_profile": "fast"}),
+            content_type='application/json'
+        )
+        assert resp.status == '400 BAD REQUEST'
+        assert 'edit' in json.loads(resp.data)
+
+        resp = client.put(
+            url,
+            data=json.dumps({"scale": 640, "encoder_profile": "fast"}),
+            content_type='application/json'
+        )
+        assert resp.status == '202 ACCEPTED'
+
+        resp = client.get(url)
+        resp_data = json.loads(resp.data)
+        assert not resp_data['processing']['video']
+        assert resp_data['metadata']['codec_name'] == 'h264'
+        assert resp_data['metadata']['width'] == 640
+
+
+@pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': True},)], indirect=True)
+def test_edit_project_segments(test_app, client, projects):
+    project = projects[0]
+    test_app.config['EDIT_SEGMENT_DURATION'] = 4
+
+    # celery tasks run in a context of the first app created in a session, so they use config of this one
+    with test_app.test_request_context(), mock.patch('videoserver.apps.projects.tasks.app', test_app), \
+            mock.patch.object(FFMPEGVideoEditor, 'encode_segment', autospec=True,
+                              side_effect=FFMPEGVideoEditor.encode_segment) as encode_segment:
+        url = url_for('projects.retrieve_edit_destroy_project', project_id=project['_id'])
+        resp = client.put(
+            url,
+            data=json.dumps({"scale": 640}),
+            content_type='application/json'
+        )
+        assert resp.status == '202 ACCEPTED'
+
+        # sample is split at keyframes at 8.4 and 12.96 seconds
+        assert [(c.kwargs['start'], c.kwargs['end']) for c in encode_segment.call_args_list] == [
+            (0, 8.4), (8.4, 12.96), (12.96, 15.0)
+        ]
+        resp = client.get(url)
+        resp_data = json.loads(resp.data)
+        assert not resp_data['processing']['video']
+        assert resp_data['version'] == 3
+        assert resp_data['metadata']['width'] == 640
+        assert resp_data['metadata']['nb_frames'] == 15 * 25
+        # segments are removed
+        with pytest.raises(Exception):
+            test_app.fs.get(get_segment_storage_id(project, 0))
+
+
+@pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': True},)], indirect=True)
+def test_edit_project_segments_fail(test_app, client, projects):
+    project = projects[0]
+    test_app.config['EDIT_SEGMENT_DURATION'] = 4
+
+    with test_app.test_request_context(), mock.patch('videoserver.apps.projects.tasks.app', test_app), \
+            mock.patch.object(FFMPEGVideoEditor, 'encode_segment', side_effect=RuntimeError) as encode_segment:
+        url = url_for('projects.retrieve_edit_destroy_project', project_id=project['_id'])
+        resp = client.put(
+            url,
+            data=json.dumps({"scale": 640}),
+            content_type='application/json'
+        )
+        assert resp.status == '202 ACCEPTED'
+        assert encode_segment.called
+
+        # edit is failed, video is not replaced
+        resp = client.get(url)
+        resp_data = json.loads(resp.data)
+        assert not resp_data['processing']['video']
+        assert resp_data['version'] == 2
+        assert resp_data['metadata']['width'] == 1280
+
+
+@pytest.mark.parametrize('segment_duration', [0, 4])
+@pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': True},)], indirect=True)
+def test_edit_project_replace_fail(test_app, client, projects, segment_duration):
+    project = projects[0]
+    test_app.config['EDIT_SEGMENT_DURATION'] = segment_duration
+
+    with test_app.test_request_context(), mock.patch('videoserver.apps.projects.tasks.app', test_app), \
+            mock.patch.object(test_app.fs, 'replace_from_path', side_effect=OSError) as replace_from_path:
+        url = url_for('projects.retrieve_edit_destroy_project', project_id=project['_id'])
+        resp = client.put(
+            url,
+            data=json.dumps({"scale": 640}),
+            content_type='application/json'
+        )
+        assert resp.status == '202 ACCEPTED'
+        assert replace_from_path.called
+
+        resp = client.get(url)
+        assert not json.loads(resp.data)['processing']['video']
+        # edited video and segments are not left in a storage
+        assert not [
+            name for _, _, names in os.walk(test_app.config['FS_MEDIA_STORAGE_PATH'])
+            for name in names if name.startswith('.')
+        ]
+
+
 @pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': True},)], indirect=True)
 def test_edit_project_trim_fail(test_app, client, projects):
     project = projects[0]
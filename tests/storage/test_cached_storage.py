@@ -0,0 +1,96 @@
+import os
+from unittest import mock
+
+import pytest
+from videoserver.lib.storage.cached_storage import CachedStorage
+from videoserver.lib.storage.file_system_storage import FileSystemStorage
+
+
+@pytest.fixture(scope='function')
+def cached_storage(test_app):
+    test_app.config['STORAGE_CACHE_PATH'] = os.path.join(
+        os.path.dirname(test_app.config['FS_MEDIA_STORAGE_PATH']), 'cache'
+    )
+    test_app.config['STORAGE_CACHE_BLOCK_SIZE'] = 64 * 1024
+    test_app.config['STORAGE_CACHE_SIZE'] = 1024 * 1024
+    with test_app.app_context():
+        yield CachedStorage(FileSystemStorage())
+
+
+def _cache_size(storage):
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, files in os.walk(storage._get_cache_path()) for name in files
+    )
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
+def test_cached_storage_read_through(cached_storage, filestreams):
+    mp4_stream = filestreams[0]
+    storage_id = cached_storage.storage.put(
+        content=mp4_stream,
+        filename='sample_video.mp4',
+        project_id='project_one',
+        asset_type='project'
+    )
+
+    with mock.patch.object(cached_storage.storage, 'get_range', wraps=cached_storage.storage.get_range) as get_range:
+        assert cached_storage.get_range(storage_id, 100000, 70000) == mp4_stream[100000:170000]
+        # blocks 1 and 2
+        assert get_range.call_count == 2
+        assert cached_storage.get_range(storage_id, 131072, 1000) == mp4_stream[131072:132072]
+        assert get_range.call_count == 2
+        with cached_storage.open_read(storage_id, start=10, length=100) as f:
+            assert f.read(100) == mp4_stream[10:110]
+        assert get_range.call_count == 3
+
+    assert cached_storage.get_range(storage_id, 3000000, 1000) == b''
+    # cache is limited, least recently used blocks are evicted
+    assert cached_storage.get(storage_id) == mp4_stream
+    assert _cache_size(cached_storage) <= 1024 * 1024
+    assert cached_storage._size == _cache_size(cached_storage)
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.jpg', 'sample_1.jpg')], indirect=True)
+def test_cached_storage_write_through(cached_storage, filestreams):
+    jpg_stream_0, jpg_stream_1 = filestreams
+    storage_id = cached_storage.put(
+        content=jpg_stream_0,
+        filename='sample_image.jpg',
+        project_id='project_one',
+        asset_type='project'
+    )
+    assert cached_storage.storage.get(storage_id) == jpg_stream_0
+
+    with mock.patch.object(cached_storage.storage, 'get_range') as get_range:
+        assert cached_storage.get(storage_id) == jpg_stream_0
+        cached_storage.replace(jpg_stream_1, storage_id)
+        assert cached_storage.get(storage_id) == jpg_stream_1
+        assert not get_range.called
+    assert cached_storage.storage.get(storage_id) == jpg_stream_1
+
+    cached_storage.delete(storage_id)
+    assert not os.path.exists(cached_storage._get_cache_path(storage_id))
+    with pytest.raises(FileNotFoundError):
+        cached_storage.get(storage_id)
+    assert _cache_size(cached_storage) == 0
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.jpg', 'sample_1.jpg')], indirect=True)
+def test_cached_storage_replaced_by_other_node(cached_storage, filestreams):
+    jpg_stream_0, jpg_stream_1 = filestreams
+    storage_id = cached_storage.put(
+        content=jpg_stream_0,
+        filename='sample_image.jpg',
+        project_id='project_one',
+        asset_type='project'
+    )
+    assert cached_storage.get(storage_id) == jpg_stream_0
+
+    # file is replaced in the storage bypassing this cache
+    cached_storage.storage.replace(jpg_stream_1, storage_id)
+    assert cached_storage.get(storage_id) == jpg_stream_1
+    assert cached_storage.get_range(storage_id, 10, 100) == jpg_stream_1[10:110]
+    # blocks of the previous version are removed
+    assert _cache_size(cached_storage) == len(jpg_stream_1)
+    assert cached_storage._size == len(jpg_stream_1)
@@ -0,0 +1,93 @@
+import os
+from io import BytesIO
+
+import pytest
+from videoserver.lib.storage.content_addressable_storage import ContentAddressableStorage
+
+
+def _blobs(storage):
+    blobs = []
+    for root, _, files in os.walk(storage._get_service_path(storage.BLOBS_DIR)):
+        blobs.extend(files)
+    return blobs
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4', 'sample_0.jpg')], indirect=True)
+def test_ca_storage_put_deduplicate(test_app, filestreams):
+    storage = ContentAddressableStorage()
+    mp4_stream, jpg_stream_0 = filestreams
+
+    with test_app.app_context():
+        storage_id = storage.put(
+            content=mp4_stream,
+            filename='sample_video.mp4',
+            project_id='project_one',
+            asset_type='project'
+        )
+        storage.put(
+            content=jpg_stream_0,
+            filename='sample_image.jpg',
+            storage_id=storage_id,
+            asset_type='thumbnail'
+        )
+        # same content from a stream
+        dup_storage_id = storage.put(
+            content=BytesIO(mp4_stream),
+            filename='sample_video.mp4',
+            project_id='project_two',
+            asset_type='project'
+        )
+        # same content from an opened storage file
+        with storage.open_read(storage_id) as f:
+            dup_2_storage_id = storage.put(
+                content=f,
+                filename='sample_video.mp4',
+                project_id='project_three',
+                asset_type='project'
+            )
+
+        assert len(_blobs(storage)) == 2
+        assert storage.get(dup_storage_id) == mp4_stream
+        assert storage.get(dup_2_storage_id) == mp4_stream
+        assert os.stat(storage._get_file_path(storage_id)).st_nlink == 4
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4', 'sample_0.jpg', 'sample_1.jpg')], indirect=True)
+def test_ca_storage_replace_delete(test_app, filestreams):
+    storage = ContentAddressableStorage()
+    mp4_stream, jpg_stream_0, jpg_stream_1 = filestreams
+
+    with test_app.app_context():
+        storage_id = storage.put(
+            content=mp4_stream,
+            filename='sample_video.mp4',
+            project_id='project_one',
+            asset_type='project'
+        )
+        thumbn_storage_id = storage.put(
+            content=jpg_stream_0,
+            filename='sample_image.jpg',
+            storage_id=storage_id,
+            asset_type='thumbnail'
+        )
+        dup_storage_id = storage.put(
+            content=mp4_stream,
+            filename='sample_video.mp4',
+            project_id='project_two',
+            asset_type='project'
+        )
+
+        # old blob is released once it's not referenced anymore
+        storage.replace(content=jpg_stream_1, storage_id=thumbn_storage_id)
+        assert storage.get(thumbn_storage_id) == jpg_stream_1
+        assert len(_blobs(storage)) == 2
+
+        # blob is still referenced by a duplicate
+        storage.delete_dir(storage_id)
+        assert storage.get(dup_storage_id) == mp4_stream
+        assert len(_blobs(storage)) == 1
+
+        storage.delete(dup_storage_id)
+        with pytest.raises(FileNotFoundError):
+            storage.get(dup_storage_id)
+        assert len(_blobs(storage)) == 0
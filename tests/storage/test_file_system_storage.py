@@ -1,4 +1,5 @@
 import os
+from io import BytesIO
 
 import pytest
 from videoserver.lib.storage.file_system_storage import FileSystemStorage
@@ -201,3 +202,89 @@ def test_fs_storage_delete_dir(test_app, filestreams):
             storage.get(thumbn_0_storage_id)
 
         assert not os.path.exists(os.path.dirname(storage._get_file_path(storage_id)))
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
+def test_fs_storage_put_stream_open_read(test_app, filestreams):
+    storage = FileSystemStorage()
+    mp4_stream = filestreams[0]
+    project_id = 'project_one'
+    with test_app.app_context():
+        test_app.config['STORAGE_CHUNK_SIZE'] = 1000
+        storage_id = storage.put(
+            content=BytesIO(mp4_stream),
+            filename='sample_video.mp4',
+            project_id=project_id,
+            asset_type='project'
+        )
+        with storage.open_read(storage_id) as f:
+            assert f.read() == mp4_stream
+
+        storage.replace(
+            content=(mp4_stream[i:i + 1000] for i in range(0, 5000, 1000)),
+            storage_id=storage_id,
+        )
+        with storage.open_read(storage_id) as f:
+            assert f.read() == mp4_stream[:5000]
+
+        with pytest.raises(FileNotFoundError):
+            storage.open_read(storage_id + '.random.png')
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4', 'sample_0.jpg', 'sample_1.jpg')], indirect=True)
+def test_fs_storage_copy(test_app, filestreams):
+    storage = FileSystemStorage()
+    mp4_stream, jpg_stream_0, jpg_stream_1 = filestreams
+    with test_app.app_context():
+        storage_id = storage.put(
+            content=mp4_stream,
+            filename='sample_video.mp4',
+            project_id='project_one',
+            asset_type='project'
+        )
+        thumbn_storage_id = storage.put(
+            content=jpg_stream_0,
+            filename='sample_image.jpg',
+            storage_id=storage_id,
+            asset_type='thumbnail'
+        )
+        copy_storage_id = storage.copy(
+            storage_id,
+            filename='sample_video.mp4',
+            project_id='project_two'
+        )
+        copy_thumbn_storage_id = storage.copy(
+            thumbn_storage_id,
+            filename='sample_image.jpg',
+            storage_id=copy_storage_id,
+            asset_type='thumbnail'
+        )
+        assert storage.get(copy_storage_id) == mp4_stream
+        assert storage.get(copy_thumbn_storage_id) == jpg_stream_0
+
+        # copies are independent
+        storage.replace(content=jpg_stream_1, storage_id=copy_thumbn_storage_id)
+        assert storage.get(thumbn_storage_id) == jpg_stream_0
+        storage.delete_dir(storage_id)
+        assert storage.get(copy_storage_id) == mp4_stream
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4', 'sample_0.jpg')], indirect=True)
+def test_fs_storage_replace_from_path(test_app, filestreams):
+    storage = FileSystemStorage()
+    mp4_stream, jpg_stream_0 = filestreams
+    with test_app.app_context():
+        storage_id = storage.put(
+            content=jpg_stream_0,
+            filename='sample_video.mp4',
+            project_id='project_one',
+            asset_type='project'
+        )
+        assert storage.local_path(storage_id) == storage._get_file_path(storage_id)
+
+        file_path = os.path.join(os.path.dirname(storage.local_path(storage_id)), 'edited.mp4')
+        with open(file_path, 'wb') as f:
+            f.write(mp4_stream)
+        storage.replace_from_path(file_path, storage_id)
+        assert storage.get(storage_id) == mp4_stream
+        assert not os.path.exists(file_path)
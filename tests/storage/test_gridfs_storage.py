@@ -0,0 +1,103 @@
+import os
+from io import BytesIO
+
+import pytest
+from videoserver.lib.storage.gridfs_storage import GridFSStorage
+
+
+@pytest.fixture(scope='function')
+def gridfs_storage(test_app):
+    test_app.config['GRIDFS_BUCKET_NAME'] = 'media_test'
+    test_app.config['GRIDFS_CHUNK_SIZE'] = 64 * 1024
+    with test_app.app_context():
+        yield GridFSStorage()
+        test_app.mongo.db['media_test.files'].drop()
+        test_app.mongo.db['media_test.chunks'].drop()
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4', 'sample_0.jpg', 'sample_1.jpg')], indirect=True)
+def test_gridfs_storage_put_get_replace(gridfs_storage, filestreams):
+    mp4_stream, jpg_stream_0, jpg_stream_1 = filestreams
+
+    storage_id = gridfs_storage.put(
+        content=BytesIO(mp4_stream),
+        filename='sample_video.mp4',
+        project_id='project_one',
+        asset_type='project',
+        content_type='video/mp4'
+    )
+    thumbn_storage_id = gridfs_storage.put(
+        content=jpg_stream_0,
+        filename='sample_image.jpg',
+        storage_id=storage_id,
+        asset_type='thumbnail'
+    )
+    assert gridfs_storage.get(storage_id) == mp4_stream
+    assert gridfs_storage.get(thumbn_storage_id) == jpg_stream_0
+    with pytest.raises(Exception):
+        gridfs_storage.put(
+            content=jpg_stream_1,
+            filename='sample_image.jpg',
+            storage_id=storage_id,
+            asset_type='thumbnail',
+            override=False
+        )
+
+    gridfs_storage.replace(jpg_stream_1, thumbn_storage_id)
+    assert gridfs_storage.get(thumbn_storage_id) == jpg_stream_1
+    # old revision is removed
+    assert gridfs_storage.files.count_documents({'filename': thumbn_storage_id}) == 1
+
+    with pytest.raises(FileNotFoundError):
+        gridfs_storage.get(storage_id + '.random.png')
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
+def test_gridfs_storage_get_range(gridfs_storage, filestreams):
+    mp4_stream = filestreams[0]
+    storage_id = gridfs_storage.put(
+        content=mp4_stream,
+        filename='sample_video.mp4',
+        project_id='project_one',
+        asset_type='project'
+    )
+
+    assert gridfs_storage.get_range(storage_id, 0, 1000000) == mp4_stream[:1000000]
+    assert gridfs_storage.get_range(storage_id, 100000, 70000) == mp4_stream[100000:170000]
+    assert gridfs_storage.get_range(storage_id, 2000000, 1000000) == mp4_stream[2000000:]
+    assert gridfs_storage.get_range(storage_id, 3000000, 1000000) == b''
+    with gridfs_storage.open_read(storage_id, start=100, length=50) as f:
+        assert f.read(50) == mp4_stream[100:150]
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4', 'sample_0.jpg')], indirect=True)
+def test_gridfs_storage_copy_delete(gridfs_storage, filestreams):
+    mp4_stream, jpg_stream_0 = filestreams
+    storage_id = gridfs_storage.put(
+        content=mp4_stream,
+        filename='sample_video.mp4',
+        project_id='project_one',
+        asset_type='project'
+    )
+    thumbn_storage_id = gridfs_storage.put(
+        content=jpg_stream_0,
+        filename='sample_image.jpg',
+        storage_id=storage_id,
+        asset_type='thumbnail'
+    )
+    copy_storage_id = gridfs_storage.copy(storage_id, filename='sample_video.mp4', project_id='project_two')
+    assert gridfs_storage.get(copy_storage_id) == mp4_stream
+    assert set(gridfs_storage.list_dirs()) == {os.path.dirname(storage_id), os.path.dirname(copy_storage_id)}
+
+    gridfs_storage.delete(thumbn_storage_id)
+    with pytest.raises(FileNotFoundError):
+        gridfs_storage.get(thumbn_storage_id)
+
+    gridfs_storage.delete_dir(storage_id)
+    with pytest.raises(FileNotFoundError):
+        gridfs_storage.get(storage_id)
+    assert gridfs_storage.get(copy_storage_id) == mp4_stream
+    # chunks of deleted files are removed too
+    copy_file = gridfs_storage.files.find_one({'filename': copy_storage_id})
+    assert gridfs_storage.chunks.count_documents({}) == \
+        gridfs_storage.chunks.count_documents({'files_id': copy_file['_id']})
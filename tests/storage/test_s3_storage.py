@@ -0,0 +1,156 @@
+import os
+from unittest import mock
+
+import pytest
+
+from videoserver.lib.storage.s3_storage import S3Storage
+
+# s3 storage is tested against a local stand-in s3 server
+boto3 = pytest.importorskip('boto3')
+moto_server = pytest.importorskip('moto.server')
+
+
+@pytest.fixture(scope='module')
+def s3_endpoint():
+    server = moto_server.ThreadedMotoServer(ip_address='127.0.0.1', port=0)
+    server.start()
+    host, port = server.get_host_and_port()
+    yield f'http://{host}:{port}'
+    server.stop()
+
+
+@pytest.fixture(scope='function')
+def s3_storage(test_app, s3_endpoint):
+    test_app.config.update({
+        'S3_ENDPOINT_URL': s3_endpoint,
+        'S3_REGION_NAME': 'us-east-1',
+        'S3_ACCESS_KEY_ID': 'testing',
+        'S3_SECRET_ACCESS_KEY': 'testing',
+        'S3_BUCKET': 'videoserver-test',
+        # force multipart upload for fixtures
+        'S3_MULTIPART_THRESHOLD': 5 * 1024 * 1024,
+        'S3_MULTIPART_CHUNKSIZE': 5 * 1024 * 1024,
+    })
+    with test_app.app_context():
+        storage = S3Storage()
+        storage.client.create_bucket(Bucket=test_app.config['S3_BUCKET'])
+        yield storage
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4', 'sample_0.jpg', 'sample_1.jpg')], indirect=True)
+def test_s3_storage_put_get(s3_storage, filestreams):
+    mp4_stream, jpg_stream_0, jpg_stream_1 = filestreams
+
+    # multipart upload
+    big_stream = mp4_stream * 3
+    storage_id = s3_storage.put(
+        content=big_stream,
+        filename='sample_video.mp4',
+        project_id='project_one',
+        asset_type='project',
+        content_type='video/mp4'
+    )
+    thumbn_storage_id = s3_storage.put(
+        content=(chunk for chunk in (jpg_stream_0[:100], jpg_stream_0[100:])),
+        filename='sample_image.jpg',
+        storage_id=storage_id,
+        asset_type='thumbnail'
+    )
+    assert s3_storage.get(storage_id) == big_stream
+    assert s3_storage.get(thumbn_storage_id) == jpg_stream_0
+
+    with pytest.raises(Exception):
+        s3_storage.put(
+            content=jpg_stream_1,
+            filename='sample_image.jpg',
+            storage_id=storage_id,
+            asset_type='thumbnail',
+            override=False
+        )
+    s3_storage.replace(jpg_stream_1, thumbn_storage_id)
+    assert s3_storage.get(thumbn_storage_id) == jpg_stream_1
+
+    with pytest.raises(FileNotFoundError):
+        s3_storage.get(storage_id + '.random.png')
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
+def test_s3_storage_get_range(s3_storage, filestreams):
+    mp4_stream = filestreams[0]
+    storage_id = s3_storage.put(
+        content=mp4_stream,
+        filename='sample_video.mp4',
+        project_id='project_one',
+        asset_type='project'
+    )
+
+    assert s3_storage.get_range(storage_id, 0, 1000000) == mp4_stream[:1000000]
+    assert s3_storage.get_range(storage_id, 2000000, 1000000) == mp4_stream[2000000:]
+    assert s3_storage.get_range(storage_id, 3000000, 1000000) == b''
+    with s3_storage.open_read(storage_id, start=100, length=50) as f:
+        assert f.read() == mp4_stream[100:150]
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4', 'sample_0.jpg')], indirect=True)
+def test_s3_storage_copy_delete(s3_storage, filestreams):
+    mp4_stream, jpg_stream_0 = filestreams
+    storage_id = s3_storage.put(
+        content=mp4_stream,
+        filename='sample_video.mp4',
+        project_id='project_one',
+        asset_type='project'
+    )
+    thumbn_storage_id = s3_storage.put(
+        content=jpg_stream_0,
+        filename='sample_image.jpg',
+        storage_id=storage_id,
+        asset_type='thumbnail'
+    )
+    copy_storage_id = s3_storage.copy(storage_id, filename='sample_video.mp4', project_id='project_two')
+    assert s3_storage.get(copy_storage_id) == mp4_stream
+
+    s3_storage.delete(thumbn_storage_id)
+    with pytest.raises(FileNotFoundError):
+        s3_storage.get(thumbn_storage_id)
+
+    s3_storage.delete_dir(storage_id)
+    with pytest.raises(FileNotFoundError):
+        s3_storage.get(storage_id)
+    assert s3_storage.get(copy_storage_id) == mp4_stream
+    assert list(s3_storage.list_dirs()) == [os.path.dirname(copy_storage_id)]
+
+    s3_storage.delete_many([copy_storage_id])
+    with pytest.raises(FileNotFoundError):
+        s3_storage.get(copy_storage_id)
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.jpg',)], indirect=True)
+def test_s3_storage_delete_errors(s3_storage, filestreams):
+    jpg_stream = filestreams[0]
+    storage_ids = [
+        s3_storage.put(content=jpg_stream, filename=f'sample_{i}.jpg', project_id='project_one') for i in range(3)
+    ]
+    delete_objects = s3_storage.client.delete_objects
+
+    def deny_first(Bucket, Delete):
+        # access to the first object is denied, quiet response reports only errors
+        objects = [obj for obj in Delete['Objects'] if obj['Key'] != storage_ids[0]]
+        response = delete_objects(Bucket=Bucket, Delete={**Delete, 'Objects': objects})
+        response['Errors'] = [{'Key': storage_ids[0], 'Code': 'AccessDenied', 'Message': 'Access Denied'}]
+        return response
+
+    with mock.patch.object(s3_storage.client, 'delete_objects', side_effect=deny_first):
+        assert s3_storage.delete_many(storage_ids[:2]) == [storage_ids[0]]
+        assert s3_storage.get(storage_ids[0]) == jpg_stream
+        with pytest.raises(FileNotFoundError):
+            s3_storage.get(storage_ids[1])
+
+        with pytest.raises(OSError):
+            s3_storage.delete_dir(storage_ids[0])
+        assert s3_storage.get(storage_ids[0]) == jpg_stream
+        with pytest.raises(FileNotFoundError):
+            s3_storage.get(storage_ids[2])
+
+    s3_storage.delete_dir(storage_ids[0])
+    with pytest.raises(FileNotFoundError):
+        s3_storage.get(storage_ids[0])
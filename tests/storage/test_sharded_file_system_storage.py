@@ -0,0 +1,94 @@
+import os
+
+import pytest
+from videoserver.lib.storage.sharded_file_system_storage import ShardedFileSystemStorage
+
+
+@pytest.fixture(scope='function')
+def roots(test_app):
+    media_path = os.path.dirname(test_app.config['FS_MEDIA_STORAGE_PATH'])
+    return [os.path.join(media_path, f'shard_{i}') for i in range(3)]
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4', 'sample_0.jpg')], indirect=True)
+def test_sharded_fs_storage_put_rebalance(test_app, roots, filestreams):
+    storage = ShardedFileSystemStorage()
+    mp4_stream, jpg_stream_0 = filestreams
+    test_app.config['FS_MEDIA_STORAGE_PATHS'] = roots[:2]
+
+    with test_app.app_context():
+        storage_ids = []
+        for i in range(10):
+            storage_id = storage.put(
+                content=mp4_stream[:1000],
+                filename='sample_video.mp4',
+                project_id=f'project_{i}',
+                asset_type='project'
+            )
+            storage.put(
+                content=jpg_stream_0,
+                filename='sample_image.jpg',
+                storage_id=storage_id,
+                asset_type='thumbnail'
+            )
+            storage_ids.append(storage_id)
+            # all files of a project are on the same shard
+            root = storage._get_root(storage_id)
+            assert os.path.exists(os.path.join(root, storage_id))
+            assert os.path.exists(os.path.join(root, os.path.dirname(storage_id), 'thumbnail', 'sample_image.jpg'))
+        # projects are spread across shards
+        assert all(os.listdir(root) for root in roots[:2])
+
+        # new shard is added, files are still found
+        test_app.config['FS_MEDIA_STORAGE_PATHS'] = roots
+        moved = [storage_id for storage_id in storage_ids if storage._get_root(storage_id) == roots[2]]
+        assert moved
+        for storage_id in storage_ids:
+            assert storage.get(storage_id) == mp4_stream[:1000]
+
+        assert storage.rebalance() == len(moved)
+        assert storage.rebalance() == 0
+        for storage_id in storage_ids:
+            root = storage._get_root(storage_id)
+            assert storage.local_path(storage_id) == os.path.join(root, storage_id)
+            assert storage.get(storage_id) == mp4_stream[:1000]
+            assert storage.get(f'{os.path.dirname(storage_id)}/thumbnail/sample_image.jpg') == jpg_stream_0
+
+        storage.delete_dir(storage_ids[0])
+        with pytest.raises(FileNotFoundError):
+            storage.get(storage_ids[0])
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
+def test_sharded_fs_storage_rebalance_skips_incomplete(test_app, roots, filestreams):
+    storage = ShardedFileSystemStorage()
+    mp4_stream = filestreams[0]
+    test_app.config['FS_MEDIA_STORAGE_PATHS'] = roots[:2]
+
+    with test_app.app_context():
+        storage_ids = [
+            storage.put(content=mp4_stream[:1000], filename='sample_video.mp4', project_id=f'project_{i}')
+            for i in range(10)
+        ]
+        test_app.config['FS_MEDIA_STORAGE_PATHS'] = roots
+        storage_id = next(storage_id for storage_id in storage_ids if storage._get_root(storage_id) == roots[2])
+        test_app.config['FS_MEDIA_STORAGE_PATHS'] = roots[:2]
+        old_root = storage._get_root(storage_id)
+        # video editor is writing an edited video
+        edit_path = os.path.join(os.path.dirname(storage.local_path(storage_id)), '.0123_edit.mp4')
+        with open(edit_path, 'wb') as f:
+            f.write(mp4_stream[:500])
+
+        test_app.config['FS_MEDIA_STORAGE_PATHS'] = roots
+        storage.rebalance()
+        assert storage.local_path(storage_id) == os.path.join(roots[2], storage_id)
+        assert os.path.exists(edit_path)
+        assert edit_path.startswith(old_root)
+        assert not os.path.exists(os.path.join(roots[2], os.path.dirname(storage_id), '.0123_edit.mp4'))
+
+        # edited video is adopted on a new shard when it's complete
+        with open(edit_path, 'ab') as f:
+            f.write(mp4_stream[500:1500])
+        storage.replace_from_path(edit_path, storage_id)
+        assert storage.get(storage_id) == mp4_stream[:1500]
+        assert storage.local_path(storage_id) == os.path.join(roots[2], storage_id)
@@ -0,0 +1,76 @@
+from datetime import datetime, timedelta
+from unittest import mock
+
+import pytest
+from videoserver.apps.projects.tasks import delete_later, purge_deleted, sweep_storage
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.jpg',)], indirect=True)
+def test_purge_deleted_keeps_failed(test_app, filestreams):
+    jpg_stream = filestreams[0]
+    test_app.config['STORAGE_DELETE_BATCH_SIZE'] = 2
+
+    with test_app.app_context():
+        storage_ids = [
+            test_app.fs.put(jpg_stream, f'sample_{i}.jpg', project_id=f'project_{i}') for i in range(5)
+        ]
+        with mock.patch.object(test_app.fs, 'delete_dir', side_effect=Exception('Some error')):
+            delete_later(storage_ids[0], directory=True)
+            delete_later(*storage_ids[1:])
+
+        assert test_app.mongo.db.deletions.count_documents({}) == 1
+        for storage_id in storage_ids[1:]:
+            with pytest.raises(FileNotFoundError):
+                test_app.fs.get(storage_id)
+
+        # failed tombstone is drained by the next run
+        purge_deleted()
+        assert test_app.mongo.db.deletions.count_documents({}) == 0
+        with pytest.raises(FileNotFoundError):
+            test_app.fs.get(storage_ids[0])
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.jpg',)], indirect=True)
+def test_purge_deleted_keeps_partially_failed(test_app, filestreams):
+    jpg_stream = filestreams[0]
+
+    with test_app.app_context():
+        storage_ids = [
+            test_app.fs.put(jpg_stream, f'sample_{i}.jpg', project_id=f'project_{i}') for i in range(3)
+        ]
+        # storage failed to remove one file of a batch
+        with mock.patch.object(test_app.fs, 'delete_many', return_value=[storage_ids[1]]):
+            delete_later(*storage_ids)
+        tombstones = list(test_app.mongo.db.deletions.find())
+        assert [tombstone['storage_id'] for tombstone in tombstones] == [storage_ids[1]]
+
+        purge_deleted()
+        assert test_app.mongo.db.deletions.count_documents({}) == 0
+        with pytest.raises(FileNotFoundError):
+            test_app.fs.get(storage_ids[1])
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.jpg',)], indirect=True)
+def test_sweep_storage(test_app, filestreams):
+    jpg_stream = filestreams[0]
+    old_date = datetime.utcnow() - timedelta(days=10)
+    old_dir = f'{old_date.year}/{old_date.month}/{old_date.day}'
+
+    with test_app.app_context():
+        orphan_id = test_app.fs.put(
+            jpg_stream, 'sample.jpg', asset_type='thumbnails', storage_id=f'{old_dir}/orphan/video.mp4'
+        )
+        # referenced by a project
+        test_app.mongo.db.projects.insert_one({'storage_id': f'{old_dir}/referenced/video.mp4'})
+        referenced_id = test_app.fs.put(
+            jpg_stream, 'sample.jpg', asset_type='thumbnails', storage_id=f'{old_dir}/referenced/video.mp4'
+        )
+        # too new to be removed
+        new_orphan_id = test_app.fs.put(jpg_stream, 'sample.jpg', project_id='new_orphan')
+
+        sweep_storage()
+
+        with pytest.raises(FileNotFoundError):
+            test_app.fs.get(orphan_id)
+        assert test_app.fs.get(referenced_id) == jpg_stream
+        assert test_app.fs.get(new_orphan_id) == jpg_stream
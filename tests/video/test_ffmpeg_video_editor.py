@@ -1,5 +1,10 @@
+import os
+import subprocess
+from unittest import mock
+
 import pytest
 
+from videoserver.lib.video_editor import KeyframeIndex
 from videoserver.lib.video_editor.ffmpeg import FFMPEGVideoEditor
 
 
@@ -23,6 +28,77 @@ def test_ffmpeg_video_editor_trim(test_app, filestreams):
         assert metadata['duration'] == 3.0
 
 
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
+def test_ffmpeg_video_editor_trim_copy(test_app, filestreams):
+    editor = FFMPEGVideoEditor()
+    mp4_stream = filestreams[0]
+
+    with test_app.app_context():
+        path, metadata = editor.edit_video(
+            stream_file=mp4_stream,
+            filename='test_ffmpeg_video_editor_sample.mp4',
+            trim={'start': 1, 'end': 9},
+            trim_mode='copy'
+        )
+        os.remove(path)
+
+    # sample has keyframes at 0, 8.4 and 12.96 seconds
+    assert metadata['trim'] == {'start': 0.0, 'end': 12.96}
+    assert metadata['codec_name'] == 'h264'
+    assert metadata['duration'] == pytest.approx(12.96, abs=0.2)
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
+def test_ffmpeg_video_editor_trim_smart(test_app, filestreams):
+    editor = FFMPEGVideoEditor()
+    mp4_stream = filestreams[0]
+
+    with test_app.app_context(), mock.patch.object(editor, '_run_ffmpeg', wraps=editor._run_ffmpeg) as run_ffmpeg:
+        path, metadata = editor.edit_video(
+            stream_file=mp4_stream,
+            filename='test_ffmpeg_video_editor_sample.mp4',
+            trim={'start': 5, 'end': 14},
+            trim_mode='smart'
+        )
+        os.remove(path)
+
+    # sample has keyframes at 0, 8.4 and 12.96 seconds: 5-8.4 and 12.96-14 are encoded, 8.4-12.96 is copied
+    encoded = [call for call in run_ffmpeg.call_args_list if 'libx264' in call.kwargs['options']]
+    assert [call.kwargs['preoptions'][-1] for call in encoded] == ['5', '12.96']
+    assert metadata['codec_name'] == 'h264'
+    # cut is exact
+    assert metadata['duration'] == 9.0
+    assert metadata['nb_frames'] == 9 * 25
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
+def test_ffmpeg_video_editor_trim_smart_fallback(test_app, filestreams):
+    editor = FFMPEGVideoEditor()
+    mp4_stream = filestreams[0]
+    run_ffmpeg = editor._run_ffmpeg
+
+    def _fail_copy(path_input, path_output, **kwargs):
+        if path_output.endswith('copy.h264'):
+            raise RuntimeError('copy has failed')
+        return run_ffmpeg(path_input, path_output, **kwargs)
+
+    # ffmpeg older than 5 has no `noise` bsf expressions, a failed step is not fatal too
+    for patch in (mock.patch.object(editor, '_get_ffmpeg_help', return_value=''),
+                  mock.patch.object(editor, '_run_ffmpeg', side_effect=_fail_copy)):
+        with test_app.app_context(), patch:
+            path, metadata = editor.edit_video(
+                stream_file=mp4_stream,
+                filename='test_ffmpeg_video_editor_sample.mp4',
+                trim={'start': 5, 'end': 14},
+                trim_mode='smart'
+            )
+            os.remove(path)
+
+        # video is trimmed by re-encoding
+        assert metadata['codec_name'] == 'h264'
+        assert metadata['duration'] == pytest.approx(9.0, abs=0.1)
+
+
 @pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
 def test_ffmpeg_video_editor_crop(test_app, filestreams):
     editor = FFMPEGVideoEditor()
@@ -58,6 +134,64 @@ def test_ffmpeg_video_editor_rotate(test_app, filestreams):
         assert metadata['height'] == 1280
 
 
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
+def test_ffmpeg_video_editor_rotate_display_matrix(test_app, filestreams, tmpdir):
+    editor = FFMPEGVideoEditor()
+    path = str(tmpdir.join('sample_0.mp4'))
+    with open(path, 'wb') as f:
+        f.write(filestreams[0])
+
+    def get_rotation(file_path):
+        stream = [s for s in editor._get_streams(file_path) if s['codec_type'] == 'video'][0]
+        return editor._get_rotation(stream)
+
+    with test_app.app_context(), mock.patch.object(editor, '_run_ffmpeg', wraps=editor._run_ffmpeg) as run_ffmpeg:
+        rotated_path, metadata = editor.edit_video(stream_file=path, filename='sample_0.mp4', rotate=90)
+        # video is copied, only its display matrix is set
+        assert run_ffmpeg.call_args.kwargs['options'][-2:] == ('-c', 'copy')
+        assert get_rotation(rotated_path) == -90
+        assert metadata['width'] == 720
+        assert metadata['height'] == 1280
+        assert metadata['nb_frames'] == 375
+
+        # rotation is added to a current one
+        path, metadata = editor.edit_video(stream_file=rotated_path, filename='sample_0.mp4', rotate=180)
+        os.remove(rotated_path)
+        assert get_rotation(path) == 90
+        assert metadata['width'] == 720
+
+        # rotate with a stream-copy trim
+        trimmed_path, metadata = editor.edit_video(
+            stream_file=path,
+            filename='sample_0.mp4',
+            trim={'start': 9, 'end': 11},
+            trim_mode='copy',
+            rotate=-90
+        )
+        os.remove(path)
+        assert get_rotation(trimmed_path) == -180
+        assert metadata['trim'] == {'start': 8.4, 'end': 12.96}
+        assert metadata['width'] == 1280
+        os.remove(trimmed_path)
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
+def test_ffmpeg_video_editor_rotate_metadata(test_app, filestreams, tmpdir):
+    editor = FFMPEGVideoEditor()
+    path = str(tmpdir.join('sample_0.mp4'))
+    with open(path, 'wb') as f:
+        f.write(filestreams[0])
+
+    # ffmpeg older than 6 has no `-display_rotation`, video is rotated by stream's metadata
+    with test_app.app_context(), mock.patch.object(editor, '_get_ffmpeg_help', return_value=''), \
+            mock.patch.object(editor, '_run_ffmpeg', wraps=editor._run_ffmpeg) as run_ffmpeg:
+        rotated_path, metadata = editor.edit_video(stream_file=path, filename='sample_0.mp4', rotate=90)
+        os.remove(rotated_path)
+
+    assert run_ffmpeg.call_args.kwargs['preoptions'] == ()
+    assert run_ffmpeg.call_args.kwargs['options'][-4:] == ('-metadata:s:v:0', 'rotate=90', '-c', 'copy')
+
+
 @pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
 def test_ffmpeg_video_editor_scale(test_app, filestreams):
     editor = FFMPEGVideoEditor()
@@ -74,6 +208,111 @@ def test_ffmpeg_video_editor_scale(test_app, filestreams):
         assert metadata['height'] == 720 / 2
 
 
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
+def test_ffmpeg_video_editor_copy_streams(test_app, filestreams, tmpdir):
+    editor = FFMPEGVideoEditor()
+    sample_path = tmpdir.join('sample_0.mp4')
+    sample_path.write_binary(filestreams[0])
+    subtitles_path = tmpdir.join('subtitles.srt')
+    subtitles_path.write('1\n00:00:01,000 --> 00:00:04,000\nHello\n')
+    # video with subtitles and a timecode data stream
+    video_path = str(tmpdir.join('sample_subtitles.mp4'))
+    subprocess.run(('ffmpeg', '-v', 'error', '-i', str(sample_path), '-i', str(subtitles_path),
+                    '-map', '0', '-map', '1', '-c', 'copy', '-c:s', 'mov_text', '-timecode', '00:00:00:00', video_path))
+
+    def get_streams(file_path):
+        return [(s['codec_type'], s.get('codec_name')) for s in editor._get_streams(file_path)]
+
+    def get_audio_md5(file_path):
+        return subprocess.run(('ffmpeg', '-v', 'error', '-i', file_path, '-map', '0:a', '-c', 'copy', '-f', 'md5', '-'),
+                              stdout=subprocess.PIPE).stdout
+
+    streams = get_streams(video_path)
+    assert streams == [('video', 'h264'), ('audio', 'aac'), ('subtitle', 'mov_text'), ('data', None)]
+    with test_app.app_context():
+        path, metadata = editor.edit_video(stream_file=video_path, filename='sample_subtitles.mp4', scale=640)
+        # audio is copied as is, subtitles are kept, timecode is written by a muxer
+        assert get_streams(path) == streams
+        assert get_audio_md5(path) == get_audio_md5(video_path)
+        assert metadata['width'] == 640
+        os.remove(path)
+
+        # audio is re-encoded if it's cut
+        path, metadata = editor.edit_video(
+            stream_file=video_path,
+            filename='sample_subtitles.mp4',
+            trim={'start': 2, 'end': 10},
+            scale=640
+        )
+        assert get_streams(path) == streams
+        assert get_audio_md5(path) != get_audio_md5(video_path)
+        assert metadata['duration'] == 8.0
+        os.remove(path)
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
+def test_ffmpeg_video_editor_encoder_profile(test_app, filestreams, tmpdir):
+    editor = FFMPEGVideoEditor()
+    sample_path = tmpdir.join('sample_0.mp4')
+    sample_path.write_binary(filestreams[0])
+    vp9_path = str(tmpdir.join('sample_0.webm'))
+    subprocess.run(('ffmpeg', '-v', 'error', '-i', str(sample_path), '-t', '3', '-vf', 'scale=640:-2',
+                    '-c:v', 'libvpx-vp9', '-deadline', 'realtime', '-cpu-used', '8', vp9_path))
+
+    with test_app.app_context(), mock.patch.object(editor, '_run_ffmpeg', wraps=editor._run_ffmpeg) as run_ffmpeg:
+        # codec is kept, encoder options of the codec are used
+        path, metadata = editor.edit_video(
+            stream_file=vp9_path, filename='sample_0.webm', scale=320, encoder_profile='fast'
+        )
+        os.remove(path)
+        options = run_ffmpeg.call_args.kwargs['options']
+        assert options[options.index('-c:v'):] == test_app.config['FFMPEG_ENCODER_PROFILES']['fast']['vp9']
+        assert metadata['codec_name'] == 'vp9'
+        assert metadata['width'] == 320
+
+        # default profile
+        path, metadata = editor.edit_video(stream_file=str(sample_path), filename='sample_0.mp4', scale=320)
+        os.remove(path)
+        options = run_ffmpeg.call_args.kwargs['options']
+        assert options[options.index('-c:v'):] == ('-c:v', 'libx264', '-preset', test_app.config['FFMPEG_PRESET'])
+        assert metadata['codec_name'] == 'h264'
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
+def test_ffmpeg_video_editor_segments(test_app, filestreams, tmpdir):
+    editor = FFMPEGVideoEditor()
+    video_path = str(tmpdir.join('sample_0.mp4'))
+    with open(video_path, 'wb') as f:
+        f.write(filestreams[0])
+
+    def get_audio_md5(file_path):
+        return subprocess.run(('ffmpeg', '-v', 'error', '-i', file_path, '-map', '0:a', '-c', 'copy', '-f', 'md5', '-'),
+                              stdout=subprocess.PIPE).stdout
+
+    with test_app.app_context():
+        # sample has keyframes at 0, 8.4 and 12.96 seconds
+        segments = [
+            editor.encode_segment(stream_file=video_path, filename='sample_0.mp4', start=start, end=end, scale=640)
+            for start, end in ((0, 8.4), (8.4, 12.96), (12.96, 15))
+        ]
+        path, metadata = editor.concat_segments(stream_file=video_path, filename='sample_0.mp4', segments=segments)
+        # all frames are joined, audio is copied
+        assert metadata['nb_frames'] == 15 * 25
+        assert metadata['duration'] == 15.0
+        assert metadata['width'] == 640
+        assert get_audio_md5(path) == get_audio_md5(video_path)
+        os.remove(path)
+
+        path, metadata = editor.concat_segments(
+            stream_file=video_path, filename='sample_0.mp4', segments=segments[1:], trim={'start': 8.4, 'end': 15}
+        )
+        assert metadata['nb_frames'] == (15 - 8.4) * 25
+        assert metadata['duration'] == pytest.approx(15 - 8.4)
+        os.remove(path)
+        for segment in segments:
+            os.remove(segment)
+
+
 @pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
 def test_ffmpeg_video_editor_all_methods(test_app, filestreams):
     editor = FFMPEGVideoEditor()
@@ -106,16 +345,97 @@ def test_ffmpeg_video_editor_capture_timeline_thumbnails(test_app, filestreams):
 
     with test_app.app_context():
         filename = 'test_ffmpeg_video_editor_sample.mp4'
-        thumbnails_generator = editor.capture_timeline_thumbnails(mp4_stream, filename, 15, 10)
+        with mock.patch('videoserver.lib.video_editor.ffmpeg.subprocess', wraps=subprocess) as mock_subprocess:
+            thumbnails = list(editor.capture_timeline_thumbnails(mp4_stream, filename, 15, 10))
+        # all thumbnails are captured by one ffmpeg process without ffprobe
+        assert mock_subprocess.run.call_count == 1
+        assert mock_subprocess.Popen.call_count == 0
 
-        for i, (thumbnail, meta) in enumerate(thumbnails_generator):
+        assert len(thumbnails) == 10
+        for i, (thumbnail, meta) in enumerate(thumbnails):
             assert thumbnail.__class__ is bytes
+            assert thumbnail.startswith(b'\x89PNG')
             assert meta['codec_name'] == 'png'
             assert meta['mimetype'] == 'image/png'
             assert meta['width'] == 89
             assert meta['height'] == 50
 
 
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
+def test_ffmpeg_video_editor_capture_timeline_thumbnails_missing(test_app, filestreams):
+    editor = FFMPEGVideoEditor()
+    mp4_stream = filestreams[0]
+    run = subprocess.run
+
+    def _run_lossy(cmd, *args, **kwargs):
+        # the first process fails after the third frame
+        if _run_lossy.calls == 0:
+            output_dir = os.path.dirname(cmd[-1])
+            proc = run(cmd, *args, **kwargs)
+            for name in os.listdir(output_dir):
+                if int(name.split('.')[0]) >= 3:
+                    os.remove(os.path.join(output_dir, name))
+            proc.returncode = 1
+        else:
+            proc = run(cmd, *args, **kwargs)
+        _run_lossy.calls += 1
+        return proc
+    _run_lossy.calls = 0
+
+    with test_app.app_context():
+        filename = 'test_ffmpeg_video_editor_sample.mp4'
+        with mock.patch('videoserver.lib.video_editor.ffmpeg.subprocess.run', side_effect=_run_lossy):
+            thumbnails = list(editor.capture_timeline_thumbnails(mp4_stream, filename, 15, 10))
+        decoded = list(editor.capture_timeline_thumbnails(mp4_stream, filename, 15, 10))
+
+        # missing frames are captured by seeking
+        assert _run_lossy.calls == 1 + 7
+        assert len(thumbnails) == 10
+        assert [meta for _, meta in thumbnails] == [meta for _, meta in decoded]
+
+        # frames which can't be captured are skipped
+        with mock.patch('videoserver.lib.video_editor.ffmpeg.subprocess.run',
+                        return_value=subprocess.CompletedProcess((), 1)):
+            assert list(editor.capture_timeline_thumbnails(mp4_stream, filename, 15, 10)) == []
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
+def test_ffmpeg_video_editor_capture_timeline_thumbnails_seek(test_app, filestreams):
+    editor = FFMPEGVideoEditor()
+    mp4_stream = filestreams[0]
+
+    with test_app.app_context():
+        filename = 'test_ffmpeg_video_editor_sample.mp4'
+        # seek to every thumbnail instead of decoding whole video
+        with mock.patch.object(FFMPEGVideoEditor, 'TIMELINE_SEEK_MIN_INTERVAL', 0):
+            thumbnails = list(editor.capture_timeline_thumbnails(mp4_stream, filename, 15, 3))
+        decoded = list(editor.capture_timeline_thumbnails(mp4_stream, filename, 15, 3))
+
+        assert len(thumbnails) == 3
+        assert [(meta['width'], meta['height']) for _, meta in thumbnails] == \
+            [(meta['width'], meta['height']) for _, meta in decoded]
+        assert len({thumbnail for thumbnail, _ in thumbnails}) == 3
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
+def test_ffmpeg_video_editor_capture_timeline_thumbnails_fast(test_app, filestreams):
+    editor = FFMPEGVideoEditor()
+    mp4_stream = filestreams[0]
+
+    with test_app.app_context():
+        filename = 'test_ffmpeg_video_editor_sample.mp4'
+        thumbnails = list(editor.capture_timeline_thumbnails(mp4_stream, filename, 15, 10, fast=True))
+
+        assert len(thumbnails) == 10
+        # sample has keyframes at 0, 8.4 and 12.96 seconds
+        assert len({thumbnail for thumbnail, _ in thumbnails}) == 3
+        assert thumbnails[0][0] != thumbnails[5][0] != thumbnails[-1][0]
+        for thumbnail, meta in thumbnails:
+            assert thumbnail.startswith(b'\x89PNG')
+            assert meta['width'] == 89
+            assert meta['height'] == 50
+
+
 @pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
 def test_ffmpeg_video_editor_capture_thumbnail(test_app, filestreams):
     editor = FFMPEGVideoEditor()
@@ -137,3 +457,90 @@ def test_ffmpeg_video_editor_capture_thumbnail(test_app, filestreams):
         assert meta['mimetype'] == 'image/png'
         assert meta['width'] == 360
         assert meta['height'] == 720
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
+def test_ffmpeg_video_editor_capture_thumbnail_exact_frame(test_app, filestreams, tmpdir):
+    editor = FFMPEGVideoEditor()
+    video_path = tmpdir.join('test_ffmpeg_video_editor_sample.mp4')
+    video_path.write_binary(filestreams[0])
+    output_path = str(tmpdir.join('frame.png'))
+
+    with test_app.app_context():
+        thumbnail, _ = editor.capture_thumbnail(
+            stream_file=str(video_path),
+            filename='test_ffmpeg_video_editor_sample.mp4',
+            duration=15,
+            position=11.3,
+        )
+        # the same frame as decoding from the start
+        subprocess.run(('ffmpeg', '-v', 'error', '-i', str(video_path), '-ss', '11.3', '-vframes', '1', output_path))
+        with open(output_path, 'rb') as f:
+            assert thumbnail == f.read()
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
+def test_ffmpeg_video_editor_local_path(test_app, filestreams, tmpdir):
+    editor = FFMPEGVideoEditor()
+    mp4_stream = filestreams[0]
+    video_path = tmpdir.join('test_ffmpeg_video_editor_sample.mp4')
+    video_path.write_binary(mp4_stream)
+
+    with test_app.app_context():
+        edited_path, metadata = editor.edit_video(
+            stream_file=str(video_path),
+            filename='test_ffmpeg_video_editor_sample.mp4',
+            trim={'start': 0, 'end': 3}
+        )
+        # edited file is created next to the original one, original is untouched
+        assert os.path.dirname(edited_path) == str(tmpdir)
+        assert metadata['duration'] == 3.0
+        assert video_path.read_binary() == mp4_stream
+
+        thumbnail, meta = editor.capture_thumbnail(
+            stream_file=str(video_path),
+            filename='test_ffmpeg_video_editor_sample.mp4',
+            duration=15,
+            position=5,
+        )
+        assert meta['width'] == 1280
+        # no tmp files are left next to the video
+        assert sorted(os.listdir(str(tmpdir))) == sorted([
+            'test_ffmpeg_video_editor_sample.mp4', os.path.basename(edited_path)
+        ])
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
+def test_ffmpeg_video_editor_keyframe_index(test_app, filestreams):
+    editor = FFMPEGVideoEditor()
+
+    with test_app.app_context():
+        keyframes = editor.get_keyframe_index(filestreams[0])
+
+    assert list(keyframes.pts) == [0.0, 8.4, 12.96]
+    assert list(keyframes.pos) == [48, 1945446, 2335660]
+    restored = KeyframeIndex.from_bytes(keyframes.to_bytes())
+    assert restored.pts == keyframes.pts
+    assert restored.pos == keyframes.pos
+    assert [keyframes.floor(t) for t in (0, 8.3, 8.4, 20)] == [0, 0, 1, 2]
+    assert [keyframes.nearest(t) for t in (4, 4.3, 11, 20)] == [0, 1, 2, 2]
+    assert keyframes.split(0, 15, 4) == [(0, 8.4), (8.4, 12.96), (12.96, 15)]
+    # the last part is too short
+    assert keyframes.split(2, 14, 4) == [(2, 8.4), (8.4, 14)]
+    assert keyframes.split(0, 15, 10) == [(0, 15)]
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
+def test_ffmpeg_video_editor_keyframe_index_start_time(test_app, filestreams, tmpdir):
+    editor = FFMPEGVideoEditor()
+    sample_path = tmpdir.join('sample_0.mp4')
+    sample_path.write_binary(filestreams[0])
+    # video starts at 10 seconds
+    video_path = str(tmpdir.join('sample_offset.mp4'))
+    subprocess.run(('ffmpeg', '-v', 'error', '-i', str(sample_path), '-an', '-c', 'copy', '-output_ts_offset', '10',
+                    video_path))
+
+    with test_app.app_context():
+        keyframes = editor.get_keyframe_index(video_path)
+
+    assert list(keyframes.pts) == [0.0, 8.4, 12.96]